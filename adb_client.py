@@ -0,0 +1,402 @@
+import logging
+import os
+import socket
+import stat
+import struct
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+SYNC_DATA_MAX = 64 * 1024 # sync协议单个DATA包的最大长度
+
+# 目录项/文件状态，size和mtime为精确值（字节/秒级时间戳）
+SyncEntry = namedtuple('SyncEntry', ['name', 'mode', 'size', 'mtime'])
+
+
+def parse_devices(text):
+    """解析 host:devices 格式的设备列表，返回 [(serial, state), ...]"""
+    result = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            result.append((parts[0], parts[1]))
+    return result
+
+
+class AdbError(RuntimeError):
+    """ADB服务端返回错误"""
+
+
+class AdbServerUnavailable(AdbError):
+    """无法连接本地adb server"""
+
+
+class AdbConnectionClosed(AdbError):
+    """连接被adb server关闭"""
+
+
+class AdbConnection:
+    """与adb server之间的一条socket连接"""
+
+    def __init__(self, host, port, timeout):
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise AdbServerUnavailable(f"无法连接adb server {host}:{port}: {e}") from e
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_request(self, request):
+        """发送host请求并等待OKAY"""
+        payload = request.encode('utf-8')
+        self.sock.sendall(b'%04x' % len(payload) + payload)
+        self.read_status()
+
+    def read_status(self):
+        status = self.read_exact(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbError(self.read_hex_block().decode('utf-8', errors='ignore'))
+        raise AdbError(f"未知的adb响应: {status!r}")
+
+    def read_hex_block(self):
+        """读取4位十六进制长度前缀的数据块"""
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length)
+
+    def read_exact(self, size):
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise AdbConnectionClosed("adb连接被关闭")
+            buf += chunk
+        return bytes(buf)
+
+    def read_stream(self, chunk_size=SYNC_DATA_MAX):
+        """读取原始输出直到连接关闭"""
+        while True:
+            chunk = self.sock.recv(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class SyncConnection:
+    """已进入sync模式的设备连接，可顺序执行多次LIST/STAT/RECV/SEND"""
+
+    def __init__(self, conn, device_id, features):
+        self.conn = conn
+        self.device_id = device_id
+        self.stat_v2 = 'stat_v2' in features
+        self.ls_v2 = 'ls_v2' in features
+
+    def _send(self, command_id, data=b''):
+        self.conn.sock.sendall(command_id + struct.pack('<I', len(data)) + data)
+
+    def _read_fail(self, length):
+        message = self.conn.read_exact(length).decode('utf-8', errors='ignore')
+        raise AdbError(message)
+
+    def stat(self, remote_path):
+        """获取文件状态，文件不存在时返回None"""
+        self._send(b'STA2' if self.stat_v2 else b'STAT', remote_path.encode('utf-8'))
+        return self._read_stat(remote_path)
+
+    def stat_many(self, remote_paths):
+        """先发送全部STAT请求再依次读取结果，多个文件只需一次往返"""
+        command_id = b'STA2' if self.stat_v2 else b'STAT'
+        paths = [remote_path.encode('utf-8') for remote_path in remote_paths]
+        self.conn.sock.sendall(b''.join(command_id + struct.pack('<I', len(path)) + path for path in paths))
+        return [self._read_stat(remote_path) for remote_path in remote_paths]
+
+    def _read_stat(self, remote_path):
+        if self.stat_v2:
+            header = self.conn.read_exact(72)
+            (error, _dev, _ino, mode, _nlink, _uid, _gid, size,
+             _atime, mtime, _ctime) = struct.unpack('<IQQIIIIQqqq', header[4:])
+            if error:
+                return None
+        else:
+            mode, size, mtime = struct.unpack('<III', self.conn.read_exact(16)[4:])
+            if mode == 0:
+                return None
+        return SyncEntry(os.path.basename(remote_path.rstrip('/')), mode, size, mtime)
+
+    def list(self, remote_path):
+        """列出目录内容（不含 . 和 ..）"""
+        path = remote_path.encode('utf-8')
+        entries = []
+        if self.ls_v2:
+            self._send(b'LIS2', path)
+            while True:
+                header = self.conn.read_exact(76)
+                if header[:4] == b'DONE':
+                    return entries
+                (error, _dev, _ino, mode, _nlink, _uid, _gid, size,
+                 _atime, mtime, _ctime, namelen) = struct.unpack('<IQQIIIIQqqqI', header[4:])
+                name = self.conn.read_exact(namelen).decode('utf-8', errors='ignore')
+                if not error and name not in ('.', '..'):
+                    entries.append(SyncEntry(name, mode, size, mtime))
+        else:
+            self._send(b'LIST', path)
+            while True:
+                header = self.conn.read_exact(20)
+                if header[:4] == b'DONE':
+                    return entries
+                mode, size, mtime, namelen = struct.unpack('<IIII', header[4:])
+                name = self.conn.read_exact(namelen).decode('utf-8', errors='ignore')
+                if name not in ('.', '..'):
+                    entries.append(SyncEntry(name, mode, size, mtime))
+
+    def recv(self, remote_path):
+        """流式读取设备文件，逐块返回数据"""
+        self._send(b'RECV', remote_path.encode('utf-8'))
+        while True:
+            command_id, length = struct.unpack('<4sI', self.conn.read_exact(8))
+            if command_id == b'DATA':
+                yield self.conn.read_exact(length)
+            elif command_id == b'DONE':
+                return
+            elif command_id == b'FAIL':
+                self._read_fail(length)
+            else:
+                raise AdbError(f"未知的sync响应: {command_id!r}")
+
+    def send(self, chunks, remote_path, mode=0o644, mtime=0):
+        """把数据块流式写入设备文件"""
+        self._send(b'SEND', f"{remote_path},{stat.S_IFREG | mode}".encode('utf-8'))
+        for chunk in chunks:
+            view = memoryview(chunk)
+            for offset in range(0, len(view), SYNC_DATA_MAX):
+                self._send(b'DATA', view[offset:offset + SYNC_DATA_MAX])
+        self.conn.sock.sendall(b'DONE' + struct.pack('<I', int(mtime)))
+        command_id, length = struct.unpack('<4sI', self.conn.read_exact(8))
+        if command_id == b'FAIL':
+            self._read_fail(length)
+        if command_id != b'OKAY':
+            raise AdbError(f"未知的sync响应: {command_id!r}")
+
+    def quit(self):
+        try:
+            self._send(b'QUIT')
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class AdbClient:
+    """
+    直接通过adb server的socket协议访问设备
+    sync连接按设备缓存复用，避免每次请求都重新建立传输通道
+    """
+
+    def __init__(self, host='127.0.0.1', port=5037, timeout=10, max_idle_per_device=4):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle_per_device = max_idle_per_device
+        self._lock = threading.Lock()
+        self._idle_sync = {}
+        self._features = {}
+
+    def _connect(self):
+        return AdbConnection(self.host, self.port, self.timeout)
+
+    def host_request(self, request):
+        """执行一次host请求并返回响应数据"""
+        conn = self._connect()
+        try:
+            conn.send_request(request)
+            return conn.read_hex_block().decode('utf-8', errors='ignore')
+        finally:
+            conn.close()
+
+    def devices(self):
+        """返回 [(serial, state), ...]"""
+        return parse_devices(self.host_request('host:devices'))
+
+    def track_devices(self):
+        """
+        保持一条 host:track-devices 连接，每当设备列表变化时返回完整的 [(serial, state), ...]
+        连接建立后立即返回一次当前列表；adb server退出时迭代结束
+        """
+        conn = self._connect()
+        try:
+            conn.send_request('host:track-devices')
+            # 设备列表可能长时间不变，读取时不设超时
+            conn.sock.settimeout(None)
+            while True:
+                yield parse_devices(conn.read_hex_block().decode('utf-8', errors='ignore'))
+        except AdbConnectionClosed:
+            return
+        finally:
+            conn.close()
+
+    def features(self, device_id):
+        """获取设备支持的特性（stat_v2、ls_v2等），结果按设备缓存"""
+        features = self._features.get(device_id)
+        if features is None:
+            try:
+                features = set(self.host_request(f'host-serial:{device_id}:features').split(','))
+            except AdbServerUnavailable:
+                raise
+            except AdbError:
+                return set()
+            self._features[device_id] = features
+        return features
+
+    def transport(self, device_id):
+        """建立到指定设备的传输连接"""
+        conn = self._connect()
+        try:
+            conn.send_request(f'host:transport:{device_id}')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def open_service(self, device_id, service):
+        """在设备上打开一个服务（shell:、exec:等）"""
+        conn = self.transport(device_id)
+        try:
+            conn.send_request(service)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def exec_out(self, device_id, command, chunk_size=SYNC_DATA_MAX):
+        """执行命令并流式返回原始标准输出（等同 adb exec-out）"""
+        conn = self.open_service(device_id, f'exec:{command}')
+        # 命令可能长时间没有输出（大的content query、find、慢设备上的screencap），读取时不设超时
+        conn.sock.settimeout(None)
+        try:
+            yield from conn.read_stream(chunk_size)
+        except OSError as e:
+            raise AdbError(f"exec连接失败: {e}") from e
+        finally:
+            conn.close()
+
+    def _acquire_sync(self, device_id):
+        with self._lock:
+            idle = self._idle_sync.get(device_id)
+            if idle:
+                return idle.pop()
+        features = self.features(device_id)
+        conn = self.transport(device_id)
+        try:
+            conn.send_request('sync:')
+        except Exception:
+            conn.close()
+            raise
+        return SyncConnection(conn, device_id, features)
+
+    def _release_sync(self, sync):
+        with self._lock:
+            idle = self._idle_sync.setdefault(sync.device_id, [])
+            if len(idle) < self.max_idle_per_device:
+                idle.append(sync)
+                return
+        sync.quit()
+
+    def _sync_call(self, device_id, method, *args):
+        """在复用的sync连接上执行一次请求，缓存连接失效时重建后重试"""
+        for attempt in range(2):
+            sync = self._acquire_sync(device_id)
+            try:
+                result = getattr(sync, method)(*args)
+            except (AdbConnectionClosed, OSError) as e:
+                # 缓存的连接可能已被server关闭（设备重新插拔等），重建一次
+                sync.conn.close()
+                if attempt:
+                    raise AdbError(f"sync连接失败: {e}") from e
+                continue
+            except Exception:
+                sync.conn.close()
+                raise
+            self._release_sync(sync)
+            return result
+
+    def stat(self, device_id, remote_path):
+        return self._sync_call(device_id, 'stat', remote_path)
+
+    def stat_many(self, device_id, remote_paths):
+        return self._sync_call(device_id, 'stat_many', remote_paths)
+
+    def list_dir(self, device_id, remote_path):
+        return self._sync_call(device_id, 'list', remote_path)
+
+    def pull_stream(self, device_id, remote_path):
+        """流式拉取文件；中途停止迭代时连接会被关闭而不是放回池中"""
+        sync = self._acquire_sync(device_id)
+        completed = False
+        try:
+            yield from sync.recv(remote_path)
+            completed = True
+        except OSError as e:
+            raise AdbError(f"sync连接失败: {e}") from e
+        finally:
+            if completed:
+                self._release_sync(sync)
+            else:
+                sync.conn.close()
+
+    def pull(self, device_id, remote_path, local_path):
+        """拉取文件到本地，返回写入的字节数"""
+        written = 0
+        try:
+            with open(local_path, 'wb') as f:
+                for chunk in self.pull_stream(device_id, remote_path):
+                    f.write(chunk)
+                    written += len(chunk)
+        except Exception:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            raise
+        return written
+
+    def push_stream(self, device_id, chunks, remote_path, mode=0o644, mtime=0):
+        """把数据块流式写入设备文件"""
+        sync = self._acquire_sync(device_id)
+        try:
+            sync.send(chunks, remote_path, mode, mtime)
+        except OSError as e:
+            sync.conn.close()
+            raise AdbError(f"sync连接失败: {e}") from e
+        except Exception:
+            sync.conn.close()
+            raise
+        self._release_sync(sync)
+
+    def push(self, device_id, local_path, remote_path):
+        """推送本地文件到设备"""
+        st = os.stat(local_path)
+        with open(local_path, 'rb') as f:
+            chunks = iter(lambda: f.read(SYNC_DATA_MAX), b'')
+            self.push_stream(device_id, chunks, remote_path, stat.S_IMODE(st.st_mode), st.st_mtime)
+        return st.st_size
+
+    def forget_device(self, device_id):
+        """设备断开后丢弃其特性缓存和sync连接"""
+        with self._lock:
+            self._features.pop(device_id, None)
+            idle = self._idle_sync.pop(device_id, [])
+        for sync in idle:
+            sync.conn.close()
+
+    def close_all(self):
+        """关闭所有缓存的sync连接"""
+        with self._lock:
+            pools = list(self._idle_sync.values())
+            self._idle_sync.clear()
+        for idle in pools:
+            for sync in idle:
+                sync.quit()
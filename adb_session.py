@@ -0,0 +1,213 @@
+import logging
+import queue
+import subprocess
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class AdbSessionError(RuntimeError):
+    """ADB会话异常（会话断开、设备掉线等）"""
+
+
+class AdbSessionUnavailable(AdbSessionError):
+    """命令写入之前会话已经断开，命令没有执行，可以换一个会话重试"""
+
+
+class AdbShellSession:
+    """
+    单个常驻的 adb shell 会话
+    每条命令的输出以哨兵行结尾，借此在同一个进程上顺序执行多条命令
+    """
+
+    def __init__(self, adb_bin, device_id):
+        self.device_id = device_id
+        self._marker = f"__AFS_{uuid.uuid4().hex}__"
+        self._stdout_lines = queue.Queue()
+        self._stderr_lines = queue.Queue()
+        self._merged_stderr = False
+        self._proc = subprocess.Popen(
+            [adb_bin, '-s', device_id, 'shell'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        for stream, target in ((self._proc.stdout, self._stdout_lines), (self._proc.stderr, self._stderr_lines)):
+            threading.Thread(target=self._drain, args=(stream, target), daemon=True).start()
+
+    @staticmethod
+    def _drain(stream, target):
+        """后台读取输出流，EOF时放入None"""
+        try:
+            for line in iter(stream.readline, b''):
+                target.put(line.decode('utf-8', errors='ignore'))
+        except (OSError, ValueError):
+            pass
+        target.put(None)
+
+    @property
+    def alive(self):
+        return self._proc.poll() is None
+
+    def run(self, shell_command, timeout):
+        """执行一条shell命令，返回 (returncode, stdout, stderr)"""
+        if not self.alive:
+            raise AdbSessionUnavailable(f"ADB会话已断开: {self.device_id}")
+
+        framed = (
+            f"( {shell_command} ) </dev/null; "
+            f"printf '\\n%s %d\\n' {self._marker} $?; "
+            f"printf '%s\\n' {self._marker} >&2\n"
+        )
+        try:
+            self._proc.stdin.write(framed.encode('utf-8'))
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise AdbSessionUnavailable(f"ADB会话写入失败: {e}") from e
+
+        deadline = time.monotonic() + timeout
+        stdout_parts = []
+        returncode = None
+        while returncode is None:
+            line = self._next_line(self._stdout_lines, deadline)
+            stripped = line.rstrip('\r\n')
+            if stripped == self._marker:
+                # 老设备不区分stderr，哨兵会出现在stdout中
+                self._merged_stderr = True
+                continue
+            if stripped.startswith(self._marker + ' '):
+                returncode = int(stripped[len(self._marker) + 1:])
+            else:
+                stdout_parts.append(line)
+
+        stderr_parts = []
+        if not self._merged_stderr:
+            while True:
+                line = self._next_line(self._stderr_lines, deadline)
+                if line.rstrip('\r\n') == self._marker:
+                    break
+                stderr_parts.append(line)
+
+        # 去掉哨兵前补充的换行
+        stdout = ''.join(stdout_parts)
+        if stdout.endswith('\r\n'):
+            stdout = stdout[:-2]
+        elif stdout.endswith('\n'):
+            stdout = stdout[:-1]
+        return returncode, stdout, ''.join(stderr_parts)
+
+    def _next_line(self, lines, deadline):
+        remaining = deadline - time.monotonic()
+        try:
+            line = lines.get(timeout=max(remaining, 0))
+        except queue.Empty:
+            self.close()
+            raise TimeoutError("ADB会话命令超时")
+        if line is None:
+            self.close()
+            stderr = ''.join(self._pending(self._stderr_lines)).strip()
+            raise AdbSessionError(f"ADB会话已断开: {stderr or self.device_id}")
+        return line
+
+    @staticmethod
+    def _pending(lines):
+        result = []
+        while True:
+            try:
+                line = lines.get_nowait()
+            except queue.Empty:
+                return result
+            if line is not None:
+                result.append(line)
+
+    def close(self):
+        """关闭会话进程"""
+        if self._proc.poll() is None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc.kill()
+            try:
+                self._proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class AdbSessionPool:
+    """按设备维护若干常驻shell会话，并在会话间复用命令"""
+
+    def __init__(self, adb_bin='adb', sessions_per_device=2):
+        self.adb_bin = adb_bin
+        self.sessions_per_device = sessions_per_device
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._open = {}
+
+    def _acquire(self, device_id):
+        with self._lock:
+            while True:
+                idle = self._idle.setdefault(device_id, [])
+                while idle:
+                    session = idle.pop()
+                    if session.alive:
+                        return session
+                    self._open[device_id] -= 1
+                if self._open.get(device_id, 0) < self.sessions_per_device:
+                    self._open[device_id] = self._open.get(device_id, 0) + 1
+                    break
+                self._lock.wait()
+
+        try:
+            logger.info(f"建立ADB会话: {device_id}")
+            return AdbShellSession(self.adb_bin, device_id)
+        except OSError:
+            self._discard(device_id)
+            raise
+
+    def _release(self, session):
+        with self._lock:
+            if session.alive:
+                self._idle.setdefault(session.device_id, []).append(session)
+            else:
+                self._open[session.device_id] -= 1
+            self._lock.notify()
+
+    def _discard(self, device_id):
+        with self._lock:
+            self._open[device_id] -= 1
+            self._lock.notify()
+
+    def run(self, device_id, shell_command, timeout):
+        """
+        在设备会话上执行shell命令，命令写入前会话已断开时自动重连重试一次
+        命令写入之后的断开直接抛出：命令可能已经执行，重试会让mv/rm等非幂等命令执行两次
+        """
+        for attempt in range(2):
+            session = self._acquire(device_id)
+            try:
+                return session.run(shell_command, timeout)
+            except AdbSessionUnavailable as e:
+                if attempt:
+                    raise
+                logger.warning(f"ADB会话断开，正在重连: {e}")
+            finally:
+                self._release(session)
+
+    def close_device(self, device_id):
+        """关闭某台设备的全部空闲会话"""
+        with self._lock:
+            sessions = self._idle.pop(device_id, [])
+            self._open[device_id] = self._open.get(device_id, 0) - len(sessions)
+        for session in sessions:
+            session.close()
+
+    def close_all(self):
+        """关闭全部会话"""
+        with self._lock:
+            device_ids = list(self._idle)
+        for device_id in device_ids:
+            self.close_device(device_id)
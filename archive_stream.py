@@ -0,0 +1,160 @@
+import logging
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# name为归档内的相对路径，目录条目不带结尾的 /
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'remote_path', 'size', 'mtime', 'is_dir'])
+
+ARCHIVE_MIME_TYPES = {'tar': 'application/x-tar', 'zip': 'application/zip'}
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close:
+        close()
+
+
+def iter_file_contents(entries, open_entry, workers=1, prefetch_max_bytes=0):
+    """
+    按顺序返回 (条目, 数据块迭代器)
+    workers大于1时，后续不超过prefetch_max_bytes的小文件由线程池提前并行拉取到内存，
+    大文件仍按顺序流式读取，内存占用不超过 workers * prefetch_max_bytes
+    """
+    if workers <= 1:
+        for entry in entries:
+            yield entry, (() if entry.is_dir else open_entry(entry))
+        return
+
+    def fetch(entry):
+        return b''.join(open_entry(entry))
+
+    executor = ThreadPoolExecutor(workers, thread_name_prefix='archive-fetch')
+    pending = {}
+    ahead = 0
+    try:
+        for index, entry in enumerate(entries):
+            ahead = max(ahead, index + 1)
+            while ahead < len(entries) and ahead - index <= workers:
+                candidate = entries[ahead]
+                if not candidate.is_dir and candidate.size <= prefetch_max_bytes:
+                    pending[ahead] = executor.submit(fetch, candidate)
+                ahead += 1
+
+            if entry.is_dir:
+                yield entry, ()
+            elif index in pending:
+                yield entry, (pending.pop(index).result(),)
+            else:
+                yield entry, open_entry(entry)
+    finally:
+        for future in pending.values():
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_tar(files):
+    """把 (条目, 数据块) 流式打包为tar（PAX格式，支持长文件名和超过8GB的文件）"""
+    written = 0
+    for entry, chunks in files:
+        info = tarfile.TarInfo(entry.name)
+        info.mtime = entry.mtime
+        if entry.is_dir:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            info.size = entry.size
+            info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        written += len(header)
+        yield header
+        if entry.is_dir:
+            continue
+
+        # tar头中的大小已经确定，文件在打包期间变化时截断或补零
+        remaining = entry.size
+        try:
+            for chunk in chunks:
+                if len(chunk) > remaining:
+                    chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                if chunk:
+                    yield chunk
+                if not remaining:
+                    break
+        finally:
+            _close(chunks)
+        if remaining:
+            logger.warning(f"打包期间文件变小，已补零: {entry.remote_path}")
+            yield bytes(remaining)
+        padding = -entry.size % tarfile.BLOCKSIZE
+        written += entry.size + padding
+        if padding:
+            yield bytes(padding)
+
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % tarfile.RECORDSIZE
+    yield bytes(end)
+
+
+class _ZipSink:
+    """zipfile写入目标：不可seek，写入的数据由生成器取走"""
+
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _zip_date_time(mtime):
+    date_time = time.localtime(mtime)[:6]
+    return date_time if date_time[0] >= 1980 else (1980, 1, 1, 0, 0, 0)
+
+
+def iter_zip(files):
+    """把 (条目, 数据块) 流式打包为zip（不压缩，大小和CRC写在数据描述符中）"""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for entry, chunks in files:
+            if entry.is_dir:
+                info = zipfile.ZipInfo(entry.name + '/', _zip_date_time(entry.mtime))
+                info.external_attr = (0o40755 << 16) | 0x10
+                archive.writestr(info, b'')
+            else:
+                info = zipfile.ZipInfo(entry.name, _zip_date_time(entry.mtime))
+                info.external_attr = 0o644 << 16
+                try:
+                    with archive.open(info, 'w', force_zip64=True) as dest:
+                        for chunk in chunks:
+                            dest.write(chunk)
+                            data = sink.drain()
+                            if data:
+                                yield data
+                finally:
+                    _close(chunks)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def iter_archive(archive_format, files):
+    if archive_format == 'tar':
+        return iter_tar(files)
+    if archive_format == 'zip':
+        return iter_zip(files)
+    raise ValueError(f"不支持的归档格式: {archive_format}")
@@ -0,0 +1,138 @@
+import posixpath
+import shlex
+
+RESULT_MARKER = '__AFS_OP__'
+
+OPERATIONS = ('delete', 'move', 'copy', 'rename', 'mkdir')
+
+# 不允许删除或移动的目录
+PROTECTED_PATHS = {'/', '/sdcard', '/storage', '/storage/emulated', '/storage/emulated/0', '/storage/self/primary'}
+
+
+class BatchOperationError(ValueError):
+    """批量操作参数不合法"""
+
+
+def _clean_path(value, field):
+    if not isinstance(value, str) or not value.startswith('/') or '\n' in value or '\0' in value:
+        raise BatchOperationError(f"{field} 必须是设备上的绝对路径")
+    return posixpath.normpath(value)
+
+
+def normalize_operation(operation):
+    """校验单个操作，返回 {op, src, dst, recursive}，src/dst 为规范化后的路径"""
+    if not isinstance(operation, dict):
+        raise BatchOperationError("操作必须是对象")
+    op = operation.get('op')
+    if op not in OPERATIONS:
+        raise BatchOperationError(f"不支持的操作: {op}")
+
+    if op in ('delete', 'mkdir'):
+        src, dst = _clean_path(operation.get('path'), 'path'), None
+    elif op == 'rename':
+        src = _clean_path(operation.get('path'), 'path')
+        name = operation.get('name')
+        if not isinstance(name, str) or not name or '/' in name or name in ('.', '..') or '\n' in name or '\0' in name:
+            raise BatchOperationError("name 不合法")
+        dst = posixpath.join(posixpath.dirname(src), name)
+    else:
+        src, dst = _clean_path(operation.get('src'), 'src'), _clean_path(operation.get('dst'), 'dst')
+        if dst == src or dst.startswith(src + '/'):
+            raise BatchOperationError(f"不能{op}到自身或其子目录: {src}")
+
+    if op in ('delete', 'move', 'rename') and src in PROTECTED_PATHS:
+        raise BatchOperationError(f"不允许操作受保护的目录: {src}")
+    return {'op': op, 'src': src, 'dst': dst, 'recursive': bool(operation.get('recursive'))}
+
+
+def _operation_command(operation):
+    src = shlex.quote(operation['src'])
+    op = operation['op']
+    if op == 'delete':
+        return f"rm {'-r ' if operation['recursive'] else ''}-- {src}"
+    if op == 'mkdir':
+        return f"mkdir -p -- {src}"
+    dst = shlex.quote(operation['dst'])
+    command = f"cp -r -- {src} {dst}" if op == 'copy' else f"mv -- {src} {dst}"
+    # 不覆盖已存在的目标
+    return f"if [ -e {dst} ]; then echo 'target exists' >&2; false; else {command}; fi"
+
+
+def compile_batch(operations):
+    """
+    把操作列表编译为一个shell脚本，每个操作执行后输出一行
+    "<标记> <序号> <退出码> <错误信息>"，前一个操作失败不影响后续操作
+    """
+    lines = []
+    for index, operation in enumerate(operations):
+        lines.append(
+            f"out=$( {{ {_operation_command(operation)}; }} 2>&1 ); rc=$?; "
+            f"printf '%s %d %d %s\\n' {RESULT_MARKER} {index} $rc \"$(printf '%s' \"$out\" | tr '\\n' ' ')\""
+        )
+    return '\n'.join(lines)
+
+
+def parse_batch_results(output, operations):
+    """解析脚本输出，返回每个操作的结果；没有输出结果行的操作视为未执行"""
+    results = [
+        {'index': index, 'op': operation['op'], 'path': operation['src'], 'dst': operation['dst'],
+         'ok': False, 'error': 'not executed'}
+        for index, operation in enumerate(operations)
+    ]
+    for line in output.splitlines():
+        if not line.startswith(RESULT_MARKER + ' '):
+            continue
+        parts = line.split(' ', 3)
+        try:
+            index, returncode = int(parts[1]), int(parts[2])
+        except (IndexError, ValueError):
+            continue
+        if 0 <= index < len(results):
+            message = parts[3].strip() if len(parts) > 3 else ''
+            results[index]['ok'] = returncode == 0
+            results[index]['error'] = None if returncode == 0 else (message or f'exit code {returncode}')
+    return results
+
+
+def scan_targets(paths):
+    """
+    合并需要扫描的路径：同一目录下有多个路径时改为扫描该目录，
+    并去掉已被其他扫描目标包含的路径
+    """
+    by_parent = {}
+    for path in set(paths):
+        by_parent.setdefault(posixpath.dirname(path), []).append(path)
+    candidates = []
+    for parent, children in by_parent.items():
+        candidates.extend([parent] if len(children) > 1 else children)
+
+    result = []
+    for path in sorted(candidates):
+        if not any(path == parent or path.startswith(parent.rstrip('/') + '/') for parent in result):
+            result.append(path)
+    return result
+
+
+def _sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def media_scan_script(removed_paths, added_paths, files_uri):
+    """
+    生成批量更新MediaStore的脚本：被删除/移走的路径（含其子路径）用一条 content delete 移除，
+    新增的路径合并后广播扫描（目录扫描会递归处理其中的文件）
+    """
+    commands = []
+    if removed_paths:
+        conditions = ' OR '.join(
+            f"_data={_sql_literal(path)} OR substr(_data, 1, {len(path) + 1})={_sql_literal(path + '/')}"
+            for path in removed_paths
+        )
+        commands.append(f"content delete --uri {files_uri} --where {shlex.quote(conditions)}")
+    for target in scan_targets(added_paths):
+        commands.append(
+            "am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE "
+            f"-d {shlex.quote('file://' + target)}"
+        )
+    # MediaStore更新失败不影响文件操作本身的结果
+    return '; '.join(f"{command} >/dev/null 2>&1 || true" for command in commands)
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TOUCH_INTERVAL = 60 # 命中时最多每隔多少秒更新一次访问时间，减少索引写入
+
+
+class ContentCache:
+    """
+    按内容寻址的派生文件缓存（缩略图、HLS分段等由设备文件生成的文件）
+    key由 (设备序列号, 远程完整路径, 大小, 修改时间, 生成参数) 计算，源文件修改后自动失效
+    元数据保存在SQLite索引中，启动时无需扫描缓存目录；超出容量时按LRU淘汰
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(cache_dir, 'tmp')
+        # 上次运行残留的临时文件直接清理
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, file TEXT, device_id TEXT, remote_path TEXT, '
+            'size INTEGER, last_access REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)')
+        self._db.commit()
+        self.total_bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(device_id, remote_path, size, mtime, params):
+        """计算缓存key"""
+        raw = '\0'.join([device_id, remote_path, str(size), str(mtime), params])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key, record_stats=True):
+        """命中返回缓存文件路径，否则返回None"""
+        with self._lock:
+            row = self._db.execute('SELECT file, last_access FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                if record_stats:
+                    self.misses += 1
+                return None
+            path = os.path.join(self.cache_dir, row[0])
+            if not os.path.exists(path):
+                # 文件被外部删除，修正索引
+                self._remove(key)
+                self._db.commit()
+                if record_stats:
+                    self.misses += 1
+                return None
+            now = time.time()
+            if now - row[1] > TOUCH_INTERVAL:
+                self._db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+                self._db.commit()
+            if record_stats:
+                self.hits += 1
+        return path
+
+    def new_temp_path(self, ext='.jpg'):
+        """生成临时文件路径，写入完成后通过put原子移动到缓存"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex + ext)
+
+    def put(self, key, temp_path, device_id, remote_path):
+        """把已生成的临时文件放入缓存，返回最终路径"""
+        file = os.path.join(key[:2], key + os.path.splitext(temp_path)[1])
+        path = os.path.join(self.cache_dir, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            old = self._db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (key, file, device_id, remote_path, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, file, device_id, remote_path, size, time.time())
+            )
+            self.total_bytes += size
+            self._evict(protect=key)
+            self._db.commit()
+        return path
+
+    def _remove(self, key):
+        row = self._db.execute('SELECT file, size FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        self.total_bytes -= row[1]
+        self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        try:
+            os.remove(os.path.join(self.cache_dir, row[0]))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, protect):
+        """超出容量时按最久未访问淘汰"""
+        while self.total_bytes > self.max_bytes:
+            rows = self._db.execute(
+                'SELECT key FROM entries WHERE key != ? ORDER BY last_access LIMIT 64', (protect,)
+            ).fetchall()
+            if not rows:
+                return
+            for (key,) in rows:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                self._remove(key)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            return {
+                'entries': count,
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
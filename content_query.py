@@ -0,0 +1,103 @@
+import codecs
+
+ROW_PREFIX = 'Row: '
+QUERY_END_MARKER = '__AFS_QUERY_END__'
+
+
+class ContentQueryError(RuntimeError):
+    """content query 执行失败或输出不完整"""
+
+
+class ContentRow:
+    """content query 的一行结果，值按列顺序保存，多行共享同一个列位置表"""
+
+    __slots__ = ('positions', 'values')
+
+    def __init__(self, positions, values):
+        self.positions = positions
+        self.values = values
+
+    def get(self, column, default=None):
+        index = self.positions.get(column)
+        if index is None:
+            return default
+        value = self.values[index]
+        return default if value is None else value
+
+    def as_dict(self):
+        return {column: self.values[index] for column, index in self.positions.items()}
+
+
+def iter_lines(chunks, encoding='utf-8'):
+    """把字节流增量解码为文本行"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending.rstrip('\r')
+
+
+def parse_row(line, columns, separators=None):
+    """
+    按投影列顺序解析一行 "Row: N col1=v1, col2=v2, ..."
+    只在下一个已知列名处切分，值中包含逗号也能正确解析；NULL转换为None
+    """
+    if separators is None:
+        separators = [f', {column}=' for column in columns[1:]]
+    start = line.find(' ', len(ROW_PREFIX)) + 1
+    if not start or not line.startswith(columns[0] + '=', start):
+        return None
+    values = []
+    position = start + len(columns[0]) + 1
+    for separator in separators:
+        end = line.find(separator, position)
+        if end < 0:
+            return None
+        value = line[position:end]
+        values.append(None if value == 'NULL' else value)
+        position = end + len(separator)
+    value = line[position:]
+    values.append(None if value == 'NULL' else value)
+    return values
+
+
+def iter_content_rows(lines, columns, end_marker=None):
+    """
+    流式解析 content query 输出，逐行返回值列表
+    值中包含换行时会被拆成多行输出，续行拼接回上一行后再解析
+    :param end_marker: 命令末尾输出的 "<标记> <退出码>"，指定时缺少标记或退出码非0会抛出 ContentQueryError
+    """
+    separators = [f', {column}=' for column in columns[1:]]
+    pending = None
+    messages = []
+    finished = end_marker is None
+    for line in lines:
+        if end_marker is not None and line.startswith(end_marker):
+            returncode = line[len(end_marker):].strip()
+            if returncode != '0':
+                raise ContentQueryError(f"content query 失败(退出码 {returncode}): {' '.join(messages)[:500]}")
+            finished = True
+            break
+        if line.startswith(ROW_PREFIX):
+            if pending is not None:
+                values = parse_row(pending, columns, separators)
+                if values is not None:
+                    yield values
+            pending = line
+        elif pending is not None:
+            pending += '\n' + line
+        elif line:
+            messages.append(line)
+
+    if not finished:
+        raise ContentQueryError("content query 输出不完整")
+    if pending is not None:
+        values = parse_row(pending, columns, separators)
+        if values is not None:
+            yield values
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SECTION_MARKER = '__AFS_FIELD__'
+
+
+class DeviceInfoField:
+    """一项设备信息：获取命令、解析函数和有效期（None表示永不过期）"""
+
+    def __init__(self, name, command, parse, ttl=None):
+        self.name = name
+        self.command = command
+        self.parse = parse
+        self.ttl = ttl
+
+
+def build_command(fields):
+    """把多项信息的命令合并为一次shell调用，每段输出前加分隔标记"""
+    parts = [f"echo {SECTION_MARKER} {field.name}; {field.command} 2>/dev/null" for field in fields]
+    # 某一项失败不影响整体的退出码
+    return '; '.join(parts) + '; true'
+
+
+def split_sections(output):
+    """按分隔标记拆分合并命令的输出，返回 {名称: 文本}"""
+    sections = {}
+    name = None
+    for line in output.splitlines():
+        if line.startswith(SECTION_MARKER + ' '):
+            name = line[len(SECTION_MARKER) + 1:].strip()
+            sections[name] = []
+        elif name is not None:
+            sections[name].append(line)
+    return {key: '\n'.join(lines) for key, lines in sections.items()}
+
+
+class DeviceInfoCache:
+    """
+    按设备缓存设备信息，每项有独立的有效期
+    首次请求时同步获取，之后由后台线程在过期前刷新，接口直接返回内存中的值
+    """
+
+    def __init__(self, run_shell, fields, poll_interval=5, idle_timeout=300):
+        """
+        :param run_shell: (device_id, shell_command) -> 标准输出文本
+        :param idle_timeout: 超过该时间没有被请求的设备停止后台刷新
+        """
+        self.run_shell = run_shell
+        self.fields = {field.name: field for field in fields}
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._device_locks = {}
+        self._values = {}
+        self._requested = {}
+        self._poller = None
+
+    def _device_lock(self, device_id):
+        with self._lock:
+            return self._device_locks.setdefault(device_id, threading.Lock())
+
+    def _expired(self, device_id, now):
+        values = self._values.get(device_id, {})
+        return [
+            field for name, field in self.fields.items()
+            if name not in values or (field.ttl is not None and now - values[name][1] >= field.ttl)
+        ]
+
+    def refresh(self, device_id, fields=None):
+        """获取指定（默认已过期的）信息项"""
+        with self._device_lock(device_id):
+            now = time.monotonic()
+            fields = fields if fields is not None else self._expired(device_id, now)
+            if not fields:
+                return
+            sections = split_sections(self.run_shell(device_id, build_command(fields)))
+            with self._lock:
+                values = self._values.setdefault(device_id, {})
+                for field in fields:
+                    try:
+                        values[field.name] = (field.parse(sections.get(field.name, '')), now)
+                    except (ValueError, IndexError) as e:
+                        logger.warning(f"解析设备信息失败: {device_id} {field.name} - {e}")
+                        if field.name in values:
+                            # 保留旧值，等到下一个周期再重试
+                            values[field.name] = (values[field.name][0], now)
+
+    def get(self, device_id):
+        """返回 {名称: 值}；只有从未获取过的项才会同步请求设备"""
+        with self._lock:
+            self._requested[device_id] = time.monotonic()
+            values = self._values.get(device_id, {})
+            missing = [field for name, field in self.fields.items() if name not in values]
+        if missing:
+            self.refresh(device_id, missing)
+        self._ensure_poller()
+        with self._lock:
+            values = self._values.get(device_id, {})
+            return {name: values[name][0] if name in values else None for name in self.fields}
+
+    def invalidate(self, device_id, names=None):
+        """让指定信息项在下一次刷新时重新获取"""
+        with self._lock:
+            values = self._values.get(device_id, {})
+            for name in names or list(values):
+                values.pop(name, None)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._values.pop(device_id, None)
+            self._requested.pop(device_id, None)
+
+    def _ensure_poller(self):
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='device-info-poller', daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        try:
+            self._poll_loop()
+        finally:
+            # 线程意外退出时允许下一次请求重新启动后台刷新
+            with self._lock:
+                self._poller = None
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            now = time.monotonic()
+            with self._lock:
+                devices = [d for d, requested in self._requested.items() if now - requested < self.idle_timeout]
+                for device_id in [d for d in self._requested if d not in devices]:
+                    del self._requested[device_id]
+            for device_id in devices:
+                # 提前一个轮询周期刷新，保证请求时数据不过期
+                with self._lock:
+                    due = self._expired(device_id, now + self.poll_interval)
+                if not due:
+                    continue
+                try:
+                    self.refresh(device_id, due)
+                except Exception as e:
+                    # 解析、连接或超时等任何异常都不能让后台线程退出
+                    logger.warning(f"后台刷新设备信息失败: {device_id} - {e}")
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceTracker:
+    """
+    通过一条长连接（host:track-devices）维护设备列表，变化时通知订阅者
+    跟踪连接断开期间回退为一次性查询，查询结果在 fallback_ttl 内复用
+    """
+
+    def __init__(self, open_stream, list_devices, on_change=None,
+                 retry_interval=1, max_retry_interval=30, fallback_ttl=1):
+        """
+        :param open_stream: () -> 迭代器，每当设备列表变化时返回完整的 [(serial, state)]
+        :param list_devices: () -> [(serial, state)]，跟踪连接不可用时使用
+        :param on_change: (added, removed) -> None，added/removed 为进入/离开可用状态的设备
+        """
+        self.open_stream = open_stream
+        self.list_devices = list_devices
+        self.on_change = on_change
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.fallback_ttl = fallback_ttl
+        self._cond = threading.Condition()
+        self._states = {}
+        self._version = 0
+        self._tracking = False
+        self._fallback_at = None
+        self._thread = None
+
+    def _update(self, devices):
+        """保存新的设备列表，有变化时唤醒订阅者"""
+        states = dict(devices)
+        with self._cond:
+            if states == self._states and self._version:
+                return
+            before = {serial for serial, state in self._states.items() if state == 'device'}
+            after = {serial for serial, state in states.items() if state == 'device'}
+            self._states = states
+            self._version += 1
+            self._cond.notify_all()
+        logger.info(f"设备列表变化: {states}")
+        if self.on_change and before != after:
+            try:
+                self.on_change(sorted(after - before), sorted(before - after))
+            except Exception as e:
+                logger.error(f"处理设备变化失败: {e}")
+
+    def _run(self):
+        delay = self.retry_interval
+        while True:
+            try:
+                for devices in self.open_stream():
+                    with self._cond:
+                        self._tracking = True
+                    self._update(devices)
+                    delay = self.retry_interval
+                logger.warning("设备跟踪连接已关闭，准备重连")
+            except Exception as e:
+                logger.warning(f"设备跟踪连接失败: {e}，{delay}s 后重试")
+            with self._cond:
+                self._tracking = False
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_interval)
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='device-tracker', daemon=True)
+                self._thread.start()
+
+    def _refresh_fallback(self):
+        """跟踪连接不可用时直接查询一次设备列表"""
+        with self._cond:
+            if self._tracking:
+                return
+            now = time.monotonic()
+            if self._fallback_at is not None and now - self._fallback_at < self.fallback_ttl:
+                return
+            self._fallback_at = now
+        try:
+            devices = self.list_devices()
+        except Exception as e:
+            logger.warning(f"查询设备列表失败: {e}")
+            devices = []
+        self._update(devices)
+
+    def status(self):
+        """返回 {connected, devices}，devices 只包含可用状态的设备"""
+        self._ensure_started()
+        self._refresh_fallback()
+        with self._cond:
+            return self._status()
+
+    def _status(self):
+        devices = [serial for serial, state in self._states.items() if state == 'device']
+        return {'connected': bool(devices), 'devices': devices}
+
+    def wait(self, version=None, timeout=None):
+        """
+        等待设备列表版本不同于 version，返回 (版本, 状态, 是否变化)
+        version 为None时立即返回当前状态
+        """
+        self._ensure_started()
+        self._refresh_fallback()
+        with self._cond:
+            changed = self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._status(), changed
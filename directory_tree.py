@@ -0,0 +1,181 @@
+import itertools
+import logging
+import posixpath
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_dir(path):
+    """目录路径统一为以 / 结尾的规范形式"""
+    path = posixpath.normpath('/' + path.strip('/'))
+    return path if path == '/' else path + '/'
+
+
+class TreeSnapshot:
+    """以某个目录为根的一次完整子树快照"""
+
+    _serials = itertools.count(1)
+
+    def __init__(self, root, dirs):
+        self.root = root
+        # 快照编号和局部更新次数，两者不变时快照内容不变
+        self.serial = next(self._serials)
+        self.generation = 0
+        # 目录路径 -> 直接子条目列表 (SyncEntry)
+        self.dirs = dirs
+        self.fetched_at = time.monotonic()
+        self.stale = set()
+        self._sizes = None
+
+    def covers(self, path):
+        return path.startswith(self.root)
+
+    def folder_sizes(self):
+        """各目录（含全部子目录）的文件总字节数"""
+        if self._sizes is None:
+            sizes = {}
+            for dir_path in sorted(self.dirs, key=lambda p: p.count('/'), reverse=True):
+                total = 0
+                for entry in self.dirs[dir_path]:
+                    if stat.S_ISDIR(entry.mode):
+                        total += sizes.get(dir_path + entry.name + '/', 0)
+                    elif stat.S_ISREG(entry.mode):
+                        total += entry.size
+                sizes[dir_path] = total
+            self._sizes = sizes
+        return self._sizes
+
+    def replace_dir(self, dir_path, entries):
+        self.dirs[dir_path] = entries
+        self.stale.discard(dir_path)
+        self.generation += 1
+        self._sizes = None
+
+    def invalidate(self, path):
+        """
+        路径被修改/删除：移除其子树并标记所在目录需要重新列出
+        所在目录不在快照中（例如上传时新建了目录）时无法局部更新，返回False
+        """
+        path = path.rstrip('/')
+        parent = normalize_dir(posixpath.dirname(path))
+        if parent not in self.dirs:
+            return False
+        for dir_path in [p for p in self.dirs if p.startswith(path + '/')]:
+            del self.dirs[dir_path]
+        self.stale.add(parent)
+        self.generation += 1
+        self._sizes = None
+        return True
+
+
+class DirectoryTreeCache:
+    """
+    按设备缓存目录子树快照
+    一次设备命令获取整个子树的精确大小和修改时间，之后的目录浏览和文件夹大小统计都在本地完成
+    快照超过TTL后重新获取；上传、删除后只重新列出受影响的目录
+    """
+
+    def __init__(self, fetch_snapshot, list_dir, ttl=60, max_snapshots_per_device=4):
+        """
+        :param fetch_snapshot: (device_id, root) -> {目录路径: [SyncEntry]}，目录路径以 / 结尾
+        :param list_dir: (device_id, dir_path) -> [SyncEntry]，用于重新列出单个目录
+        """
+        self.fetch_snapshot = fetch_snapshot
+        self.list_dir = list_dir
+        self.ttl = ttl
+        self.max_snapshots_per_device = max_snapshots_per_device
+        self._lock = threading.Lock()
+        self._device_locks = {}
+        self._snapshots = {}
+
+    def _device_lock(self, device_id):
+        with self._lock:
+            return self._device_locks.setdefault(device_id, threading.Lock())
+
+    def _find(self, device_id, path):
+        """找到覆盖该路径且未过期的快照"""
+        now = time.monotonic()
+        snapshots = self._snapshots.get(device_id, [])
+        snapshots[:] = [s for s in snapshots if now - s.fetched_at < self.ttl]
+        for snapshot in snapshots:
+            if snapshot.covers(path) and path in snapshot.dirs:
+                return snapshot
+        return None
+
+    def snapshot(self, device_id, path, refresh=False):
+        """返回包含该目录的快照，必要时从设备获取"""
+        path = normalize_dir(path)
+        with self._device_lock(device_id):
+            snapshot = None if refresh else self._find(device_id, path)
+            if snapshot is None:
+                started = time.monotonic()
+                snapshot = TreeSnapshot(path, self.fetch_snapshot(device_id, path))
+                logger.info(
+                    f"获取目录快照: {device_id} {path} {len(snapshot.dirs)} 个目录, "
+                    f"耗时 {time.monotonic() - started:.2f}s"
+                )
+                snapshots = [s for s in self._snapshots.get(device_id, []) if not snapshot.covers(s.root)]
+                snapshots.insert(0, snapshot)
+                self._snapshots[device_id] = snapshots[:self.max_snapshots_per_device]
+            elif path in snapshot.stale:
+                snapshot.replace_dir(path, self.list_dir(device_id, path))
+            return snapshot
+
+    def list(self, device_id, path, refresh=False):
+        """返回 (直接子条目列表, 各目录总大小)"""
+        path = normalize_dir(path)
+        snapshot = self.snapshot(device_id, path, refresh)
+        with self._device_lock(device_id):
+            sizes = self._folder_sizes(device_id, snapshot)
+            return list(snapshot.dirs.get(path, [])), sizes
+
+    def version(self, device_id, path, refresh=False):
+        """
+        返回该目录列表的版本标识（快照编号.局部更新次数），用作ETag
+        版本不变时 list() 的结果不变；文件夹大小依赖整个快照，快照内任何目录变化都会改变版本
+        """
+        path = normalize_dir(path)
+        snapshot = self.snapshot(device_id, path, refresh)
+        with self._device_lock(device_id):
+            self._folder_sizes(device_id, snapshot)
+            return f'{snapshot.serial}.{snapshot.generation}'
+
+    def folder_size(self, device_id, path, refresh=False):
+        path = normalize_dir(path)
+        snapshot = self.snapshot(device_id, path, refresh)
+        with self._device_lock(device_id):
+            return self._folder_sizes(device_id, snapshot).get(path, 0)
+
+    def _folder_sizes(self, device_id, snapshot):
+        # 统计前先重新列出被标记的目录
+        for dir_path in list(snapshot.stale):
+            snapshot.replace_dir(dir_path, self.list_dir(device_id, dir_path))
+        return snapshot.folder_sizes()
+
+    def walk(self, device_id, path, refresh=False):
+        """返回子树中全部目录的 [(目录路径, 直接子条目列表)]，按路径排序"""
+        path = normalize_dir(path)
+        snapshot = self.snapshot(device_id, path, refresh)
+        with self._device_lock(device_id):
+            self._folder_sizes(device_id, snapshot)
+            return [(p, list(snapshot.dirs[p])) for p in sorted(snapshot.dirs) if p.startswith(path)]
+
+    def invalidate(self, device_id, paths):
+        """设备上的文件被修改或删除后调用"""
+        with self._device_lock(device_id):
+            snapshots = self._snapshots.get(device_id, [])
+            for snapshot in list(snapshots):
+                for path in paths:
+                    if snapshot.covers(path) and not snapshot.invalidate(path):
+                        snapshots.remove(snapshot)
+                        break
+
+    def clear(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(device_id, None)
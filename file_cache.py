@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    """
+    设备文件的本地缓存
+    以 (设备序列号, 远程完整路径) 为key，按远程文件的大小和修改时间校验是否过期
+    支持全局/单设备容量上限（LRU或LFU淘汰），正在传输或使用中的文件会被固定不参与淘汰
+    """
+
+    def __init__(self, root, max_bytes, max_bytes_per_device, policy='lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"不支持的淘汰策略: {policy}")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_bytes_per_device = max_bytes_per_device
+        self.policy = policy
+        self.tmp_dir = os.path.join(root, '.tmp')
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pins = {}
+        self._db = sqlite3.connect(os.path.join(root, '.cache_index.sqlite3'), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'device_id TEXT, remote_path TEXT, size INTEGER, mtime INTEGER, '
+            'last_access REAL, hits INTEGER, PRIMARY KEY (device_id, remote_path))'
+        )
+        self._db.commit()
+        self._device_bytes = dict(self._db.execute('SELECT device_id, SUM(size) FROM files GROUP BY device_id'))
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def local_path(self, device_id, remote_path):
+        """
+        缓存文件在本地的位置：<root>/<设备>/<key前两位>/<key><扩展名>，key由 (设备序列号, 远程路径) 计算
+        不按远程目录结构存放，同一路径在不同时刻分别是文件和目录（/sdcard/a 与 /sdcard/a/b）时也不会冲突
+        """
+        remote_path = posixpath.normpath('/' + remote_path)
+        key = hashlib.sha1(f'{device_id}\0{remote_path}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, device_id, key[:2], key + posixpath.splitext(remote_path)[1])
+
+    @property
+    def total_bytes(self):
+        return sum(self._device_bytes.values())
+
+    def lookup(self, device_id, remote_path, size, mtime):
+        """缓存有效时返回本地路径；远程文件已变化则删除旧缓存并返回None"""
+        path = self.local_path(device_id, remote_path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime FROM files WHERE device_id = ? AND remote_path = ?',
+                (device_id, remote_path)
+            ).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            if (row[0], row[1]) != (size, mtime) or not os.path.exists(path):
+                self._stats['stale'] += 1
+                self._stats['misses'] += 1
+                if (device_id, remote_path) not in self._pins:
+                    self._remove(device_id, remote_path)
+                    self._db.commit()
+                return None
+            self._db.execute(
+                'UPDATE files SET last_access = ?, hits = hits + 1 WHERE device_id = ? AND remote_path = ?',
+                (time.time(), device_id, remote_path)
+            )
+            self._db.commit()
+            self._stats['hits'] += 1
+        return path
+
+    @contextmanager
+    def pinned(self, device_id, remote_path):
+        """使用期间固定缓存条目，避免被淘汰"""
+        key = (device_id, remote_path)
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def new_temp_path(self):
+        """传输中的文件先写入临时目录，完成后通过commit原子替换"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def commit(self, device_id, remote_path, temp_path, size, mtime):
+        """把传输完成的临时文件放入缓存，返回最终路径"""
+        path = self.local_path(device_id, remote_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        local_size = os.path.getsize(path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size FROM files WHERE device_id = ? AND remote_path = ?', (device_id, remote_path)
+            ).fetchone()
+            if row:
+                self._device_bytes[device_id] -= row[0]
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (device_id, remote_path, size, mtime, last_access, hits) '
+                'VALUES (?, ?, ?, ?, ?, 0)',
+                (device_id, remote_path, local_size, mtime, time.time())
+            )
+            self._device_bytes[device_id] = self._device_bytes.get(device_id, 0) + local_size
+            self._evict(device_id, protect=(device_id, remote_path))
+            self._db.commit()
+        return path
+
+    def invalidate(self, device_id, remote_path):
+        """远程文件被删除或修改时移除缓存"""
+        with self._lock:
+            if (device_id, remote_path) not in self._pins:
+                self._remove(device_id, remote_path)
+                self._db.commit()
+
+    def _remove(self, device_id, remote_path):
+        row = self._db.execute(
+            'SELECT size FROM files WHERE device_id = ? AND remote_path = ?', (device_id, remote_path)
+        ).fetchone()
+        if row is None:
+            return
+        self._device_bytes[device_id] -= row[0]
+        self._db.execute('DELETE FROM files WHERE device_id = ? AND remote_path = ?', (device_id, remote_path))
+        try:
+            os.remove(self.local_path(device_id, remote_path))
+        except FileNotFoundError:
+            pass
+
+    def _victims(self, device_id=None):
+        """按淘汰策略排序的候选条目"""
+        order = 'last_access' if self.policy == 'lru' else 'hits, last_access'
+        if device_id is None:
+            return self._db.execute(f'SELECT device_id, remote_path FROM files ORDER BY {order}')
+        return self._db.execute(
+            f'SELECT device_id, remote_path FROM files WHERE device_id = ? ORDER BY {order}', (device_id,)
+        )
+
+    def _evict(self, device_id, protect):
+        for scope, over_quota in (
+            (device_id, lambda: self._device_bytes.get(device_id, 0) > self.max_bytes_per_device),
+            (None, lambda: self.total_bytes > self.max_bytes),
+        ):
+            if not over_quota():
+                continue
+            for key in self._victims(scope).fetchall():
+                if not over_quota():
+                    break
+                if key == protect or key in self._pins:
+                    continue
+                self._remove(*key)
+                self._stats['evictions'] += 1
+                logger.info(f"淘汰缓存文件: {key[0]} {key[1]}")
+
+    def stats(self):
+        with self._lock:
+            count = self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            return {
+                'entries': count,
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_bytes_per_device': self.max_bytes_per_device,
+                'device_bytes': dict(self._device_bytes),
+                'pinned': len(self._pins),
+                'policy': self.policy,
+                **self._stats
+            }
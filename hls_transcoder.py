@@ -0,0 +1,219 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = 'seg_{}.ts'
+LOG_NAME = 'ffmpeg.log'
+
+
+class TranscodeJob:
+    """一个ffmpeg进程：从 start 号分段开始连续输出，直到文件结束或被停止"""
+
+    def __init__(self, source, profile, start, work_dir):
+        self.source = source
+        self.profile = profile
+        self.start = start
+        self.work_dir = work_dir
+        # 下一个尚未完成的分段号
+        self.next_segment = start
+        self.last_requested = start
+        self.last_access = time.monotonic()
+        self.process = None
+        self.stopped = False
+        self.done = False
+        self.error = None
+
+    def covers(self, index, seek_threshold):
+        """该分段是否会由这个进程在不久后输出（不超过 seek_threshold 个分段）"""
+        return not self.done and self.start <= index <= self.next_segment + seek_threshold
+
+
+class HlsTranscoder:
+    """
+    按需把设备上的视频/音频转码为HLS分段
+    请求某个分段时，如果没有进程正在它附近输出，就从该分段的时间点启动ffmpeg，之后连续输出后续分段；
+    进程领先最后请求的分段太多、或者一段时间没有请求（没有人观看）时停止，之后需要时再从请求的位置重新启动
+    完成的分段放入缓存，超出容量时按LRU淘汰
+    """
+
+    def __init__(self, cache, probe, start_process, segment_seconds=4, max_jobs=2, max_ahead=10,
+                 seek_threshold=3, idle_timeout=30, poll_interval=0.1, probe_cache_size=256):
+        """
+        :param cache: ContentCache，保存分段文件
+        :param probe: (source) -> (时长秒数, 是否有视频画面)，source 为 (设备序列号, 远程路径, 大小, 修改时间)
+        :param start_process: (source, profile, 起始分段号, 输出目录) -> Popen，分段文件名为 SEGMENT_NAME，
+            写完后才出现在输出目录中（ffmpeg -hls_flags temp_file），错误输出写入输出目录中的 LOG_NAME
+        :param max_jobs: 同时运行的ffmpeg进程数，超出时停止最久没有请求的进程
+        :param max_ahead: 进程最多领先最后请求的分段数
+        :param seek_threshold: 请求的分段在正在输出的位置之后不超过该数量时等待，否则视为跳转并重新启动
+        """
+        self.cache = cache
+        self.probe = probe
+        self.start_process = start_process
+        self.segment_seconds = segment_seconds
+        self.max_jobs = max_jobs
+        self.max_ahead = max_ahead
+        self.seek_threshold = seek_threshold
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.probe_cache_size = probe_cache_size
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._probes = OrderedDict()
+        self._probe_lock = threading.Lock()
+        self._stats = {'jobs_started': 0, 'jobs_failed': 0, 'segments': 0}
+
+    def segment_key(self, source, profile, index):
+        """分段的缓存key，同时用作ETag"""
+        return self.cache.make_key(*source, f'hls:{profile}:{index}')
+
+    def media_info(self, source):
+        """返回 (时长秒数, 是否有视频画面)，同一文件版本只探测一次"""
+        with self._probe_lock:
+            if source in self._probes:
+                self._probes.move_to_end(source)
+                return self._probes[source]
+        info = self.probe(source)
+        with self._probe_lock:
+            self._probes[source] = info
+            while len(self._probes) > self.probe_cache_size:
+                self._probes.popitem(last=False)
+        return info
+
+    def segment_durations(self, source):
+        """各分段的时长（最后一个分段可能较短）"""
+        duration, _has_video = self.media_info(source)
+        count = max(1, -(-int(duration * 1000) // int(self.segment_seconds * 1000)))
+        return [min(self.segment_seconds, duration - i * self.segment_seconds) for i in range(count)]
+
+    def segment(self, source, profile, index, timeout=60):
+        """
+        返回分段文件路径，必要时启动或重新定位转码进程并等待
+        :raises TimeoutError: 等待超时
+        :raises RuntimeError: ffmpeg转码失败
+        """
+        cache_key = self.segment_key(source, profile, index)
+        deadline = time.monotonic() + timeout
+        while True:
+            path = self.cache.get(cache_key)
+            with self._cond:
+                job = self._jobs.get((source, profile))
+                if job is not None and job.covers(index, self.seek_threshold):
+                    job.last_requested = max(job.last_requested, index)
+                    job.last_access = time.monotonic()
+                if path:
+                    return path
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待HLS分段超时: {source[1]} {profile} #{index}")
+                if job is not None and job.start <= index < job.next_segment:
+                    # 进程已经输出过该分段，但缓存中没有（被淘汰或删除）：先在锁内再确认一次，仍然没有就和跳转一样从该分段重新启动
+                    path = self.cache.get(cache_key, record_stats=False)
+                    if path:
+                        return path
+                    self._stop(job, '分段已被淘汰')
+                    job = self._start(source, profile, index)
+                elif job is None or not job.covers(index, self.seek_threshold):
+                    if job is not None:
+                        self._stop(job, '跳转')
+                    job = self._start(source, profile, index)
+                self._cond.wait_for(lambda: job.next_segment > index or job.done, deadline - time.monotonic())
+                if job.next_segment > index:
+                    continue
+                if job.done and job.error:
+                    raise RuntimeError(job.error)
+                if job.done and not job.stopped:
+                    # 进程正常结束但没有输出该分段：已超出文件末尾
+                    raise RuntimeError(f"HLS分段不存在: {source[1]} {profile} #{index}")
+            # 进程在输出该分段之前被停止（例如超出并发数），重新启动
+
+    def _start(self, source, profile, index):
+        """需要持有 self._cond"""
+        running = sorted((j for j in self._jobs.values() if not j.done), key=lambda j: j.last_access)
+        for old in running[:max(0, len(running) - self.max_jobs + 1)]:
+            self._stop(old, '超出并发数')
+        work_dir = os.path.join(self.cache.tmp_dir, f'hls-{os.urandom(6).hex()}')
+        os.makedirs(work_dir)
+        job = TranscodeJob(source, profile, index, work_dir)
+        try:
+            job.process = self.start_process(source, profile, index, work_dir)
+        except Exception as e:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise RuntimeError(f"启动ffmpeg失败: {e}")
+        self._jobs[(source, profile)] = job
+        self._stats['jobs_started'] += 1
+        logger.info(f"开始HLS转码: {source[0]} {source[1]} {profile} 从第 {index} 段")
+        threading.Thread(target=self._run, args=(job,), name=f'hls-{profile}', daemon=True).start()
+        return job
+
+    def _stop(self, job, reason):
+        """需要持有 self._cond"""
+        if job.stopped or job.done:
+            return
+        job.stopped = True
+        logger.info(f"停止HLS转码（{reason}）: {job.source[1]} {job.profile} 已输出到第 {job.next_segment} 段")
+        try:
+            job.process.kill()
+        except OSError:
+            pass
+
+    def _run(self, job):
+        device_id, remote_path = job.source[:2]
+        while True:
+            segment_path = os.path.join(job.work_dir, SEGMENT_NAME.format(job.next_segment))
+            if os.path.exists(segment_path):
+                key = self.segment_key(job.source, job.profile, job.next_segment)
+                self.cache.put(key, segment_path, device_id, remote_path)
+                with self._cond:
+                    job.next_segment += 1
+                    self._stats['segments'] += 1
+                    self._cond.notify_all()
+                continue
+            returncode = job.process.poll()
+            if returncode is not None:
+                # 进程退出前完成的最后一个分段可能刚刚出现
+                if os.path.exists(segment_path):
+                    continue
+                break
+            with self._cond:
+                now = time.monotonic()
+                if now - job.last_access >= self.idle_timeout:
+                    self._stop(job, '没有观看者')
+                elif job.next_segment > job.last_requested + self.max_ahead:
+                    self._stop(job, '领先播放位置')
+            time.sleep(self.poll_interval)
+
+        error = None
+        if returncode != 0 and not job.stopped:
+            error = f"ffmpeg转码失败(退出码 {returncode}): {self._read_log(job)}"
+            logger.error(f"HLS转码失败: {remote_path} {job.profile} - {error}")
+        with self._cond:
+            job.done = True
+            job.error = error
+            if error:
+                self._stats['jobs_failed'] += 1
+            if self._jobs.get((job.source, job.profile)) is job:
+                del self._jobs[(job.source, job.profile)]
+            self._cond.notify_all()
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    @staticmethod
+    def _read_log(job):
+        try:
+            with open(os.path.join(job.work_dir, LOG_NAME), encoding='utf-8', errors='replace') as f:
+                return f.read()[-500:].strip()
+        except OSError:
+            return ''
+
+    def stop_all(self):
+        with self._cond:
+            for job in list(self._jobs.values()):
+                self._stop(job, '服务退出')
+
+    def stats(self):
+        with self._cond:
+            return {**self._stats, 'running': sum(1 for job in self._jobs.values() if not job.done)}
@@ -0,0 +1,118 @@
+import gzip
+import os
+import threading
+
+from werkzeug.wrappers import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 进程内的计数器重启后从头开始，ETag加上实例标识，避免与重启前发出的ETag相同而内容不同
+INSTANCE_TAG = os.urandom(4).hex()
+
+# 列表类响应：浏览器保存副本，但每次使用前都要用ETag确认
+LISTING_CACHE_CONTROL = 'private, no-cache'
+
+COMPRESSIBLE_MIME_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'text/javascript',
+                           'application/javascript'}
+
+
+def listing_etag(*parts):
+    """由列表的代数（版本计数）生成强ETag"""
+    return '-'.join([INSTANCE_TAG, *map(str, parts)])
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    条件请求是否命中：有 If-None-Match 时只比较ETag（弱比较，压缩后的 "<etag>-gzip"/"<etag>-br" 视为同一版本），
+    否则比较 If-Modified-Since 与修改时间（秒级时间戳）
+    """
+    tags = request.if_none_match
+    if tags:
+        return tags.star_tag or any(
+            tags.contains_weak(etag + suffix) for suffix in ('', *(f'-{name}' for name in ResponseCompressor.ENCODINGS)))
+    if last_modified is not None and request.if_modified_since:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def not_modified_response(etag, last_modified=None, cache_control=None):
+    """304响应，带上与200响应相同的验证头"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def conditional_response(request, response, etag=None, cache_control=LISTING_CACHE_CONTROL):
+    """
+    为已生成的响应设置ETag（未指定时使用响应体的哈希），客户端的副本仍然有效时改为304
+    响应体已经生成，只节省传输；能预先得到版本号的接口应在生成响应体之前用 is_not_modified 判断
+    """
+    if etag is None:
+        response.add_etag()
+        etag, _weak = response.get_etag()
+    else:
+        response.set_etag(etag)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, cache_control=cache_control)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+class ResponseCompressor:
+    """
+    按 Accept-Encoding 压缩较大的JSON/文本响应（after_request中调用），安装了brotli时优先使用br
+    文件、缩略图和流式响应不压缩；压缩后的ETag加上编码后缀，304判断时视为同一版本
+    """
+
+    ENCODINGS = ('br', 'gzip')
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._stats = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def choose_encoding(self, accept_encodings):
+        for encoding in self.ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            if accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def compress(self, request, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_MIME_TYPES or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding(request.accept_encodings)
+        data = response.get_data()
+        if encoding is None or len(data) < self.min_size:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        with self._lock:
+            self._stats['responses'] += 1
+            self._stats['bytes_in'] += len(data)
+            self._stats['bytes_out'] += len(compressed)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
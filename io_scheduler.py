@@ -0,0 +1,253 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 优先级从高到低：交互式元数据操作 > 可见缩略图 > 预取 > 大文件传输
+IO_CLASSES = ('interactive', 'thumbnail', 'prefetch', 'bulk')
+PRIORITY = {name: index for index, name in enumerate(IO_CLASSES)}
+
+
+class IOQueueTimeout(RuntimeError):
+    """等待设备I/O额度超时"""
+
+
+class _Ticket:
+    __slots__ = ('device_id', 'io_class', 'seq', 'enqueued_at', 'granted')
+
+    def __init__(self, device_id, io_class, seq):
+        self.device_id = device_id
+        self.io_class = io_class
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class _ClassStats:
+    __slots__ = ('active', 'waiting', 'granted', 'wait_seconds', 'bytes')
+
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.granted = 0
+        self.wait_seconds = 0.0
+        self.bytes = 0
+
+
+class DeviceIOScheduler:
+    """
+    按设备调度adb操作：每个优先级类别、每台设备以及全部设备合计都有并发上限
+    有空闲额度时优先放行高优先级类别；同一优先级在多台设备之间轮流放行
+    同一线程对同一设备的嵌套调用不重复占用额度
+    """
+
+    def __init__(self, class_limits, device_limit=6, total_limit=None, queue_timeout=None,
+                 rate_limits=None, busy_rate_limits=None, burst_seconds=0.1):
+        """
+        :param class_limits: {类别: 每台设备同时进行的操作数}
+        :param rate_limits: {类别: 字节/秒}，经过 throttle() 的数据流按设备和类别限速
+        :param busy_rate_limits: {类别: 字节/秒}，同一设备上有更高优先级的操作进行或排队时使用
+        """
+        self.class_limits = dict(class_limits)
+        self.device_limit = device_limit
+        self.total_limit = total_limit
+        self.queue_timeout = queue_timeout
+        self.rate_limits = dict(rate_limits or {})
+        self.busy_rate_limits = dict(busy_rate_limits or {})
+        self.burst_seconds = burst_seconds
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._served = {}
+        self._serve_counter = itertools.count()
+        self._stats = {}
+        self._device_active = {}
+        self._total_active = 0
+        self._next_send = {}
+        self._local = threading.local()
+
+    def _class_stats(self, device_id, io_class):
+        device = self._stats.setdefault(device_id, {})
+        stats = device.get(io_class)
+        if stats is None:
+            stats = device[io_class] = _ClassStats()
+        return stats
+
+    def _can_run(self, ticket):
+        if self._device_active.get(ticket.device_id, 0) >= self.device_limit:
+            return False
+        limit = self.class_limits.get(ticket.io_class)
+        return limit is None or self._class_stats(ticket.device_id, ticket.io_class).active < limit
+
+    def _dispatch(self):
+        """需要持有 self._cond：在额度允许的范围内放行排队的操作"""
+        granted = False
+        while self._waiting and (self.total_limit is None or self._total_active < self.total_limit):
+            eligible = [ticket for ticket in self._waiting if self._can_run(ticket)]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (PRIORITY[t.io_class], self._served.get(t.device_id, -1), t.seq))
+            self._waiting.remove(ticket)
+            self._grant(ticket)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _grant(self, ticket):
+        ticket.granted = True
+        stats = self._class_stats(ticket.device_id, ticket.io_class)
+        stats.waiting -= 1
+        stats.active += 1
+        stats.granted += 1
+        stats.wait_seconds += time.monotonic() - ticket.enqueued_at
+        self._device_active[ticket.device_id] = self._device_active.get(ticket.device_id, 0) + 1
+        self._total_active += 1
+        self._served[ticket.device_id] = next(self._serve_counter)
+
+    def acquire(self, device_id, io_class, timeout=None):
+        """等待并占用一个额度，返回用于 release() 的凭据"""
+        if io_class not in PRIORITY:
+            raise ValueError(f"未知的I/O类别: {io_class}")
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            ticket = _Ticket(device_id, io_class, next(self._seq))
+            self._class_stats(device_id, io_class).waiting += 1
+            self._waiting.append(ticket)
+            self._dispatch()
+            if not self._cond.wait_for(lambda: ticket.granted, timeout):
+                self._waiting.remove(ticket)
+                self._class_stats(device_id, io_class).waiting -= 1
+                raise IOQueueTimeout(f"等待设备I/O超时: {device_id} {io_class}")
+            return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            self._class_stats(ticket.device_id, ticket.io_class).active -= 1
+            self._device_active[ticket.device_id] -= 1
+            self._total_active -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, device_id, io_class='interactive'):
+        """
+        占用一个额度执行设备操作
+        当前线程通过 using() 指定了类别时以其为准；已持有该设备额度时直接执行
+        """
+        held = self._held()
+        if held.get(device_id):
+            held[device_id] += 1
+            try:
+                yield
+            finally:
+                held[device_id] -= 1
+            return
+        ticket = self.acquire(device_id, self.current_class(io_class))
+        held[device_id] = 1
+        try:
+            yield
+        finally:
+            held[device_id] = 0
+            self.release(ticket)
+
+    @contextmanager
+    def using(self, io_class):
+        """指定当前线程中设备操作的类别（例如缩略图任务中的文件拉取）"""
+        previous = getattr(self._local, 'io_class', None)
+        self._local.io_class = io_class
+        try:
+            yield
+        finally:
+            self._local.io_class = previous
+
+    def current_class(self, default='interactive'):
+        return getattr(self._local, 'io_class', None) or default
+
+    def _held(self):
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+        return held
+
+    def _higher_priority_busy(self, device_id, io_class):
+        device = self._stats.get(device_id, {})
+        return any(
+            stats.active or stats.waiting
+            for name, stats in device.items() if PRIORITY[name] < PRIORITY[io_class]
+        )
+
+    def _reserve(self, device_id, io_class, size):
+        """记录传输的字节数，返回为满足限速需要等待的秒数"""
+        with self._cond:
+            self._class_stats(device_id, io_class).bytes += size
+            rate = self.rate_limits.get(io_class)
+            busy_rate = self.busy_rate_limits.get(io_class)
+            if busy_rate and self._higher_priority_busy(device_id, io_class):
+                rate = min(rate, busy_rate) if rate else busy_rate
+            if not rate:
+                return 0
+            key = (device_id, io_class)
+            now = time.monotonic()
+            send_at = max(self._next_send.get(key, now), now - self.burst_seconds)
+            self._next_send[key] = send_at + size / rate
+            return send_at - now
+
+    def throttle(self, device_id, io_class, chunks):
+        """按类别的限速转发数据块，并统计传输量"""
+        try:
+            for chunk in chunks:
+                delay = self._reserve(device_id, io_class, len(chunk))
+                if delay > 0:
+                    time.sleep(delay)
+                yield chunk
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    def status(self):
+        """各设备各类别的进行中、排队、累计放行数、平均等待时间和传输字节数"""
+        with self._cond:
+            now = time.monotonic()
+            oldest = {}
+            for ticket in self._waiting:
+                key = (ticket.device_id, ticket.io_class)
+                oldest[key] = max(oldest.get(key, 0), now - ticket.enqueued_at)
+            devices = {}
+            for device_id, classes in self._stats.items():
+                devices[device_id] = {
+                    'active': self._device_active.get(device_id, 0),
+                    'classes': {
+                        name: {
+                            'limit': self.class_limits.get(name),
+                            'active': stats.active,
+                            'waiting': stats.waiting,
+                            'oldest_wait_ms': round(oldest.get((device_id, name), 0) * 1000, 1),
+                            'granted': stats.granted,
+                            'avg_wait_ms': round(stats.wait_seconds / stats.granted * 1000, 1) if stats.granted else 0,
+                            'bytes': stats.bytes
+                        }
+                        for name, stats in sorted(classes.items(), key=lambda item: PRIORITY[item[0]])
+                    }
+                }
+            return {
+                'device_limit': self.device_limit,
+                'total_limit': self.total_limit,
+                'total_active': self._total_active,
+                'rate_limits': self.rate_limits,
+                'busy_rate_limits': self.busy_rate_limits,
+                'devices': devices
+            }
+
+    def forget(self, device_id):
+        """设备断开后清除其统计（进行中的操作不受影响）"""
+        with self._cond:
+            classes = self._stats.get(device_id, {})
+            if not any(stats.active or stats.waiting for stats in classes.values()):
+                self._stats.pop(device_id, None)
+                self._served.pop(device_id, None)
+                self._device_active.pop(device_id, None)
+                for key in [key for key in self._next_send if key[0] == device_id]:
+                    del self._next_send[key]
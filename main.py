@@ -1,44 +1,138 @@
 # app.py
 import logging
-from flask import Flask, render_template, request, jsonify, Response, make_response, send_file
+from flask import Flask, render_template, request, jsonify, Response, make_response, send_file, url_for
 import subprocess
 import re
 from functools import wraps
-from pathlib import Path
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 import mimetypes
 import os
+import argparse
+import atexit
+import json
+import threading
+import time
 from install_tools import install_adb, install_ffmpeg, verify_installation, install_all
+import stat
+import shlex
+import posixpath
+from urllib.parse import quote, urlencode
+from adb_session import AdbSessionPool, AdbSessionError
+from adb_client import AdbClient, AdbServerUnavailable, SyncEntry, parse_devices
+from thumbnail_scheduler import ThumbnailScheduler, ThumbnailJobCancelled
+from content_cache import ContentCache
+from thumbnail_warmer import ThumbnailWarmer
+from file_cache import FileCache
+from media_index import MediaIndex
+from content_query import ContentRow, QUERY_END_MARKER, iter_content_rows, iter_lines
+from directory_tree import DirectoryTreeCache, normalize_dir
+from archive_stream import ARCHIVE_MIME_TYPES, ArchiveEntry, iter_archive, iter_file_contents
+from upload_session import UploadManager, UploadError
+from device_info import DeviceInfoCache, DeviceInfoField
+from device_tracker import DeviceTracker
+from screen_stream import ScreenStreamManager
+from serving import ConcurrencyLimiter, RequestClass, serve
+from io_scheduler import DeviceIOScheduler
+from hls_transcoder import HlsTranscoder, LOG_NAME as HLS_LOG_NAME, SEGMENT_NAME as HLS_SEGMENT_NAME
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, RequestMetrics
+from http_cache import LISTING_CACHE_CONTROL, ResponseCompressor, conditional_response, is_not_modified, listing_etag, not_modified_response
+from batch_ops import BatchOperationError, compile_batch, media_scan_script, normalize_operation, parse_batch_results
 
 # 常量定义
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STORAGE_DIR = os.path.join(BASE_DIR, 'storage')
-PER_PAGE = 64
+DATA_DIR = os.environ.get('AFS_DATA_DIR', BASE_DIR) # 文件缓存、缩略图缓存和媒体索引所在目录，基准测试时指向临时目录
+STORAGE_DIR = os.path.join(DATA_DIR, 'storage')
+PER_PAGE = 64 # 分页接口默认每页条数
+MAX_PER_PAGE = 1000
 ADB_TIMEOUT = 3000 # ADB命令超时时间，单位为秒 考虑到大视频传输问题
+ADB_BIN = os.environ.get('ADB_BIN', 'adb') # 可指向 tools/fake_adb.py 进行离线调试
+ADB_SESSIONS_PER_DEVICE = 2 # 每台设备常驻的adb shell会话数
+FILE_STREAM_MODE = True # /api/file 直接把设备数据流式转发给浏览器，而不是先完整拉取
+FILE_STREAM_TEE_TO_CACHE = True # 完整流式下载时同时写入本地缓存
+FILE_CACHE_MAX_BYTES = 20 * 1024**3 # STORAGE_DIR 文件缓存总容量上限
+FILE_CACHE_MAX_BYTES_PER_DEVICE = 10 * 1024**3 # 单台设备的缓存容量上限
+FILE_CACHE_POLICY = 'lru' # 淘汰策略: lru 或 lfu
+FILE_LIST_MODE = 'tree' # 目录浏览模式: tree 一次获取整个子树快照并在本地浏览, dir 每次只列出当前目录
+DIRECTORY_TREE_TTL = 60 # 子树快照的有效期，单位为秒
+ARCHIVE_PARALLEL_FETCH = 4 # 打包下载时并行预取小文件的线程数，1为顺序读取
+ARCHIVE_PREFETCH_MAX_BYTES = 8 * 1024 * 1024 # 不超过该大小的文件才会被预取到内存
+UPLOAD_DIR = '/sdcard/PC' # 上传文件在设备上的保存目录，按分类分子目录
+UPLOAD_MAX_BUFFER_BYTES = 32 * 1024 * 1024 # 每个上传会话在内存中暂存（乱序块、等待写入设备）的数据上限
+UPLOAD_IDLE_TIMEOUT = 600 # 上传会话无数据超过该时间后取消，单位为秒
+BATCH_MAX_OPERATIONS = 5000 # 单次批量操作的最大条目数
+DEVICE_INFO_STORAGE_TTL = 30 # 存储空间信息的有效期，单位为秒（设备型号不过期）
+DEVICE_INFO_BATTERY_TTL = 60 # 电量信息的有效期，单位为秒
+DEVICE_INFO_POLL_INTERVAL = 5 # 后台刷新设备信息的检查间隔，单位为秒
+DEVICE_EVENTS_KEEPALIVE = 15 # 设备事件流（SSE）没有变化时发送心跳的间隔，单位为秒
+SCREEN_STREAM_FPS = 5 # 实时画面每台设备的最高截图帧率
+SCREEN_STREAM_FORMAT = 'jpeg' # 实时画面默认编码: jpeg、webp 或 png（不转码）
+SCREEN_STREAM_QUALITY = 70 # 转码质量 1-100
+SCREEN_STREAM_SIZE = 1280 # 转码后画面长边的最大像素数
+SCREEN_STREAM_IDLE_TIMEOUT = 5 # 没有观看者超过该时间后停止截图循环，单位为秒
+SCREEN_STREAM_KEEPALIVE = 10 # 画面不变时重复发送最后一帧的间隔，单位为秒
+SCREENSHOT_MAX_AGE = 2 # /screenshot 直接返回不超过该时间的最新帧，单位为秒
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 5001
+SERVER_THREADS = 32 # 生产模式（waitress）的工作线程数，应大于下面各类请求上限之和
+MAX_CONCURRENT_TRANSFERS = 8 # 同时进行的文件下载/打包/上传请求数
+MAX_CONCURRENT_STREAMS = 8 # 同时保持的长连接（设备事件、实时画面）数
+REQUEST_QUEUE_TIMEOUT = 2 # 某类请求达到上限时最多等待的秒数，超时返回503
+# 设备I/O调度：interactive（目录/元数据）> thumbnail（可见缩略图、实时画面）> prefetch（后台预取）> bulk（文件传输）
+IO_CLASS_LIMITS = {'interactive': 4, 'thumbnail': 3, 'prefetch': 2, 'bulk': 2} # 每台设备各类别的并发上限
+IO_DEVICE_CONCURRENCY = 6 # 每台设备同时进行的adb操作数
+IO_TOTAL_CONCURRENCY = 16 # 所有设备合计同时进行的adb操作数
+IO_QUEUE_TIMEOUT = 120 # 等待I/O额度的最长时间，单位为秒
+IO_RATE_LIMITS = {} # 各类别的限速（字节/秒），例如 {'bulk': 20 * 1024 * 1024}
+IO_BUSY_RATE_LIMITS = {'bulk': 8 * 1024 * 1024, 'prefetch': 4 * 1024 * 1024} # 同一设备有更高优先级操作时的限速
+STREAM_CHUNK_SIZE = 64 * 1024
+THUMBNAIL_WORKERS = os.cpu_count() or 2 # 缩略图工作线程数，限制同时进行的拉取和ffmpeg进程
+THUMBNAIL_WAIT_TIMEOUT = 120 # 请求等待缩略图任务的最长时间，单位为秒
+THUMBNAIL_CACHE_DIR = os.path.join(DATA_DIR, '.cache_thumbnail')
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024 # 缩略图缓存容量上限，超出后按LRU淘汰
+THUMBNAIL_BACKGROUND_WORKERS = max(1, THUMBNAIL_WORKERS // 4) # 同时执行的预热任务数，前台请求始终优先
+THUMBNAIL_WARM_ON_LIST = True # 获取图片/视频列表后在后台预热缩略图
+THUMBNAIL_WARM_PAGES = 3 # 按显示顺序连续预热的页数（每页 PER_PAGE 个），之后的文件逐个间隔提交
+THUMBNAIL_WARM_REST_DELAY = 0.2 # 预热前几页之后的文件时，每个文件之间的间隔，单位为秒
+THUMBNAIL_SIZES = (128, 256, 960) # 缩略图尺寸档位（宽高都不超过该像素数），请求的尺寸向上取最接近的档位
+THUMBNAIL_SIZE = 960 # 未指定 size 时使用的档位
+THUMBNAIL_WARM_SIZE = 256 # 预热生成的档位，与网页网格使用的档位一致
+THUMBNAIL_WARM_FORMAT = 'webp' # 预热生成的格式，预热时没有请求的 Accept 头可以参考
+THUMBNAIL_WEBP_QUALITY = 75
+THUMBNAIL_BUNDLE_MAX_ITEMS = 200 # 缩略图包单次请求的最大文件数
+THUMBNAIL_MAX_AGE = 60 # 浏览器直接使用缩略图的时间，单位为秒，之后用ETag向服务端确认（源文件修改后自动更新）
+COMPRESS_MIN_SIZE = 1024 # 超过该大小的JSON/文本响应按 Accept-Encoding 压缩（br需要安装brotli，否则使用gzip）
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+HLS_CACHE_DIR = os.path.join(DATA_DIR, '.cache_hls')
+HLS_CACHE_MAX_BYTES = 2 * 1024**3 # HLS分段缓存容量上限，超出后按LRU淘汰
+HLS_SEGMENT_SECONDS = 4 # 每个分段的时长，单位为秒
+# 预览码率档位: 名称 -> (画面最大高度, 视频码率kbps, 音频码率kbps)，高度为None表示只转码音频
+HLS_PROFILES = {
+    '360p': (360, 800, 96),
+    '720p': (720, 2500, 128),
+    '1080p': (1080, 5000, 160),
+    'audio': (None, None, 128),
+}
+HLS_MAX_JOBS = 2 # 同时运行的转码进程数
+HLS_MAX_AHEAD = 10 # 转码进程最多领先播放位置的分段数，超出后停止，需要时再从请求位置启动
+HLS_IDLE_TIMEOUT = 30 # 超过该时间没有分段请求（没有人观看）时停止转码，单位为秒
+HLS_SEGMENT_TIMEOUT = 60 # 请求等待分段的最长时间，单位为秒
+HLS_LOOPBACK_URL = f'http://127.0.0.1:{SERVER_PORT}' # ffmpeg通过本服务的内部接口 /api/hls/source 读取设备文件（支持Range跳转），启动时按实际端口更新
+MEDIA_INDEX_DIR = os.path.join(DATA_DIR, '.media_index')
+MEDIA_INDEX_REFRESH_INTERVAL = 30 # 两次增量刷新媒体索引的最小间隔，单位为秒
+MEDIA_INDEX_DELETION_CHECK_INTERVAL = 300 # 检查设备上已删除媒体的间隔，单位为秒
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037)) # 与adb工具使用同一个环境变量
 LS_OUTPUT_REGEX = re.compile(
     r'^([d-])([rwxst-]{9})\s+(\d+)\s+(\S+)\s+(\S+)\s+(\d+\.?\d*[KMG]?)\s+(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2})\s+(.+)$'
 )
 LS_OUTPUT_ALT_REGEX = re.compile(
     r'^([d-])([rwxst-]{9})\s+(\d+)\s+(\S+)\s+(\S+)\s+(\s*\d+\.?\d*[KMG]?)\s+(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2})\s+(.+)$'
 )
-IMAGE_REGEX = re.compile(
-    r"Row: \d+ _id=(?P<_id>[^,]+),\s+"
-    r"_data=(?P<_data>[^,]+),\s+"
-    r"mime_type=(?P<mime_type>[^,]+),\s+"
-    r"_size=(?P<_size>[^,]+),\s+"
-    r"_display_name=(?P<_display_name>[^,]+),\s+"
-    r"width=(?P<width>[^,]+),\s+"
-    r"height=(?P<height>[^,]+),\s+"
-    r"date_added=(?P<date_added>[^,]+)"
-)
-AUDIO_REGEX = re.compile(
-    r"Row: \d+ _id=(?P<_id>[^,]+),\s+"
-    r"_data=(?P<_data>[^,]+),\s+"
-    r"mime_type=(?P<mime_type>[^,]+),\s+"
-    r"_size=(?P<_size>[^,]+),\s+"
-    r"_display_name=(?P<_display_name>[^,]+),\s+"
-    r"date_added=(?P<date_added>[^,]+)"
-)
+ROW_ID_REGEX = re.compile(r"Row: \d+ _id=(\d+)")
+MEDIA_VERSION_REGEX = re.compile(r"android\.intent\.extra\.TEXT=([^,}\]]+)")
+FFMPEG_DURATION_REGEX = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
 MIME_TYPES = {
     '.jpg': 'image/jpeg',
     '.jpeg': 'image/jpeg',
@@ -59,14 +153,76 @@ MEDIA_PROJECTIONS = {
     'video': '_id:_data:mime_type:_size:_display_name:width:height:date_added',
     'audio': '_id:_data:mime_type:_size:_display_name:date_added'
 }
+# 文档分类：(扩展名, MIME类型)，在设备端作为MediaStore查询条件过滤
+DOCUMENT_TYPES = {
+    'document': (
+        ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'odt', 'ods', 'odp'],
+        ['application/pdf', 'application/msword', 'application/vnd.ms-excel', 'application/vnd.ms-powerpoint',
+         'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+         'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+         'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+         'application/vnd.oasis.opendocument.text', 'application/vnd.oasis.opendocument.spreadsheet',
+         'application/vnd.oasis.opendocument.presentation']
+    ),
+    'zip': (
+        ['zip', 'rar', '7z', 'tar', 'gz'],
+        ['application/zip', 'application/x-rar-compressed', 'application/x-7z-compressed', 'application/x-tar',
+         'application/gzip']
+    ),
+    'apk': (['apk'], ['application/vnd.android.package-archive'])
+}
 
 # 初始化Flask应用
 app = Flask(__name__)
 
+# 慢请求按类别限制并发，保证普通接口始终有可用的处理线程
+request_limiter = ConcurrencyLimiter(app.wsgi_app, [
+    RequestClass('transfer', MAX_CONCURRENT_TRANSFERS, ['/api/file', '/api/archive', '/api/upload', 'PUT /api/uploads']),
+    RequestClass('stream', MAX_CONCURRENT_STREAMS, ['/api/device_events', '/api/screen_stream']),
+], REQUEST_QUEUE_TIMEOUT)
+app.wsgi_app = request_limiter
+
+# 运行指标（/metrics，Prometheus文本格式）
+metrics = MetricsRegistry()
+http_requests_in_flight = metrics.gauge('afs_http_requests_in_flight', '正在处理的HTTP请求数')
+http_request_seconds = metrics.histogram(
+    'afs_http_request_duration_seconds', '各路由的请求耗时（流式响应包含完整传输时间）', ['method', 'route', 'status'])
+adb_command_seconds = metrics.histogram('afs_adb_command_duration_seconds', 'adb操作耗时', ['verb'])
+ffmpeg_seconds = metrics.histogram('afs_ffmpeg_duration_seconds', '成功的ffmpeg转码耗时', ['kind'])
+device_bytes = metrics.counter('afs_device_bytes_total', '与设备之间传输的字节数', ['device', 'direction'])
+thumbnail_bundle_items = metrics.counter('afs_thumbnail_bundle_items_total', '缩略图包中的条目数（按结果）', ['result'])
+app.wsgi_app = RequestMetrics(app.wsgi_app, http_requests_in_flight, http_request_seconds)
+
+# 列表等较大的JSON响应压缩后再发送
+response_compressor = ResponseCompressor(COMPRESS_MIN_SIZE, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY)
+
+@app.after_request
+def compress_response(response):
+    return response_compressor.compress(request, response)
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 常驻adb shell会话池
+adb_sessions = AdbSessionPool(ADB_BIN, ADB_SESSIONS_PER_DEVICE)
+atexit.register(adb_sessions.close_all)
+
+# adb server socket客户端，server不可用时回退到adb命令
+adb_client = AdbClient(ADB_SERVER_HOST, ADB_SERVER_PORT)
+atexit.register(adb_client.close_all)
+
+# 设备I/O调度，避免大文件传输拖慢目录浏览
+io_scheduler = DeviceIOScheduler(IO_CLASS_LIMITS, IO_DEVICE_CONCURRENCY, IO_TOTAL_CONCURRENCY, IO_QUEUE_TIMEOUT,
+                                 IO_RATE_LIMITS, IO_BUSY_RATE_LIMITS)
+
+# 缩略图任务调度（相同文件的并发请求只生成一次）
+thumbnail_scheduler = ThumbnailScheduler(THUMBNAIL_WORKERS, THUMBNAIL_BACKGROUND_WORKERS)
+thumbnail_cache = ContentCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+
+# 设备文件本地缓存（按远程路径+大小+修改时间校验）
+file_cache = FileCache(STORAGE_DIR, FILE_CACHE_MAX_BYTES, FILE_CACHE_MAX_BYTES_PER_DEVICE, FILE_CACHE_POLICY)
+
 def parse_ls_output(ls_text, dir_path: str):
     """解析ls命令输出为结构化数据"""
     result = []
@@ -109,26 +265,64 @@ def parse_ls_output(ls_text, dir_path: str):
     
     return result
 
-def generate_thumbnail(media_path: str) -> str:
-    """为媒体文件生成缩略图"""
-    cache_dir = Path.cwd() / ".cache_thumbnail"
-    cache_dir.mkdir(exist_ok=True, parents=True)
-    
-    media_file = Path(media_path)
-    thumb_path = cache_dir / f"{media_file.stem}_thumb.jpg"
+def parse_sync_entries(entries, dir_path: str):
+    """把sync协议LIST结果转换为与parse_ls_output相同的结构（大小和时间为精确值）"""
+    result = []
+    dir_path = dir_path.rstrip('/') + '/'
     
-    if thumb_path.exists():
-        return str(thumb_path)
+    for entry in entries:
+        # 与 ls -l 保持一致：跳过隐藏文件和符号链接等特殊文件
+        if entry.name.startswith('.'):
+            continue
+        is_dir = stat.S_ISDIR(entry.mode)
+        if not is_dir and not stat.S_ISREG(entry.mode):
+            continue
+        
+        mime_type = 'inode/directory' if is_dir else mimetypes.guess_type(entry.name)[0] or 'application/octet-stream'
+        result.append({
+            "_data": dir_path + entry.name,
+            "_display_name": entry.name,
+            "_size": entry.size,
+            "date_added": str(entry.mtime),
+            "mime_type": mime_type,
+            "path": dir_path
+        })
     
+    result.sort(key=lambda item: item["_display_name"])
+    return result
+
+# 缩略图格式 -> (ffmpeg编码参数, MIME类型, 文件扩展名)；jpg 的参数与之前的单一尺寸缩略图相同，已有的缓存继续有效
+THUMBNAIL_FORMATS = {
+    'webp': (['-c:v', 'libwebp', '-quality', str(THUMBNAIL_WEBP_QUALITY)], 'image/webp', '.webp'),
+    'jpg': ([], 'image/jpeg', '.jpg'),
+}
+
+def thumbnail_params(size, image_format):
+    """参与缓存key计算，修改缩略图参数后旧缓存自动失效"""
+    return f'{size}:{image_format}'
+
+def thumbnail_size_tier(size):
+    """请求的尺寸向上取最接近的档位，超过最大档位时使用最大档位"""
+    return next((tier for tier in THUMBNAIL_SIZES if tier >= size), THUMBNAIL_SIZES[-1])
+
+def generate_thumbnail(media_path: str, cache_key: str, device_id: str, remote_path: str,
+                       size: int = THUMBNAIL_SIZE, image_format: str = 'jpg') -> str:
+    """为媒体文件生成缩略图并写入缓存"""
+    codec_args, _mime_type, ext = THUMBNAIL_FORMATS[image_format]
+    temp_path = thumbnail_cache.new_temp_path(ext)
     try:
+        started = time.perf_counter()
         subprocess.run([
             'ffmpeg', '-i', media_path,
-            '-vf', 'scale=960:960:force_original_aspect_ratio=decrease',
-            '-vframes', '1', '-y', '-loglevel', 'error', str(thumb_path)
+            '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+            *codec_args, '-vframes', '1', '-y', '-loglevel', 'error', temp_path
         ], check=True)
-        return str(thumb_path)
+        ffmpeg_seconds.observe(time.perf_counter() - started, kind='thumbnail')
+        return thumbnail_cache.put(cache_key, temp_path, device_id, remote_path)
     except (subprocess.CalledProcessError, FileNotFoundError, Exception) as e:
         logger.error(f"缩略图生成失败: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         return ""
 
 def ensure_directory(path):
@@ -147,14 +341,65 @@ def device_id_required(func):
         return func(*args, device_id=device_id, **kwargs)
     return wrapper
 
+def adb_command_verb(args):
+    """
+    adb命令在耗时指标中的标签：shell命令取命令名（content 再加上子命令），例如 'shell ls'、'shell content query'
+    其余取adb子命令，例如 'pull'
+    """
+    if args[0] in ('shell', 'exec-out', 'exec-in') and len(args) > 1:
+        words = ' '.join(args[1:]).split()
+        name = posixpath.basename(words[0])
+        if name == 'content' and len(words) > 1:
+            name = f'content {words[1]}'
+        return f'shell {name}'
+    return args[0]
+
+@contextmanager
+def adb_timer(verb):
+    """记录一次adb操作的耗时；adb server不可用时不记录，由随后回退的adb命令记录"""
+    started = time.perf_counter()
+    try:
+        yield
+    except AdbServerUnavailable:
+        raise
+    except BaseException:
+        adb_command_seconds.observe(time.perf_counter() - started, verb=verb)
+        raise
+    adb_command_seconds.observe(time.perf_counter() - started, verb=verb)
+
+def log_adb_command(full_cmd):
+    """逐条命令的日志只在DEBUG级别输出，未开启时不拼接字符串"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"执行ADB命令: {' '.join(full_cmd)}")
+
+def count_device_bytes(chunks, device_id, direction):
+    """转发数据块并计入设备传输字节数"""
+    try:
+        for chunk in chunks:
+            device_bytes.inc(len(chunk), device=device_id, direction=direction)
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
 def run_adb_command(command, device_id=None, timeout=ADB_TIMEOUT, capture_output=True):
-    """执行ADB命令的通用函数"""
-    base_cmd = ['adb']
+    """执行ADB命令的通用函数，指定设备时经过I/O调度（默认为交互类别）"""
+    args = command.split() if isinstance(command, str) else command
+    with io_scheduler.slot(device_id) if device_id else nullcontext(), adb_timer(adb_command_verb(args)):
+        return _run_adb_command(args, device_id, timeout, capture_output)
+
+def _run_adb_command(args, device_id, timeout, capture_output):
+    base_cmd = [ADB_BIN]
     if device_id:
         base_cmd.extend(['-s', device_id])
     
-    full_cmd = base_cmd + (command.split() if isinstance(command, str) else command)
-    logger.info(f"执行ADB命令: {' '.join(full_cmd)}")
+    full_cmd = base_cmd + args
+    log_adb_command(full_cmd)
+    
+    # shell命令走常驻会话，省去每次创建adb进程的开销
+    if device_id and capture_output and len(args) > 1 and args[0] == 'shell':
+        return run_shell_in_session(full_cmd, device_id, ' '.join(args[1:]), timeout)
     
     try:
         return subprocess.run(
@@ -173,45 +418,207 @@ def run_adb_command(command, device_id=None, timeout=ADB_TIMEOUT, capture_output
         logger.error(f"ADB命令超时: {e}")
         raise RuntimeError("ADB命令超时") from e
 
+def run_shell_in_session(full_cmd, device_id, shell_command, timeout):
+    """在常驻会话中执行shell命令，返回与subprocess.run一致的结果对象"""
+    try:
+        returncode, stdout, stderr = adb_sessions.run(device_id, shell_command, timeout)
+    except AdbSessionError as e:
+        logger.error(f"ADB命令执行失败: {e}")
+        raise RuntimeError(f"ADB命令失败: {e}") from e
+    except TimeoutError as e:
+        logger.error(f"ADB命令超时: {e}")
+        raise RuntimeError("ADB命令超时") from e
+    
+    if returncode != 0:
+        logger.error(f"ADB命令执行失败: {stderr}")
+        raise RuntimeError(f"ADB命令失败: {stderr}")
+    return subprocess.CompletedProcess(full_cmd, returncode, stdout, stderr)
+
 def pull_file_from_device(device_id, remote_path, local_path):
     """从设备拉取文件到本地"""
     try:
-        result = run_adb_command(['pull', remote_path, local_path], device_id)
+        with io_scheduler.slot(device_id, 'bulk'):
+            try:
+                with adb_timer('pull'):
+                    size = adb_client.pull(device_id, remote_path, local_path)
+                output = f"{remote_path}: 1 file pulled, {size} bytes"
+            except AdbServerUnavailable:
+                output = run_adb_command(['pull', remote_path, local_path], device_id).stdout
+                size = os.path.getsize(local_path)
+        device_bytes.inc(size, device=device_id, direction='read')
         logger.info(f"文件拉取成功: {remote_path} -> {local_path}")
-        return True, result.stdout
+        return True, output
     except Exception as e:
         error_msg = f"文件拉取失败: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
-def parse_adb_output(output, media_type='image'):
-    """解析adb命令输出的文本"""
-    result = []
-    regex = IMAGE_REGEX if media_type in ('image', 'video') else AUDIO_REGEX
-    
-    for line in output.splitlines():
-        match = regex.match(line)
-        if not match:
-            continue
+def stat_device_entry(device_id, remote_path):
+    """获取设备文件或目录的状态（SyncEntry），不存在时返回None"""
+    try:
+        with io_scheduler.slot(device_id), adb_timer('sync stat'):
+            return adb_client.stat(device_id, remote_path)
+    except AdbServerUnavailable:
+        pass
+    try:
+        result = run_adb_command(['shell', 'stat', '-c', "'%f %s %Y'", shlex.quote(remote_path)], device_id)
+    except RuntimeError:
+        return None
+    mode, size, mtime = result.stdout.split()
+    return SyncEntry(posixpath.basename(remote_path.rstrip('/')), int(mode, 16), int(size), int(mtime))
+
+def stat_device_file(device_id, remote_path):
+    """获取设备文件的 (大小, 修改时间)，文件不存在时返回None"""
+    entry = stat_device_entry(device_id, remote_path)
+    return (entry.size, entry.mtime) if entry else None
+
+def stat_device_files(device_id, remote_paths):
+    """批量获取设备文件的 (大小, 修改时间)，不存在的文件为None；通过adb server时所有文件只需一次往返"""
+    try:
+        with io_scheduler.slot(device_id), adb_timer('sync stat'):
+            entries = adb_client.stat_many(device_id, remote_paths)
+        return [(entry.size, entry.mtime) if entry else None for entry in entries]
+    except AdbServerUnavailable:
+        return [stat_device_file(device_id, remote_path) for remote_path in remote_paths]
+
+def stream_device_file(device_id, remote_path, start=0, length=None, io_class='bulk'):
+    """
+    流式读取设备文件，可指定起始偏移和长度；提前关闭生成器会中断传输
+    传输期间占用一个I/O额度（默认为bulk类别），并按类别限速
+    """
+    with io_scheduler.slot(device_id, io_class), adb_timer('shell tail' if start else 'pull'):
+        io_class = io_scheduler.current_class(io_class)
+        if start:
+            # sync RECV不支持偏移，改用tail从指定字节开始输出
+            command = f"tail -c +{start + 1} {shlex.quote(remote_path)}"
+            chunks = adb_client.exec_out(device_id, command, STREAM_CHUNK_SIZE)
+        else:
+            command = f"cat {shlex.quote(remote_path)}"
+            chunks = adb_client.pull_stream(device_id, remote_path)
+        try:
+            first = next(chunks, b'')
+        except AdbServerUnavailable:
+            chunks, first = _stream_adb_process(['exec-out', command], device_id), b''
+        chunks = io_scheduler.throttle(device_id, io_class, _prepend_chunk(first, chunks))
+        chunks = count_device_bytes(chunks, device_id, 'read')
+        
+        if length is None:
+            yield from chunks
+            return
         
+        remaining = length
         try:
-            item = match.groupdict()
-            # 转换数值类型字段
-            # int_fields = ['_id', '_size'] + (['width', 'height'] if media_type in ('image', 'video') else [])
-            # for key in int_fields:
-            #     if key in item:
-            #         item[key] = int(item[key])
-            
-            # 处理显示名称
-            if item['_display_name'] == 'NULL':
-                item['_display_name'] = item['_data'].split('/')[-1]
-            
-            # 添加路径信息
-            item['path'] = item['_data'][:item['_data'].rfind('/') + 1]
-            result.append(item)
-        except (ValueError, TypeError) as e:
-            logger.warning(f"解析行失败: {line} - {str(e)}")
+            for chunk in chunks:
+                if len(chunk) >= remaining:
+                    yield chunk[:remaining]
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+
+def _prepend_chunk(first, chunks):
+    try:
+        if first:
+            yield first
+        yield from chunks
+    finally:
+        chunks.close()
+
+def _stream_adb_process(command, device_id):
+    """通过adb进程流式读取输出，生成器关闭时结束进程"""
+    full_cmd = [ADB_BIN, '-s', device_id] + command
+    log_adb_command(full_cmd)
+    proc = subprocess.Popen(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for chunk in iter(lambda: proc.stdout.read(STREAM_CHUNK_SIZE), b''):
+            yield chunk
+    finally:
+        proc.kill()
+        proc.wait()
+
+def _tee_to_cache(chunks, device_id, remote_path, file_stat):
+    """转发数据的同时写入本地缓存，传输完整后才原子放入缓存"""
+    temp_file = file_cache.new_temp_path()
+    written = 0
+    try:
+        with file_cache.pinned(device_id, remote_path):
+            with open(temp_file, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    written += len(chunk)
+                    yield chunk
+            if written == file_stat[0]:
+                file_cache.commit(device_id, remote_path, temp_file, *file_stat)
+    finally:
+        chunks.close()
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def _if_range_matches(etag, mtime):
+    """If-Range 条件不满足时应返回完整文件"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(if_range.date.timestamp()) == mtime
+    return True
+
+def stream_file_response(device_id, remote_path, file_name, file_stat, tee_to_cache=False, io_class='bulk'):
+    """把设备文件流式返回给浏览器，支持Range/If-Range断点续传"""
+    size, mtime = file_stat
+    etag = f"{size}-{mtime}"
+    
+    byte_range = None
+    if request.range and _if_range_matches(etag, mtime):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+    
+    if byte_range:
+        start, stop = byte_range
+        body = stream_device_file(device_id, remote_path, start, stop - start, io_class)
+        response = Response(body, status=206, mimetype=get_mime_type(file_name), direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+    else:
+        body = stream_device_file(device_id, remote_path, io_class=io_class)
+        if tee_to_cache:
+            body = _tee_to_cache(body, device_id, remote_path, file_stat)
+        response = Response(body, mimetype=get_mime_type(file_name), direct_passthrough=True)
+        response.content_length = size
     
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(file_name)}"
+    response.set_etag(etag)
+    response.last_modified = mtime
+    return response
+
+def iter_media_rows(lines, columns, end_marker=None):
+    """流式解析content query输出，逐条返回ContentRow（补充显示名称和所在目录）"""
+    positions = {column: index for index, column in enumerate(columns + ['path'])}
+    data_index = positions['_data']
+    name_index = positions.get('_display_name')
+    for values in iter_content_rows(lines, columns, end_marker):
+        data = values[data_index]
+        if not data:
+            continue
+        # 处理显示名称
+        if name_index is not None and values[name_index] is None:
+            values[name_index] = data.split('/')[-1]
+        # 添加路径信息
+        values.append(data[:data.rfind('/') + 1])
+        yield ContentRow(positions, values)
+
+def parse_adb_output(output, media_type='image'):
+    """解析adb命令输出的文本"""
+    columns = MEDIA_PROJECTIONS.get(media_type, MEDIA_PROJECTIONS['audio']).split(':')
+    result = [
+        {key: 'NULL' if value is None else value for key, value in row.as_dict().items()}
+        for row in iter_media_rows(output.splitlines(), columns)
+    ]
     logger.info(f"成功解析 {len(result)} 个条目")
     return result
 
@@ -220,33 +627,74 @@ def get_mime_type(filename):
     _, ext = os.path.splitext(filename)
     return MIME_TYPES.get(ext.lower(), 'application/octet-stream')
 
-def download_or_get_local(device_id, category, file_path, file_name):
-    """下载文件或获取本地缓存路径"""
-    target_dir = os.path.join(STORAGE_DIR, device_id, category)
-    ensure_directory(target_dir)
+def download_or_get_local(device_id, file_path, file_stat=None):
+    """下载文件或获取本地缓存路径（缓存按远程文件大小和修改时间校验）"""
+    file_stat = file_stat or stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return None, f"文件不存在: {file_path}"
     
-    local_file = os.path.join(target_dir, file_name)
+    local_file = file_cache.lookup(device_id, file_path, *file_stat)
+    if local_file:
+        return local_file, ""
     
-    if not os.path.exists(local_file):
-        success, message = pull_file_from_device(device_id, file_path, local_file)
-        if not success or not os.path.exists(local_file):
+    with file_cache.pinned(device_id, file_path):
+        temp_file = file_cache.new_temp_path()
+        success, message = pull_file_from_device(device_id, file_path, temp_file)
+        if not success or not os.path.exists(temp_file):
             return None, message
-    
-    return local_file, ""
+        return file_cache.commit(device_id, file_path, temp_file, *file_stat), ""
+
+def stream_shell_lines(device_id, shell_command):
+    """流式执行shell命令，逐行返回输出（不等待命令结束）"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"流式执行ADB命令: {device_id} {shell_command}")
+    with io_scheduler.slot(device_id), adb_timer(adb_command_verb(['shell', shell_command])):
+        chunks = adb_client.exec_out(device_id, shell_command, STREAM_CHUNK_SIZE)
+        try:
+            first = next(chunks, b'')
+        except AdbServerUnavailable:
+            chunks, first = _stream_adb_process(['exec-out', shell_command], device_id), b''
+        yield from iter_lines(count_device_bytes(_prepend_chunk(first, chunks), device_id, 'read'))
 
-def get_media_list(device_id, media_type):
-    """通用媒体获取函数"""
+def get_media_list(device_id, media_type, where=None):
+    """
+    通用媒体获取函数，边读取adb输出边解析，逐条返回ContentRow
+    结果包含date_modified，供媒体索引增量同步
+    """
     if media_type not in MEDIA_URIS:
         raise ValueError(f"不支持的媒体类型: {media_type}")
     
-    adb_command = [
-        'shell', 'content', 'query',
-        '--uri', MEDIA_URIS[media_type],
-        '--projection', MEDIA_PROJECTIONS.get(media_type, MEDIA_PROJECTIONS['audio'])
-    ]
+    columns = MEDIA_PROJECTIONS.get(media_type, MEDIA_PROJECTIONS['audio']).split(':') + ['date_modified']
+    command = f"content query --uri {MEDIA_URIS[media_type]} --projection {':'.join(columns)}"
+    if where:
+        command += f" --where {shlex.quote(where)}"
+    # exec通道没有退出码，在输出末尾追加标记用于判断查询是否成功、输出是否完整
+    command += f" 2>&1; echo {QUERY_END_MARKER} $?"
     
+    yield from iter_media_rows(stream_shell_lines(device_id, command), columns, QUERY_END_MARKER)
+
+def get_media_ids(device_id, media_type):
+    """获取MediaStore中当前全部 _id，用于发现已删除的媒体"""
+    adb_command = ['shell', 'content', 'query', '--uri', MEDIA_URIS[media_type], '--projection', '_id']
     result = run_adb_command(adb_command, device_id)
-    return parse_adb_output(result.stdout, media_type)
+    return {int(match.group(1)) for match in ROW_ID_REGEX.finditer(result.stdout)}
+
+def get_media_store_version(device_id):
+    """获取MediaStore版本号（设备重置媒体库后会变化），获取失败返回None"""
+    adb_command = [
+        'shell', 'content', 'call', '--uri', 'content://media', '--method', 'get_version',
+        '--extra', 'android.intent.extra.TEXT:s:external_primary'
+    ]
+    try:
+        result = run_adb_command(adb_command, device_id, timeout=10)
+    except RuntimeError:
+        return None
+    match = MEDIA_VERSION_REGEX.search(result.stdout)
+    return match.group(1).strip() if match else None
+
+# 每台设备的MediaStore本地索引，列表接口直接读取
+media_index = MediaIndex(MEDIA_INDEX_DIR, get_media_list, get_media_ids, get_media_store_version,
+                         MEDIA_INDEX_REFRESH_INTERVAL, MEDIA_INDEX_DELETION_CHECK_INTERVAL)
 
 def handle_api_errors(func):
     """API错误处理装饰器"""
@@ -283,17 +731,122 @@ def delete_files(device_id):
     if not data:
         return {'error': 'Missing file'}, 400
 
-    # 在这里处理删除文件的逻辑
     logger.info(f"Deleting file: {data} from device: {device_id}")
-    # 调用ADB命令删除文件
-    adb_command = ['shell', 'rm', f'"{data}"']
-    run_adb_command(adb_command, device_id)
+    try:
+        result = run_batch_operations(device_id, [{'op': 'delete', 'path': data}])[0]
+    except BatchOperationError as e:
+        return {'error': str(e)}, 400
+    if not result['ok']:
+        return {'error': result['error']}, 500
 
     return {'message': 'Files deleted successfully'}, 200
 
+def run_batch_operations(device_id, operations):
+    """
+    在一次shell调用中执行全部文件操作，返回每个操作的结果列表
+    成功的操作随后在后台用一次shell调用批量更新MediaStore
+    """
+    operations = [normalize_operation(operation) for operation in operations]
+    result = run_adb_command(['shell', compile_batch(operations)], device_id)
+    results = parse_batch_results(result.stdout, operations)
+    
+    # 同步更新本地的缓存和索引
+    succeeded = [op for op, item in zip(operations, results) if item['ok']]
+    removed = [op['src'] for op in succeeded if op['op'] in ('delete', 'move', 'rename')]
+    added = [op['dst'] for op in succeeded if op['dst']]
+    for path in removed:
+        file_cache.invalidate(device_id, path)
+    if removed:
+        media_index.remove_paths(device_id, removed)
+    directory_tree.invalidate(device_id, removed + added + [op['src'] for op in succeeded if op['op'] == 'mkdir'])
+    
+    scan = media_scan_script(removed, added, MEDIA_URIS['file'])
+    if scan:
+        threading.Thread(target=update_media_store, args=(device_id, scan), daemon=True).start()
+    
+    failed = sum(not item['ok'] for item in results)
+    logger.info(f"批量文件操作: {device_id} {len(results)} 个, 失败 {failed} 个")
+    return results
+
+def update_media_store(device_id, scan_script):
+    try:
+        with io_scheduler.using('prefetch'):
+            run_adb_command(['shell', scan_script], device_id)
+    except RuntimeError as e:
+        logger.warning(f"更新MediaStore失败: {e}")
+
+@app.route('/api/batch', methods=['POST'])
+@device_id_required
+@handle_api_errors
+def batch_operations(device_id):
+    """
+    API: 批量文件操作，一次设备调用完成
+    JSON: {"operations": [{"op": "delete", "path": ..., "recursive": false}, {"op": "move"|"copy", "src": ..., "dst": ...},
+                          {"op": "rename", "path": ..., "name": ...}, {"op": "mkdir", "path": ...}]}
+    """
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Missing operations'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'Too many operations (max {BATCH_MAX_OPERATIONS})'}), 400
+    try:
+        results = run_batch_operations(device_id, operations)
+    except BatchOperationError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'results': results,
+        'succeeded': sum(item['ok'] for item in results),
+        'failed': sum(not item['ok'] for item in results)
+    })
+
+def push_device_file(device_id, chunks, remote_path, mtime=0):
+    """
+    把数据块直接写入设备文件（sync SEND），adb server不可用时通过 adb exec-in 写入
+    上传的数据来自浏览器，会话可能长时间等待数据，因此只限速、不占用I/O额度
+    """
+    chunks = count_device_bytes(io_scheduler.throttle(device_id, 'bulk', chunks), device_id, 'write')
+    try:
+        with adb_timer('push'):
+            adb_client.push_stream(device_id, chunks, remote_path, mtime=mtime)
+        return
+    except AdbServerUnavailable:
+        pass
+    command = f"mkdir -p {shlex.quote(posixpath.dirname(remote_path))} && cat > {shlex.quote(remote_path)}"
+    proc = subprocess.Popen([ADB_BIN, '-s', device_id, 'exec-in', command],
+                            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        with adb_timer('push'):
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+            proc.stdin.close()
+            returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    if returncode != 0:
+        raise RuntimeError(f"ADB命令失败: {proc.stderr.read().decode('utf-8', errors='ignore')}")
+
+def upload_target_path(category, filename, target_dir=None):
+    """上传文件在设备上的路径，返回 (完整路径, 所在目录)"""
+    filename = posixpath.basename(filename.replace('\\', '/'))
+    if not filename or filename in ('.', '..'):
+        raise ValueError('Invalid file name')
+    phone_dir = normalize_dir(target_dir) if target_dir else f'{UPLOAD_DIR}/{category}/'
+    return phone_dir + filename, phone_dir
+
+def on_upload_complete(session):
+    directory_tree.invalidate(session.device_id, [session.remote_path])
+
+# 分块上传会话（数据直接写入设备，不在本地落盘）
+upload_manager = UploadManager(push_device_file, UPLOAD_MAX_BUFFER_BYTES, UPLOAD_IDLE_TIMEOUT,
+                               on_complete=on_upload_complete)
+atexit.register(upload_manager.cancel_all)
+
 @app.route('/api/upload', methods=['POST'])
 @device_id_required
 def upload_file(device_id):
+    """API: 表单上传单个文件，边接收边写入设备"""
     category = request.args.get('category')
 
     if not category:
@@ -306,25 +859,83 @@ def upload_file(device_id):
     if file.filename == '':
         return {'error': 'No selected file'}, 400
 
-    if file:
-        if os.path.exists('uploads') is False:
-            os.makedirs('uploads')
-        if not os.path.exists(os.path.join('uploads', category)):
-            os.makedirs(os.path.join('uploads', category))
-        filepath = os.path.join('uploads', category, file.filename)
-        # Here, the actual file writing happens.
-        # For simplicity, we just save the file directly.
-        # The progress will be handled by XMLHttpRequest on the client-side.
-        file.save(filepath)
-        phone_path = f'/sdcard/PC/{category}/{file.filename}'
-        phone_dir = f'/sdcard/PC/{category}/'
-        adb_command = [
-            'push', f'{os.path.abspath(filepath)}', phone_path
-        ]
+    try:
+        phone_path, phone_dir = upload_target_path(category, file.filename)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    push_device_file(device_id, iter(lambda: file.stream.read(STREAM_CHUNK_SIZE), b''), phone_path)
+    directory_tree.invalidate(device_id, [phone_path])
+    return {'message': 'File uploaded successfully', 'filename': file.filename, 'phonedir': phone_dir}, 200
+
+@app.route('/api/uploads', methods=['POST'])
+@device_id_required
+@handle_api_errors
+def create_upload(device_id):
+    """
+    API: 创建分块上传会话
+    JSON: {"filename": "...", "size": 字节数, "mtime": 秒级时间戳(可选), "category": "...", "dir": 目标目录(可选)}
+    """
+    payload = request.get_json(silent=True) or {}
+    size = payload.get('size')
+    category = payload.get('category') or request.args.get('category')
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'Invalid size'}), 400
+    if not category and not payload.get('dir'):
+        return jsonify({'error': 'Missing category'}), 400
+    try:
+        phone_path, phone_dir = upload_target_path(category, payload.get('filename') or '', payload.get('dir'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-        result = run_adb_command(adb_command, device_id)
-        return {'message': 'File uploaded successfully', 'filename': file.filename, 'phonedir': phone_dir}, 200
+    session = upload_manager.create(device_id, phone_path, size, int(payload.get('mtime') or 0))
+    return jsonify({**session.status(), 'phonedir': phone_dir, 'chunk_size': 4 * 1024 * 1024})
+
+@app.route('/api/uploads', methods=['GET'])
+def list_uploads():
+    """API: 全部上传会话的进度"""
+    return jsonify([session.status() for session in upload_manager.list()])
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """API: 查询上传进度，received 即续传时下一块的偏移"""
+    session = upload_manager.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(session.status())
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """
+    API: 写入一块数据，?offset=块在文件中的起始偏移，请求体为原始字节
+    可以并行发送多个块，服务端按偏移顺序写入设备；最后一块返回时文件已写入完成
+    """
+    session = upload_manager.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'Invalid offset'}), 400
+    
+    try:
+        for chunk in iter(lambda: request.stream.read(STREAM_CHUNK_SIZE), b''):
+            session.write(offset, chunk)
+            offset += len(chunk)
+    except UploadError as e:
+        return jsonify({**session.status(), 'error': str(e)}), 409
+    
+    if session.received == session.size:
+        session.wait(ADB_TIMEOUT)
+    status = session.status()
+    return jsonify(status), 500 if status['state'] == 'failed' else 200
 
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """API: 取消上传"""
+    session = upload_manager.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    session.cancel()
+    return jsonify(session.status())
 
 @app.route('/api/file', methods=['GET'])
 @device_id_required
@@ -338,64 +949,436 @@ def get_file(device_id):
     if not all([file_path, category, file_name]):
         return jsonify({'error': 'Missing required parameters'}), 400
     
-    local_file, error = download_or_get_local(device_id, category, file_path, file_name)
+    file_stat = stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return jsonify({'error': 'File not found', 'details': file_path}), 404
+    size, mtime = file_stat
+    etag = f"{size}-{mtime}"
+    # 浏览器已有的副本仍然有效时不从设备读取
+    if is_not_modified(request, etag, mtime):
+        return not_modified_response(etag, mtime)
+    
+    local_file = file_cache.lookup(device_id, file_path, *file_stat)
     if not local_file:
-        return jsonify({'error': 'File transfer failed', 'details': error}), 500
+        if FILE_STREAM_MODE:
+            return stream_file_response(device_id, file_path, file_name, file_stat, FILE_STREAM_TEE_TO_CACHE)
+        local_file, error = download_or_get_local(device_id, file_path, file_stat)
+        if not local_file:
+            return jsonify({'error': 'File transfer failed', 'details': error}), 500
     
     try:
-        return send_file(local_file, as_attachment=True)
+        return send_file(local_file, as_attachment=True, download_name=file_name, conditional=True,
+                         etag=etag, last_modified=mtime)
     except Exception as e:
         logger.error(f"发送文件失败: {str(e)}")
         return jsonify({'error': f'Failed to send file: {str(e)}'}), 500
 
+def thumbnail_key(device_id, file_path, file_stat, size, image_format):
+    """缩略图的缓存key，同时用作ETag"""
+    return ContentCache.make_key(device_id, file_path, *file_stat, thumbnail_params(size, image_format))
+
+def cached_larger_thumbnail(device_id, file_path, file_stat, size):
+    """已缓存的更大档位的缩略图（任意格式），没有时返回None"""
+    for larger in THUMBNAIL_SIZES:
+        if larger <= size:
+            continue
+        for image_format in THUMBNAIL_FORMATS:
+            path = thumbnail_cache.get(thumbnail_key(device_id, file_path, file_stat, larger, image_format),
+                                       record_stats=False)
+            if path:
+                return path
+    return None
+
+def thumbnail_builder(device_id, file_path, file_stat, cache_key, size=THUMBNAIL_SIZE, image_format='jpg',
+                      io_class='thumbnail'):
+    """返回生成缩略图的任务函数，结果为 (缩略图路径, 错误信息)"""
+    def build_thumbnail():
+        # 排队期间可能已由其他任务生成
+        thumb_path = thumbnail_cache.get(cache_key, record_stats=False)
+        if thumb_path:
+            return thumb_path, None
+        # 已有更大档位的缩略图时直接缩小，不必从设备拉取原文件
+        larger = cached_larger_thumbnail(device_id, file_path, file_stat, size)
+        if larger:
+            thumb_path = generate_thumbnail(larger, cache_key, device_id, file_path, size, image_format)
+            if thumb_path:
+                return thumb_path, None
+        with file_cache.pinned(device_id, file_path), io_scheduler.using(io_class):
+            local_file, error = download_or_get_local(device_id, file_path, file_stat)
+            if not local_file:
+                return None, {'error': 'File transfer failed', 'details': error}
+            thumb_path = generate_thumbnail(local_file, cache_key, device_id, file_path, size, image_format)
+        if not thumb_path:
+            return None, {'error': 'Thumbnail generation failed'}
+        return thumb_path, None
+    return build_thumbnail
+
+def prepare_thumbnail_warm(device_id, file_path):
+    """预热单个文件：缩略图已缓存或文件不存在时返回None，否则返回 (缓存key, 生成函数)"""
+    with io_scheduler.using('prefetch'):
+        file_stat = stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return None
+    cache_key = thumbnail_key(device_id, file_path, file_stat, THUMBNAIL_WARM_SIZE, THUMBNAIL_WARM_FORMAT)
+    if thumbnail_cache.get(cache_key, record_stats=False):
+        return None
+    return cache_key, thumbnail_builder(device_id, file_path, file_stat, cache_key,
+                                        THUMBNAIL_WARM_SIZE, THUMBNAIL_WARM_FORMAT, 'prefetch')
+
+# 缩略图预热（后台优先级，前台请求同一文件时直接提升为前台任务）
+thumbnail_warmer = ThumbnailWarmer(prepare_thumbnail_warm, thumbnail_scheduler, rest_delay=THUMBNAIL_WARM_REST_DELAY)
+
+def warm_media_thumbnails(device_id, media_type, filters=None, restart=False):
+    """按与列表相同的排序和过滤条件预热缩略图"""
+    filters = dict(filters or {})
+
+    def list_paths():
+        items, _total, _cursor = media_index.query_media(device_id, media_type, **filters)
+        return [item['_data'] for item in items]
+
+    return thumbnail_warmer.start(device_id, media_type, tuple(sorted(filters.items())), list_paths,
+                                  THUMBNAIL_WARM_PAGES * PER_PAGE, restart)
+
+def thumbnail_format(requested=None):
+    """
+    选择缩略图格式，返回 (格式, 是否按Accept头选择)
+    未指定 format 时，浏览器在Accept头中明确列出 image/webp 才使用WebP（*/* 不算）
+    """
+    if requested:
+        if requested not in THUMBNAIL_FORMATS:
+            raise ValueError(f"不支持的缩略图格式: {requested}")
+        return requested, False
+    accepts_webp = any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+    return ('webp' if accepts_webp else 'jpg'), True
+
 @app.route('/api/thumbnail', methods=['GET'])
 @device_id_required
 @handle_api_errors
 def get_thumbnail(device_id):
-    """API: 获取设备文件缩略图"""
+    """API: 获取设备文件缩略图，size 指定所需的尺寸（取最接近的档位），format 为 webp|jpg，未指定时按Accept头选择"""
     file_path = request.args.get('file_path')
     category = request.args.get('category')
     file_name = request.args.get('file_name')
     
     if not all([file_path, category, file_name]):
         return jsonify({'error': 'Missing required parameters'}), 400
+    try:
+        image_format, negotiated = thumbnail_format(request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    size = thumbnail_size_tier(request.args.get('size', THUMBNAIL_SIZE, type=int))
     
-    local_file, error = download_or_get_local(device_id, category, file_path, file_name)
-    if not local_file:
-        return jsonify({'error': 'File transfer failed', 'details': error}), 500
+    file_stat = stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return jsonify({'error': 'File not found', 'details': file_path}), 404
+    cache_key = thumbnail_key(device_id, file_path, file_stat, size, image_format)
+    # 缓存key由文件路径、大小、修改时间和缩略图参数计算，源文件修改后ETag随之改变
+    _size, mtime = file_stat
+    cache_control = f'private, max-age={THUMBNAIL_MAX_AGE}'
+    if is_not_modified(request, cache_key, mtime):
+        response = not_modified_response(cache_key, mtime, cache_control)
+    else:
+        thumb_path = thumbnail_cache.get(cache_key)
+        if not thumb_path:
+            build_thumbnail = thumbnail_builder(device_id, file_path, file_stat, cache_key, size, image_format)
+            job = thumbnail_scheduler.submit(cache_key, build_thumbnail, request.args.get('group'))
+            try:
+                thumb_path, error = job.wait(THUMBNAIL_WAIT_TIMEOUT)
+            except ThumbnailJobCancelled:
+                return jsonify({'error': 'Thumbnail job cancelled'}), 409
+            except TimeoutError:
+                return jsonify({'error': 'Thumbnail job timed out'}), 504
+            if error:
+                return jsonify(error), 500
+        
+        try:
+            response = make_response(send_file(thumb_path, mimetype=THUMBNAIL_FORMATS[image_format][1],
+                                               etag=cache_key, last_modified=mtime))
+            response.headers['Cache-Control'] = cache_control
+        except Exception as e:
+            logger.error(f"发送缩略图失败: {str(e)}")
+            return jsonify({'error': f'Failed to send thumbnail: {str(e)}'}), 500
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
+def thumbnail_bundle_record(header, data=b''):
+    """缩略图包中的一条记录：4字节大端序的头部长度 + JSON头部 + 图片数据"""
+    header = json.dumps({**header, 'length': len(data)}, ensure_ascii=False).encode('utf-8')
+    return len(header).to_bytes(4, 'big') + header + data
+
+@app.route('/api/thumbnail/bundle', methods=['POST'])
+@device_id_required
+@handle_api_errors
+def get_thumbnail_bundle(device_id):
+    """
+    API: 一次请求获取一页文件的缩略图，已缓存的先返回，其余按完成顺序流式返回
+    JSON: {"files": [{"file_path": ..., "etag": 客户端已有的版本（可选）}], "size": 256, "format": "webp"|"jpg", "group": ...}
+    响应由连续的记录组成（见 thumbnail_bundle_record），头部为 {"index", "file_path", "etag", "mime_type", "length"}，
+    客户端的版本仍然有效时为 {"index", "file_path", "etag", "not_modified": true}，失败时为 {"index", "file_path", "error"}
+    """
+    payload = request.get_json(silent=True) or {}
+    files = payload.get('files')
+    if not isinstance(files, list) or not files:
+        return jsonify({'error': 'Missing files'}), 400
+    if len(files) > THUMBNAIL_BUNDLE_MAX_ITEMS:
+        return jsonify({'error': f'Too many files (max {THUMBNAIL_BUNDLE_MAX_ITEMS})'}), 400
+    if not all(isinstance(item, dict) and isinstance(item.get('file_path'), str) for item in files):
+        return jsonify({'error': 'Invalid files'}), 400
+    try:
+        image_format, negotiated = thumbnail_format(payload.get('format'))
+        size = thumbnail_size_tier(int(payload.get('size', THUMBNAIL_SIZE)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    mime_type = THUMBNAIL_FORMATS[image_format][1]
+    group = payload.get('group')
+
+    def thumbnail_record(index, file_path, cache_key, thumb_path):
+        try:
+            with open(thumb_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            # 读取前被淘汰
+            thumbnail_bundle_items.inc(result='error')
+            return thumbnail_bundle_record({'index': index, 'file_path': file_path, 'error': str(e)})
+        return thumbnail_bundle_record(
+            {'index': index, 'file_path': file_path, 'etag': cache_key, 'mime_type': mime_type}, data)
+
+    def records():
+        deadline = time.monotonic() + THUMBNAIL_WAIT_TIMEOUT
+        pending = []
+        file_stats = stat_device_files(device_id, [item['file_path'] for item in files])
+        for index, (item, file_stat) in enumerate(zip(files, file_stats)):
+            file_path = item['file_path']
+            if file_stat is None:
+                thumbnail_bundle_items.inc(result='error')
+                yield thumbnail_bundle_record({'index': index, 'file_path': file_path, 'error': 'File not found'})
+                continue
+            cache_key = thumbnail_key(device_id, file_path, file_stat, size, image_format)
+            if item.get('etag') == cache_key:
+                thumbnail_bundle_items.inc(result='not_modified')
+                yield thumbnail_bundle_record(
+                    {'index': index, 'file_path': file_path, 'etag': cache_key, 'not_modified': True})
+                continue
+            thumb_path = thumbnail_cache.get(cache_key)
+            if thumb_path:
+                thumbnail_bundle_items.inc(result='hit')
+                yield thumbnail_record(index, file_path, cache_key, thumb_path)
+                continue
+            # 未缓存的文件立即提交，在发送后面已缓存的缩略图时就开始生成
+            build_thumbnail = thumbnail_builder(device_id, file_path, file_stat, cache_key, size, image_format)
+            pending.append((index, file_path, cache_key, thumbnail_scheduler.submit(cache_key, build_thumbnail, group)))
+
+        while pending:
+            # 先发送已经完成的任务，都未完成时等待最早提交的任务
+            ready = [entry for entry in pending if entry[3].done] or pending[:1]
+            for entry in ready:
+                pending.remove(entry)
+                index, file_path, cache_key, job = entry
+                try:
+                    thumb_path, error = job.wait(max(0, deadline - time.monotonic()))
+                except ThumbnailJobCancelled:
+                    thumb_path, error = None, {'error': 'Thumbnail job cancelled'}
+                except TimeoutError:
+                    thumb_path, error = None, {'error': 'Thumbnail job timed out'}
+                if error:
+                    thumbnail_bundle_items.inc(result='error')
+                    yield thumbnail_bundle_record({'index': index, 'file_path': file_path, **error})
+                else:
+                    thumbnail_bundle_items.inc(result='generated')
+                    yield thumbnail_record(index, file_path, cache_key, thumb_path)
+
+    response = Response(records(), mimetype='application/x-thumbnail-bundle')
+    response.headers['Cache-Control'] = 'no-store'
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
+@app.route('/api/thumbnail/cancel', methods=['POST'])
+def cancel_thumbnails():
+    """API: 取消某个分组（页面网格）中尚未开始的缩略图任务"""
+    group = request.args.get('group')
+    if not group:
+        return jsonify({'error': 'Missing group'}), 400
+    return jsonify({'cancelled': thumbnail_scheduler.cancel_group(group)})
+
+@app.route('/api/thumbnail/warm', methods=['GET', 'POST', 'DELETE'])
+@device_id_required
+@handle_api_errors
+def thumbnail_warm(device_id):
+    """
+    API: 缩略图预热
+    POST 为设备的图片和视频（或 type 指定的类型）重新开始预热，GET 查看进度，DELETE 取消
+    """
+    media_types = [request.args['type']] if request.args.get('type') else ['image', 'video']
+    if any(media_type not in ('image', 'video') for media_type in media_types):
+        return jsonify({'error': 'Invalid media type'}), 400
+    if request.method == 'POST':
+        for media_type in media_types:
+            warm_media_thumbnails(device_id, media_type, restart=True)
+    elif request.method == 'DELETE':
+        for media_type in media_types:
+            thumbnail_warmer.cancel(device_id, media_type)
+    return jsonify(thumbnail_warmer.status(device_id))
+
+@app.route('/api/thumbnail/stats', methods=['GET'])
+def thumbnail_stats():
+    """API: 缩略图任务队列和缓存状态"""
+    return jsonify({**thumbnail_scheduler.stats(), 'cache': thumbnail_cache.stats()})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """API: 文件缓存和缩略图缓存状态"""
+    return jsonify({'files': file_cache.stats(), 'thumbnails': thumbnail_cache.stats(), 'hls': hls_segment_cache.stats()})
+
+@app.route('/api/io/status', methods=['GET'])
+def io_status():
+    """API: 各设备I/O调度队列状态（进行中、排队、平均等待时间、传输字节数）"""
+    return jsonify(io_scheduler.status())
+
+@app.route('/api/server/stats', methods=['GET'])
+def server_stats():
+    """API: 各类慢请求的并发上限、进行中和被拒绝的数量"""
+    return jsonify(request_limiter.stats())
+
+def collect_component_metrics():
+    """抓取时从各组件的统计中读取缓存命中、队列和并发情况"""
+    caches = {'file': file_cache.stats(), 'thumbnail': thumbnail_cache.stats(), 'hls': hls_segment_cache.stats()}
+    hls = hls_transcoder.stats()
+    thumbnails = thumbnail_scheduler.stats()
+    limiter = request_limiter.stats()
+    io_devices = io_scheduler.status()['devices']
+    compression = response_compressor.stats()
+    io_samples = [
+        ({'device': device_id, 'class': name}, stats)
+        for device_id, device in io_devices.items() for name, stats in device['classes'].items()
+    ]
+    return [
+        ('afs_cache_hits_total', 'counter', '缓存命中次数',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('afs_cache_misses_total', 'counter', '缓存未命中次数',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('afs_cache_evictions_total', 'counter', '缓存淘汰次数',
+         [({'cache': name}, stats['evictions']) for name, stats in caches.items()]),
+        ('afs_cache_bytes', 'gauge', '缓存占用的字节数',
+         [({'cache': name}, stats['total_bytes']) for name, stats in caches.items()]),
+        ('afs_thumbnail_jobs_total', 'counter', '缩略图任务数（按结果）',
+         [({'result': result}, thumbnails[result])
+          for result in ('submitted', 'coalesced', 'completed', 'failed', 'cancelled')]),
+        ('afs_thumbnail_queue_depth', 'gauge', '排队中的缩略图任务数',
+         [({'priority': 'foreground'}, thumbnails['queue_depth']),
+          ({'priority': 'background'}, thumbnails['background_queue_depth'])]),
+        ('afs_thumbnail_jobs_running', 'gauge', '正在执行的缩略图任务数',
+         [({'priority': 'foreground'}, thumbnails['running'] - thumbnails['background_running']),
+          ({'priority': 'background'}, thumbnails['background_running'])]),
+        ('afs_request_class_active', 'gauge', '各类慢请求正在处理的数量',
+         [({'class': name}, stats['active']) for name, stats in limiter.items()]),
+        ('afs_request_class_rejected_total', 'counter', '各类慢请求因达到上限被拒绝的次数',
+         [({'class': name}, stats['rejected']) for name, stats in limiter.items()]),
+        ('afs_device_io_active', 'gauge', '各设备正在进行的adb操作数',
+         [(labels, stats['active']) for labels, stats in io_samples]),
+        ('afs_device_io_waiting', 'gauge', '各设备等待I/O额度的adb操作数',
+         [(labels, stats['waiting']) for labels, stats in io_samples]),
+        ('afs_hls_jobs_running', 'gauge', '正在运行的HLS转码进程数', [({}, hls['running'])]),
+        ('afs_hls_segments_total', 'counter', '转码完成的HLS分段数', [({}, hls['segments'])]),
+        ('afs_http_compressed_responses_total', 'counter', '压缩后发送的响应数',
+         [({}, compression['responses'])]),
+        ('afs_http_compression_bytes_total', 'counter', '压缩前后的响应体字节数',
+         [({'stage': 'in'}, compression['bytes_in']), ({'stage': 'out'}, compression['bytes_out'])]),
+    ]
+
+metrics.register_collector(collect_component_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus指标：adb/ffmpeg耗时、设备传输量、缓存命中、进行中的请求和各路由耗时"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+def media_list_response(device_id, media_type):
+    """
+    媒体列表响应，支持排序和过滤: sort=_id|date_added|_size|name, order=asc|desc,
+    mime, folder, recursive, date_from, date_to
+    传入limit或cursor时返回分页结构 {items, total, next_cursor}，否则返回完整数组并在X-Total-Count中给出总数
+    ETag为媒体索引的内容代数，索引没有变化时直接返回304，不查询也不生成列表
+    """
+    args = request.args
+    etag = listing_etag(media_type, media_index.generation(device_id, media_type))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, cache_control=LISTING_CACHE_CONTROL)
+    paginated = 'limit' in args or 'cursor' in args
+    limit = min(args.get('limit', PER_PAGE, type=int), MAX_PER_PAGE) if paginated else None
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'Invalid limit'}), 400
     
+    filters = {
+        'sort': args.get('sort', '_id'),
+        'order': args.get('order', 'asc'),
+        'mime': args.get('mime'),
+        'folder': args.get('folder'),
+        'recursive': args.get('recursive') in ('1', 'true'),
+        'date_from': args.get('date_from', type=int),
+        'date_to': args.get('date_to', type=int)
+    }
     try:
-        thumb_path = generate_thumbnail(local_file)
-        if not thumb_path:
-            return jsonify({'error': 'Thumbnail generation failed'}), 500
-            
-        response = make_response(send_file(thumb_path, mimetype='image/jpeg'))
-        response.headers['Cache-Control'] = 'public, max-age=86400'
-        return response
-    except Exception as e:
-        logger.error(f"发送缩略图失败: {str(e)}")
-        return jsonify({'error': f'Failed to send thumbnail: {str(e)}'}), 500
+        items, total, next_cursor = media_index.query_media(
+            device_id, media_type, **filters, limit=limit, cursor=args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 首次打开列表时按相同顺序在后台预热缩略图，翻页请求不重复触发
+    if THUMBNAIL_WARM_ON_LIST and media_type in ('image', 'video') and not args.get('cursor'):
+        warm_media_thumbnails(device_id, media_type, filters)
+    
+    if paginated:
+        return conditional_response(request, jsonify({'items': items, 'total': total, 'next_cursor': next_cursor}), etag)
+    response = jsonify(items)
+    response.headers['X-Total-Count'] = str(total)
+    return conditional_response(request, response, etag)
 
 @app.route('/api/get_images', methods=['GET'])
 @device_id_required
 @handle_api_errors
 def get_images(device_id):
     """API: 获取设备图像列表"""
-    return jsonify(get_media_list(device_id, 'image'))
+    return media_list_response(device_id, 'image')
 
 @app.route('/api/get_videos', methods=['GET'])
 @device_id_required
 @handle_api_errors
 def get_videos(device_id):
     """API: 获取设备视频列表"""
-    return jsonify(get_media_list(device_id, 'video'))
+    return media_list_response(device_id, 'video')
 
 @app.route('/api/get_audios', methods=['GET'])
 @device_id_required
 @handle_api_errors
 def get_audios(device_id):
     """API: 获取设备音频列表"""
-    return jsonify(get_media_list(device_id, 'audio'))
+    return media_list_response(device_id, 'audio')
+
+@app.route('/api/media_index/resync', methods=['POST'])
+@device_id_required
+@handle_api_errors
+def resync_media_index(device_id):
+    """API: 手动全量同步媒体索引"""
+    media_type = request.args.get('type')
+    if media_type and media_type not in MEDIA_PROJECTIONS:
+        return jsonify({'error': 'Invalid media type'}), 400
+    media_index.resync(device_id, media_type)
+    return jsonify(media_index.status(device_id))
+
+@app.route('/api/media_index/status', methods=['GET'])
+@device_id_required
+def media_index_status(device_id):
+    """API: 媒体索引状态"""
+    return jsonify(media_index.status(device_id))
+
+def document_where(document_type):
+    """文档分类对应的MediaStore查询条件（扩展名不区分大小写，或MIME类型匹配）"""
+    extensions, mime_types = DOCUMENT_TYPES[document_type]
+    conditions = [f"_display_name LIKE '%.{extension}'" for extension in extensions]
+    conditions.append(f"mime_type IN ({', '.join(repr(mime_type) for mime_type in mime_types)})")
+    return ' OR '.join(conditions)
 
 @app.route('/api/get_documents', methods=['GET'])
 @device_id_required
@@ -403,58 +1386,440 @@ def get_audios(device_id):
 def get_documents(device_id):
     """API: 获取设备文档列表"""
     document_type = request.args.get('document_type', 'document')
-    suffix_map = {
-        'document': r"'\.(pdf|doc|docx|xls|xlsx|ppt|pptx|txt|odt|ods|odp)'",
-        'zip': r"'\.(zip|rar|7z|tar|gz)'",
-        'apk': r"'\.(apk)'"
-    }
-    
-    if document_type not in suffix_map:
+    if document_type not in DOCUMENT_TYPES:
         return jsonify({'error': 'Invalid document type'}), 400
     
-    adb_command = [
-        'shell', f"content query --uri {MEDIA_URIS['file']} --projection {MEDIA_PROJECTIONS['audio']} | grep -E {suffix_map[document_type]}"
+    # 过滤条件交给MediaStore执行，只传输匹配的行
+    document_data = [
+        {key: 'NULL' if value is None else value for key, value in row.as_dict().items() if key != 'date_modified'}
+        for row in get_media_list(device_id, 'file', document_where(document_type))
     ]
-    
-    result = run_adb_command(adb_command, device_id)
-    document_data = parse_adb_output(result.stdout, media_type='document')
-    return jsonify(document_data)
+    # 每次都从设备查询，ETag为响应体的哈希，内容不变时只节省传输
+    return conditional_response(request, jsonify(document_data))
+
+@app.route('/api/search', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def search_files(device_id):
+    """API: 按文件名搜索设备文件（q 为不区分大小写的子串），读取本地文件名索引"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    limit = min(request.args.get('limit', PER_PAGE, type=int), MAX_PER_PAGE)
+    if limit <= 0:
+        return jsonify({'error': 'Invalid limit'}), 400
+    items, total = media_index.search(device_id, query, limit)
+    response = jsonify(items)
+    response.headers['X-Total-Count'] = str(total)
+    return response
 
 @app.route('/api/get_files', methods=['GET'])
 @device_id_required
 @handle_api_errors
 def get_files(device_id):
-    """API: 获取设备文件列表"""
+    """API: 获取设备文件列表（tree模式下文件夹的大小为其全部内容的总大小）"""
     path = request.args.get('path', '/sdcard/').rstrip('/') + '/'
-    adb_command = ['shell', "ls", "-lh", f"'{path}'"]
+    if request.args.get('mode', FILE_LIST_MODE) == 'tree':
+        path = normalize_dir(path)
+        try:
+            # 快照没有变化时直接返回304
+            etag = listing_etag('tree', directory_tree.version(device_id, path, refresh=request.args.get('refresh') == '1'))
+            if is_not_modified(request, etag):
+                return not_modified_response(etag, cache_control=LISTING_CACHE_CONTROL)
+            entries, folder_sizes = directory_tree.list(device_id, path)
+        except RuntimeError as e:
+            logger.warning(f"获取目录快照失败，改为列出单个目录: {e}")
+        else:
+            result = parse_sync_entries(entries, dir_path=path)
+            for item in result:
+                if item['mime_type'] == 'inode/directory':
+                    item['_size'] = folder_sizes.get(item['_data'] + '/', 0)
+            return conditional_response(request, jsonify(result), etag)
+    return conditional_response(request, jsonify(list_device_dir(device_id, path)))
+
+@app.route('/api/folder_size', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def get_folder_size(device_id):
+    """API: 获取文件夹（含子目录）的总大小"""
+    path = normalize_dir(request.args.get('path', '/sdcard/'))
+    return jsonify({'path': path, 'size': directory_tree.folder_size(device_id, path)})
+
+def fetch_tree_snapshot(device_id, root):
+    """
+    一次shell命令获取整个子树（find + stat），大小为精确字节数，时间为秒级时间戳
+    跳过隐藏文件及隐藏目录；设备不支持时回退到逐个目录sync LIST
+    """
+    dirs = {root: []}
+    command = (
+        f"find {shlex.quote(root)} -mindepth 1 -name '.*' -prune -o -exec stat -c '%f %s %Y %n' {{}} + 2>/dev/null; "
+        f"echo {QUERY_END_MARKER} $?"
+    )
+    returncode = None
+    for line in stream_shell_lines(device_id, command):
+        if line.startswith(QUERY_END_MARKER):
+            returncode = line[len(QUERY_END_MARKER):].strip()
+            break
+        try:
+            mode, size, mtime, name = line.split(' ', 3)
+            entry_path = posixpath.normpath(name)
+            entry = SyncEntry(posixpath.basename(entry_path), int(mode, 16), int(size), int(mtime))
+        except ValueError:
+            continue
+        dirs.setdefault(normalize_dir(posixpath.dirname(entry_path)), []).append(entry)
+        if stat.S_ISDIR(entry.mode):
+            dirs.setdefault(entry_path + '/', [])
     
-    result = run_adb_command(adb_command, device_id)
-    files_data = parse_ls_output(result.stdout, dir_path=path)
-    return jsonify(files_data)
+    # find部分目录无权限时退出码也非0，只有完全没有输出时才认为命令不可用
+    if returncode is None or (returncode != '0' and len(dirs) == 1 and not dirs[root]):
+        logger.warning(f"find/stat获取子树失败(退出码 {returncode})，改用sync LIST遍历: {root}")
+        return walk_tree_snapshot(device_id, root)
+    return dirs
+
+def list_dir_entries(device_id, path):
+    """通过sync LIST列出目录（SyncEntry列表）"""
+    with io_scheduler.slot(device_id), adb_timer('sync list'):
+        return adb_client.list_dir(device_id, path)
+
+def walk_tree_snapshot(device_id, root):
+    """通过sync LIST逐个目录遍历子树"""
+    dirs = {}
+    pending = [root]
+    while pending:
+        dir_path = pending.pop()
+        entries = [entry for entry in list_dir_entries(device_id, dir_path) if not entry.name.startswith('.')]
+        dirs[dir_path] = entries
+        pending.extend(dir_path + entry.name + '/' for entry in entries if stat.S_ISDIR(entry.mode))
+    return dirs
+
+# 目录子树快照缓存，目录浏览和文件夹大小统计在本地完成
+directory_tree = DirectoryTreeCache(fetch_tree_snapshot, list_dir_entries, DIRECTORY_TREE_TTL)
+
+def list_device_dir(device_id, path):
+    """列出设备目录，优先使用sync协议获取精确的大小和时间"""
+    try:
+        return parse_sync_entries(list_dir_entries(device_id, path), dir_path=path)
+    except AdbServerUnavailable:
+        adb_command = ['shell', "ls", "-lh", f"'{path}'"]
+        result = run_adb_command(adb_command, device_id)
+        return parse_ls_output(result.stdout, dir_path=path)
+
+def collect_archive_entries(device_id, paths):
+    """把选中的文件和文件夹展开为归档条目，归档内名称相对于各自的上级目录"""
+    entries = []
+    for remote_path in paths:
+        remote_path = posixpath.normpath(remote_path)
+        base = posixpath.dirname(remote_path).rstrip('/') + '/'
+        entry = stat_device_entry(device_id, remote_path)
+        if entry is None:
+            raise FileNotFoundError(remote_path)
+        if not stat.S_ISDIR(entry.mode):
+            entries.append(ArchiveEntry(entry.name, remote_path, entry.size, entry.mtime, False))
+            continue
+        
+        entries.append(ArchiveEntry(entry.name, remote_path, 0, entry.mtime, True))
+        for dir_path, children in directory_tree.walk(device_id, remote_path):
+            for child in sorted(children, key=lambda item: item.name):
+                child_path = dir_path + child.name
+                is_dir = stat.S_ISDIR(child.mode)
+                if is_dir or stat.S_ISREG(child.mode):
+                    entries.append(ArchiveEntry(child_path[len(base):], child_path, child.size, child.mtime, is_dir))
+    return entries
+
+@app.route('/api/archive', methods=['GET', 'POST'])
+@device_id_required
+@handle_api_errors
+def download_archive(device_id):
+    """
+    API: 把多个文件或文件夹打包为 tar/zip 并边打包边下载
+    GET: ?path=...&path=...&format=zip|tar；POST: {"paths": [...], "format": "zip"}
+    """
+    payload = request.get_json(silent=True) or {}
+    paths = payload.get('paths') or request.args.getlist('path')
+    archive_format = payload.get('format') or request.args.get('format', 'zip')
+    if not paths:
+        return jsonify({'error': 'Missing path'}), 400
+    if archive_format not in ARCHIVE_MIME_TYPES:
+        return jsonify({'error': 'Invalid archive format'}), 400
+    
+    try:
+        entries = collect_archive_entries(device_id, paths)
+    except FileNotFoundError as e:
+        return jsonify({'error': f'File not found: {e}'}), 404
+    
+    def open_entry(entry):
+        return stream_device_file(device_id, entry.remote_path)
+    
+    files = iter_file_contents(entries, open_entry, ARCHIVE_PARALLEL_FETCH, ARCHIVE_PREFETCH_MAX_BYTES)
+    name = payload.get('name') or request.args.get('name') or (
+        posixpath.basename(posixpath.normpath(paths[0])) if len(paths) == 1 else 'files')
+    logger.info(f"打包下载: {device_id} {len(entries)} 个条目, {sum(e.size for e in entries)} 字节")
+    
+    response = Response(iter_archive(archive_format, files), mimetype=ARCHIVE_MIME_TYPES[archive_format])
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(f'{name}.{archive_format}')}"
+    return response
+
+def capture_screen(device_id):
+    """截取设备屏幕，返回PNG数据"""
+    with io_scheduler.slot(device_id, 'thumbnail'), adb_timer('shell screencap'):
+        try:
+            data = b''.join(adb_client.exec_out(device_id, 'screencap -p'))
+        except AdbServerUnavailable:
+            data = subprocess.run(
+                [ADB_BIN, '-s', device_id, 'exec-out', 'screencap', '-p'],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=10
+            ).stdout
+    device_bytes.inc(len(data), device=device_id, direction='read')
+    return data
+
+SCREEN_CODECS = {
+    'jpeg': (['-c:v', 'mjpeg', '-pix_fmt', 'yuvj420p'], 'image/jpeg'),
+    'webp': (['-c:v', 'libwebp'], 'image/webp'),
+}
+
+def encode_screen_frame(data, image_format, quality, size):
+    """用ffmpeg把PNG截图缩放并转码为JPEG/WebP，ffmpeg不可用或转码失败时返回原始PNG"""
+    codec_args, mime_type = SCREEN_CODECS[image_format]
+    if image_format == 'jpeg':
+        # mjpeg的 -q:v 范围为 2（最好）到 31
+        quality_args = ['-q:v', str(round(2 + (100 - quality) * 29 / 100))]
+    else:
+        quality_args = ['-quality', str(quality)]
+    try:
+        started = time.perf_counter()
+        result = subprocess.run([
+            'ffmpeg', '-loglevel', 'error', '-f', 'png_pipe', '-i', 'pipe:0',
+            '-vf', f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease",
+            *codec_args, *quality_args, '-frames:v', '1', '-f', 'image2pipe', 'pipe:1'
+        ], input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=10)
+        ffmpeg_seconds.observe(time.perf_counter() - started, kind='screen')
+        return result.stdout, mime_type
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+        logger.warning(f"画面转码失败，返回PNG: {e}")
+        return data, 'image/png'
+
+# 实时画面：每台设备一个截图循环，所有观看者共享截图和转码结果
+screen_streams = ScreenStreamManager(capture_screen, SCREEN_STREAM_FPS, SCREEN_STREAM_IDLE_TIMEOUT)
+
+def screen_encode_params():
+    """从请求参数读取 (格式, 质量, 尺寸)，png表示不转码返回None"""
+    image_format = request.args.get('format', SCREEN_STREAM_FORMAT)
+    if image_format == 'png':
+        return None
+    if image_format not in SCREEN_CODECS:
+        raise ValueError(f"不支持的画面格式: {image_format}")
+    quality = min(max(request.args.get('quality', SCREEN_STREAM_QUALITY, type=int), 1), 100)
+    size = min(max(request.args.get('size', SCREEN_STREAM_SIZE, type=int), 16), 4096)
+    return image_format, quality, size
 
 @app.route('/screenshot/<device_id>')
 @handle_api_errors
 def get_screenshot(device_id):
-    """获取设备截图"""
-    command = f"adb -s {device_id} exec-out screencap -p"
-    result = subprocess.run(
-        command.split(),
-        check=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        timeout=10
-    )
-    return Response(result.stdout, mimetype='image/png')
+    """获取设备截图，默认返回原始PNG，format=jpeg|webp 时转码"""
+    try:
+        params = screen_encode_params() if 'format' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    frame = screen_streams.grab(device_id, SCREENSHOT_MAX_AGE)
+    data, mime_type = frame.encode(encode_screen_frame, params)
+    response = Response(data, mimetype=mime_type)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-def get_device_name(device_id):
-    """获取设备名称"""
-    result = run_adb_command('shell getprop ro.product.model', device_id)
-    return result.stdout.strip()
+@app.route('/api/screen_stream', methods=['GET'])
+@device_id_required
+def screen_stream(device_id):
+    """API: 实时画面（multipart/x-mixed-replace，可直接作为<img>的src）"""
+    try:
+        params = screen_encode_params()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fps = request.args.get('fps', SCREEN_STREAM_FPS, type=float)
+    min_interval = 1 / fps if fps > 0 else 0
+
+    def generate():
+        for frame in screen_streams.frames(device_id, min_interval, SCREEN_STREAM_KEEPALIVE):
+            data, mime_type = frame.encode(encode_screen_frame, params)
+            yield (
+                f"--frame\r\nContent-Type: {mime_type}\r\nContent-Length: {len(data)}\r\n\r\n".encode('ascii')
+                + data + b"\r\n"
+            )
+
+    response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ffmpeg读取源文件的内部接口只接受带有该令牌的请求
+HLS_SOURCE_TOKEN = os.urandom(16).hex()
+
+def hls_input(device_id, remote_path, size, mtime):
+    """ffmpeg的输入：文件已在本地缓存时直接读取，否则读取本服务的 /api/hls/source（ffmpeg用Range请求跳转，不需要完整拉取）"""
+    local_file = file_cache.lookup(device_id, remote_path, size, mtime)
+    if local_file:
+        return local_file
+    query = urlencode({'id': device_id, 'file_path': remote_path, 'token': HLS_SOURCE_TOKEN})
+    return f'{HLS_LOOPBACK_URL}/api/hls/source?{query}'
+
+def probe_media(source):
+    """用ffmpeg读取媒体时长和是否有视频画面（音频文件的封面图不算），返回 (时长秒数, 是否有视频)"""
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-nostdin', '-i', hls_input(*source)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=30)
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        raise RuntimeError(f"读取媒体信息失败: {e}")
+    # 没有指定输出文件时ffmpeg以非0退出，媒体信息在错误输出中
+    info = result.stderr.decode('utf-8', errors='replace')
+    match = FFMPEG_DURATION_REGEX.search(info)
+    if not match:
+        raise RuntimeError(f"无法读取媒体时长: {source[1]} {info[-300:].strip()}")
+    ffmpeg_seconds.observe(time.perf_counter() - started, kind='probe')
+    hours, minutes, seconds = match.groups()
+    has_video = any('Video:' in line and 'attached pic' not in line for line in info.splitlines())
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds), has_video
 
-def get_storage_info(device_id):
-    """获取存储空间信息"""
-    result = run_adb_command('shell df /data', device_id)
-    lines = result.stdout.strip().splitlines()
+def start_hls_transcode(source, profile, start_segment, work_dir):
+    """
+    从第 start_segment 段的时间点开始转码，分段写入 work_dir
+    -copyts 保持原始时间戳、关键帧对齐分段边界，跳转后重新启动的进程输出的分段可以与之前的衔接
+    """
+    height, video_kbps, audio_kbps = HLS_PROFILES[profile]
+    start = start_segment * HLS_SEGMENT_SECONDS
+    args = ['ffmpeg', '-loglevel', 'error', '-nostdin', '-ss', str(start), '-i', hls_input(*source),
+            '-copyts', '-avoid_negative_ts', 'disabled']
+    if height:
+        args += [
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+            '-vf', f"scale=-2:'min({height},trunc(ih/2)*2)'",
+            '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps * 2}k',
+            '-force_key_frames', f'expr:gte(t,{start}+n_forced*{HLS_SEGMENT_SECONDS})', '-sc_threshold', '0',
+        ]
+    else:
+        args += ['-map', '0:a:0', '-vn']
+    args += [
+        '-c:a', 'aac', '-b:a', f'{audio_kbps}k', '-ac', '2',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_segment_type', 'mpegts',
+        '-hls_flags', 'temp_file', '-hls_playlist_type', 'event', '-hls_list_size', '0',
+        '-start_number', str(start_segment),
+        '-hls_segment_filename', os.path.join(work_dir, HLS_SEGMENT_NAME.format('%d')),
+        os.path.join(work_dir, 'index.m3u8'),
+    ]
+    with open(os.path.join(work_dir, HLS_LOG_NAME), 'wb') as log:
+        return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+
+# 视频/音频预览：按需转码为HLS分段，分段缓存按LRU淘汰
+hls_segment_cache = ContentCache(HLS_CACHE_DIR, HLS_CACHE_MAX_BYTES)
+hls_transcoder = HlsTranscoder(hls_segment_cache, probe_media, start_hls_transcode, HLS_SEGMENT_SECONDS,
+                               HLS_MAX_JOBS, HLS_MAX_AHEAD, idle_timeout=HLS_IDLE_TIMEOUT)
+atexit.register(hls_transcoder.stop_all)
+
+def hls_source(device_id):
+    """读取请求中的文件，返回 (source, 错误响应)，source 为 (设备序列号, 远程路径, 大小, 修改时间)"""
+    file_path = request.args.get('file_path')
+    if not file_path:
+        return None, (jsonify({'error': 'Missing required parameters'}), 400)
+    file_stat = stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return None, (jsonify({'error': 'File not found', 'details': file_path}), 404)
+    return (device_id, file_path, *file_stat), None
+
+def hls_playlist_response(lines):
+    response = Response('\n'.join(lines) + '\n', mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/hls/source', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def hls_source_file(device_id):
+    """
+    内部接口：ffmpeg转码时读取设备上的源文件，支持Range
+    不经过 /api/file，不占用文件传输的并发额度；设备I/O按可见媒体（thumbnail类别）调度，优先于文件下载
+    """
+    if request.args.get('token') != HLS_SOURCE_TOKEN:
+        return jsonify({'error': 'Forbidden'}), 403
+    file_path = request.args.get('file_path')
+    if not file_path:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    file_stat = stat_device_file(device_id, file_path)
+    if file_stat is None:
+        return jsonify({'error': 'File not found', 'details': file_path}), 404
+    return stream_file_response(device_id, file_path, posixpath.basename(file_path), file_stat, io_class='thumbnail')
+
+@app.route('/api/hls/master.m3u8', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def hls_master_playlist(device_id):
+    """API: HLS主播放列表，列出各码率档位（没有视频画面时只有音频档位），码率低的在前以便尽快开始播放"""
+    source, error = hls_source(device_id)
+    if error:
+        return error
+    _duration, has_video = hls_transcoder.media_info(source)
+    lines = ['#EXTM3U']
+    for name, (height, video_kbps, audio_kbps) in HLS_PROFILES.items():
+        if bool(height) != has_video:
+            continue
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={((video_kbps or 0) + audio_kbps) * 1000}')
+        lines.append(url_for('hls_media_playlist', id=device_id, file_path=source[1], profile=name))
+    return hls_playlist_response(lines)
+
+@app.route('/api/hls/playlist.m3u8', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def hls_media_playlist(device_id):
+    """API: 某个码率档位的HLS播放列表（列出全部分段，分段在请求时才转码）"""
+    profile = request.args.get('profile', '720p')
+    if profile not in HLS_PROFILES:
+        return jsonify({'error': 'Invalid profile'}), 400
+    source, error = hls_source(device_id)
+    if error:
+        return error
+    lines = [
+        '#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{HLS_SEGMENT_SECONDS}',
+        '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MEDIA-SEQUENCE:0'
+    ]
+    for index, duration in enumerate(hls_transcoder.segment_durations(source)):
+        lines.append(f'#EXTINF:{duration:.3f},')
+        # 文件版本放在分段URL中，文件修改后浏览器不会使用旧分段
+        lines.append(url_for('hls_segment', id=device_id, file_path=source[1], profile=profile, index=index,
+                             v=f'{source[2]}-{source[3]}'))
+    lines.append('#EXT-X-ENDLIST')
+    return hls_playlist_response(lines)
+
+@app.route('/api/hls/segment.ts', methods=['GET'])
+@device_id_required
+@handle_api_errors
+def hls_segment(device_id):
+    """API: HLS分段，缓存中没有时从该位置开始转码并等待"""
+    profile = request.args.get('profile', '720p')
+    index = request.args.get('index', type=int)
+    if profile not in HLS_PROFILES or index is None:
+        return jsonify({'error': 'Invalid profile or index'}), 400
+    source, error = hls_source(device_id)
+    if error:
+        return error
+    if not 0 <= index < len(hls_transcoder.segment_durations(source)):
+        return jsonify({'error': 'Segment not found'}), 404
+    etag = hls_transcoder.segment_key(source, profile, index)
+    cache_control = 'private, max-age=86400'
+    if is_not_modified(request, etag):
+        return not_modified_response(etag, cache_control=cache_control)
+    try:
+        segment_path = hls_transcoder.segment(source, profile, index, HLS_SEGMENT_TIMEOUT)
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    response = make_response(send_file(segment_path, mimetype='video/mp2t', etag=etag))
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def parse_storage_info(output):
+    """解析 df /data 输出的存储空间信息"""
+    lines = output.strip().splitlines()
     
     if len(lines) < 2:
         raise ValueError("存储信息格式错误")
@@ -471,40 +1836,86 @@ def get_storage_info(device_id):
     
     return {"total": total_gb, "used": used_gb}
 
-def get_battery_level(device_id):
-    """获取电池电量百分比"""
-    result = run_adb_command('shell dumpsys battery', device_id)
-    match = re.search(r'level:\s*(\d+)', result.stdout)
+def parse_battery_level(output):
+    """解析 dumpsys battery 输出的电池电量百分比"""
+    match = re.search(r'level:\s*(\d+)', output)
     return int(match.group(1)) if match else 0
 
+def run_shell_output(device_id, shell_command):
+    return run_adb_command(['shell', shell_command], device_id).stdout
+
+# 设备信息缓存：型号、存储、电量在一次shell调用中获取，由后台线程按各自的有效期刷新
+device_info = DeviceInfoCache(run_shell_output, [
+    DeviceInfoField('model', 'getprop ro.product.model', str.strip),
+    DeviceInfoField('storage', 'df /data', parse_storage_info, DEVICE_INFO_STORAGE_TTL),
+    DeviceInfoField('battery', 'dumpsys battery', parse_battery_level, DEVICE_INFO_BATTERY_TTL),
+], DEVICE_INFO_POLL_INTERVAL)
+
 @app.route('/api/device_info', methods=['POST'])
 @device_id_required
 @handle_api_errors
 def get_device_info(device_id):
-    """API: 获取设备信息"""
-    device_name = get_device_name(device_id)
-    storage_info = get_storage_info(device_id)
-    battery_level = get_battery_level(device_id)
+    """API: 获取设备信息（直接返回缓存值）"""
+    info = device_info.get(device_id)
+    storage_info = info['storage'] or {"total": 0, "used": 0}
     
     return jsonify({
         'cover_img': f'/screenshot/{device_id}',
-        'phone_name': device_name,
+        'phone_name': info['model'],
         'storage_total_size': storage_info["total"],
         'storage_use_size': storage_info["used"],
-        'battery_use': battery_level
+        'battery_use': info['battery']
     })
 
-def get_adb_devices():
-    """获取已连接的ADB设备列表"""
+def list_adb_devices():
+    """一次性查询设备列表，返回 [(serial, state), ...]"""
     try:
+        return adb_client.devices()
+    except AdbServerUnavailable:
         result = run_adb_command('devices', timeout=10)
-        devices = [
-            parts[0] for line in result.stdout.splitlines()[1:]
-            if (parts := line.split()) and len(parts) >= 2 and parts[1] == 'device'
-        ]
-        return {'connected': bool(devices), 'devices': devices}
-    except Exception:
-        return {'connected': False, 'devices': []}
+        return parse_devices('\n'.join(result.stdout.splitlines()[1:]))
+
+def track_adb_devices():
+    """设备列表变化时返回完整列表；adb server不可用时改用常驻的 adb track-devices 进程"""
+    try:
+        yield from adb_client.track_devices()
+        return
+    except AdbServerUnavailable as e:
+        logger.info(f"adb server不可用，改用adb track-devices进程: {e}")
+    # 命令行输出与socket协议相同：4位十六进制长度 + 设备列表
+    proc = subprocess.Popen([ADB_BIN, 'track-devices'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    atexit.register(proc.kill)
+    try:
+        while True:
+            header = proc.stdout.read(4)
+            if len(header) < 4:
+                return
+            yield parse_devices(proc.stdout.read(int(header, 16)).decode('utf-8', errors='ignore'))
+    finally:
+        atexit.unregister(proc.kill)
+        proc.kill()
+        proc.wait()
+
+def on_devices_changed(added, removed):
+    """设备断开后丢弃与其相关的连接和缓存"""
+    for device_id in removed:
+        logger.info(f"设备已断开: {device_id}")
+        adb_client.forget_device(device_id)
+        adb_sessions.close_device(device_id)
+        device_info.forget(device_id)
+        directory_tree.clear(device_id)
+        screen_streams.stop(device_id)
+        io_scheduler.forget(device_id)
+        thumbnail_warmer.cancel(device_id)
+    for device_id in added:
+        logger.info(f"设备已连接: {device_id}")
+
+# 设备列表由一条常驻的track-devices连接维护，接口和事件流都直接读取内存中的状态
+device_tracker = DeviceTracker(track_adb_devices, list_adb_devices, on_devices_changed)
+
+def get_adb_devices():
+    """获取已连接的ADB设备列表"""
+    return device_tracker.status()
 
 @app.route('/api/get_device', methods=['GET'])
 @handle_api_errors
@@ -512,7 +1923,32 @@ def device_status():
     """API: 获取设备连接状态"""
     return jsonify(get_adb_devices())
 
+@app.route('/api/device_events', methods=['GET'])
+def device_events():
+    """API: 以Server-Sent Events推送设备连接状态，连接后立即发送一次当前状态"""
+    def generate():
+        version = None
+        while True:
+            version, status, changed = device_tracker.wait(version, DEVICE_EVENTS_KEEPALIVE)
+            if changed:
+                yield f"event: devices\ndata: {json.dumps(status)}\n\n"
+            else:
+                # 心跳用于及时发现已断开的客户端
+                yield ": keepalive\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Android文件管理器')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='工作线程数（waitress）')
+    parser.add_argument('--debug', action='store_true', help='使用Flask调试服务器（自动重载）')
+    args = parser.parse_args()
+
     # 验证和安装必要工具
     for tool, installer in [('adb', install_adb), ('ffmpeg', install_ffmpeg)]:
         success, info = verify_installation(tool)
@@ -523,4 +1959,9 @@ if __name__ == '__main__':
 
     ensure_directory(STORAGE_DIR)
     logger.info("应用启动，存储目录: %s", STORAGE_DIR)
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    loopback_host = '127.0.0.1' if args.host in ('0.0.0.0', '::') else args.host
+    HLS_LOOPBACK_URL = f'http://{loopback_host}:{args.port}'
+    if args.debug:
+        app.run(debug=True, host=args.host, port=args.port)
+    else:
+        serve(app, args.host, args.port, args.threads)
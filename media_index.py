@@ -0,0 +1,415 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MEDIA_COLUMNS = ['_id', '_data', 'mime_type', '_size', '_display_name', 'width', 'height', 'date_added', 'date_modified', 'path']
+INT_COLUMNS = {'_id', '_size', 'width', 'height', 'date_added', 'date_modified'}
+# 接口返回的字段（与直接解析content query时保持一致）
+OUTPUT_COLUMNS = {
+    'image': ['_id', '_data', 'mime_type', '_size', '_display_name', 'width', 'height', 'date_added', 'path'],
+    'video': ['_id', '_data', 'mime_type', '_size', '_display_name', 'width', 'height', 'date_added', 'path'],
+    'audio': ['_id', '_data', 'mime_type', '_size', '_display_name', 'date_added', 'path'],
+    # MediaStore文件表（全部文件），只用于文件名搜索
+    'file': ['_id', '_data', 'mime_type', '_size', '_display_name', 'date_added', 'path'],
+}
+# 可排序字段及其SQL表达式（NULL按0/空字符串处理，保证游标比较稳定）
+SORT_EXPRESSIONS = {
+    '_id': '_id',
+    'date_added': 'COALESCE(date_added, 0)',
+    '_size': 'COALESCE(_size, 0)',
+    'name': "COALESCE(_display_name, '') COLLATE NOCASE",
+}
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeviceMediaIndex:
+    """单台设备的媒体索引数据库"""
+
+    def __init__(self, db_path):
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # INSERT OR REPLACE 替换旧行时也触发删除触发器，保持文件名索引同步
+        self.db.execute('PRAGMA recursive_triggers=ON')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS media ('
+            'media_type TEXT, _id INTEGER, _data TEXT, mime_type TEXT, _size INTEGER, _display_name TEXT, '
+            'width INTEGER, height INTEGER, date_added INTEGER, date_modified INTEGER, path TEXT, '
+            'PRIMARY KEY (media_type, _id))'
+        )
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.name_index = self._create_name_index()
+        self.db.commit()
+        # 搜索使用独立的只读连接（WAL模式下不等待正在进行的同步）
+        self.reader = sqlite3.connect(db_path, check_same_thread=False)
+        self.read_lock = threading.Lock()
+        # 各媒体类型的内容代数，索引内容变化后加一，用作列表的ETag
+        self.generations = {}
+
+    def _create_name_index(self):
+        """文件表的文件名三元组全文索引，SQLite不支持trigram分词器时返回False（搜索改为逐行匹配）"""
+        try:
+            self.db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS media_names USING fts5("
+                "_display_name, content='media', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite不支持trigram全文索引，文件名搜索将逐行匹配: {e}")
+            return False
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS media_names_insert AFTER INSERT ON media WHEN new.media_type = 'file' BEGIN "
+            "INSERT INTO media_names (rowid, _display_name) VALUES (new.rowid, new._display_name); END"
+        )
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS media_names_delete AFTER DELETE ON media WHEN old.media_type = 'file' BEGIN "
+            "INSERT INTO media_names (media_names, rowid, _display_name) VALUES ('delete', old.rowid, old._display_name); END"
+        )
+        return True
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def bump(self, media_types):
+        for media_type in media_types:
+            self.generations[media_type] = self.generations.get(media_type, 0) + 1
+
+
+class MediaIndex:
+    """
+    按设备保存MediaStore媒体列表的本地SQLite索引
+    列表接口直接读取索引；索引按 date_modified 增量刷新，只有MediaStore版本变化或手动触发时才全量同步
+    """
+
+    def __init__(self, index_dir, query_rows, query_ids, query_version, refresh_interval=30, deletion_check_interval=300):
+        """
+        :param query_rows: (device_id, media_type, where) -> 行迭代器（支持 row.get(列名)），需包含 date_modified
+        :param query_ids: (device_id, media_type) -> 当前全部 _id 集合，用于发现已删除的条目
+        :param query_version: (device_id) -> MediaStore版本号，无法获取时返回None
+        """
+        self.index_dir = index_dir
+        self.query_rows = query_rows
+        self.query_ids = query_ids
+        self.query_version = query_version
+        self.refresh_interval = refresh_interval
+        self.deletion_check_interval = deletion_check_interval
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._refreshing = set()
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _device(self, device_id):
+        with self._lock:
+            index = self._devices.get(device_id)
+            if index is None:
+                safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in device_id)
+                index = DeviceMediaIndex(os.path.join(self.index_dir, f'{safe_name}.sqlite3'))
+                self._devices[device_id] = index
+            return index
+
+    def list_media(self, device_id, media_type):
+        """返回完整媒体列表（必要时先刷新索引）"""
+        return self.query_media(device_id, media_type)[0]
+
+    def query_media(self, device_id, media_type, sort='_id', order='asc', mime=None, folder=None,
+                    recursive=False, date_from=None, date_to=None, limit=None, cursor=None):
+        """
+        分页查询媒体列表
+        :param mime: 精确的mime类型，或 image/* 形式的前缀
+        :param folder: 所在目录（path字段），recursive为True时包含子目录
+        :param date_from/date_to: date_added 范围（秒级时间戳，闭区间）
+        :param cursor: 上一页返回的 next_cursor
+        :return: (条目列表, 满足过滤条件的总数, 下一页游标或None)
+        """
+        if sort not in SORT_EXPRESSIONS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"不支持的排序方向: {order}")
+
+        index = self._ensure_fresh(device_id, media_type)
+
+        conditions = ['media_type = ?']
+        params = [media_type]
+        if mime:
+            if mime.endswith('/*'):
+                conditions.append('mime_type LIKE ?')
+                params.append(mime[:-1] + '%')
+            else:
+                conditions.append('mime_type = ?')
+                params.append(mime)
+        if folder:
+            folder = folder.rstrip('/') + '/'
+            if recursive:
+                conditions.append('substr(path, 1, ?) = ?')
+                params.extend([len(folder), folder])
+            else:
+                conditions.append('path = ?')
+                params.append(folder)
+        if date_from is not None:
+            conditions.append('date_added >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append('date_added <= ?')
+            params.append(date_to)
+
+        expression = SORT_EXPRESSIONS[sort]
+        comparison = '>' if order == 'asc' else '<'
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if cursor:
+            sort_value, row_id = decode_cursor(cursor)
+            page_conditions.append(f'({expression} {comparison} ? OR ({expression} = ? AND _id {comparison} ?))')
+            page_params.extend([sort_value, sort_value, row_id])
+
+        columns = OUTPUT_COLUMNS[media_type]
+        sql = (
+            f"SELECT {', '.join(columns)}, {expression} FROM media WHERE {' AND '.join(page_conditions)} "
+            f"ORDER BY {expression} {order}, _id {order}"
+        )
+        if limit is not None:
+            sql += f' LIMIT {int(limit) + 1}'
+
+        with index.lock:
+            total = index.db.execute(
+                f"SELECT COUNT(*) FROM media WHERE {' AND '.join(conditions)}", params
+            ).fetchone()[0]
+            rows = index.db.execute(sql, page_params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[-1], last[columns.index('_id')])
+
+        items = [
+            {column: 'NULL' if value is None else str(value) for column, value in zip(columns, row)}
+            for row in rows
+        ]
+        return items, total, next_cursor
+
+    def _ensure_fresh(self, device_id, media_type):
+        """按需刷新索引；刷新失败但已有索引时继续使用已有索引"""
+        index = self._device(device_id)
+        try:
+            self.refresh(device_id, media_type)
+        except RuntimeError as e:
+            with index.lock:
+                if index.get_meta(f'synced:{media_type}') is None:
+                    raise
+            logger.warning(f"媒体索引刷新失败，返回已有索引: {e}")
+        return index
+
+    def generation(self, device_id, media_type):
+        """按需刷新索引后返回该类型的内容代数，代数不变时列表内容不变"""
+        index = self._ensure_fresh(device_id, media_type)
+        with index.lock:
+            return index.generations.get(media_type, 0)
+
+    def search(self, device_id, query, limit=100):
+        """
+        按文件名搜索MediaStore文件表（不区分大小写的子串匹配），按文件名排序
+        只有第一次搜索需要从设备同步文件表，之后索引过期时在后台增量刷新，搜索直接读取本地索引
+        :return: (条目列表, 匹配总数)
+        """
+        index = self._device(device_id)
+        with index.read_lock:
+            synced = index.reader.execute("SELECT value FROM meta WHERE key = 'synced:file'").fetchone()
+            checked = index.reader.execute("SELECT value FROM meta WHERE key = 'checked:file'").fetchone()
+        if synced is None:
+            self.refresh(device_id, 'file')
+        elif time.time() - float(checked[0] if checked else 0) >= self.refresh_interval:
+            self._refresh_in_background(device_id, 'file')
+
+        if index.name_index and len(query) >= 3:
+            # trigram索引：查询至少3个字符，整体作为短语匹配
+            # 用子查询先取出匹配的rowid，避免对每一行执行一次全文查询
+            condition = 'media.rowid IN (SELECT rowid FROM media_names WHERE media_names MATCH ?)'
+            param = '"' + query.replace('"', '""') + '"'
+        else:
+            condition = "media._display_name LIKE ? ESCAPE '\\'"
+            param = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where = f"media.media_type = 'file' AND {condition}"
+        columns = OUTPUT_COLUMNS['file']
+        with index.read_lock:
+            total = index.reader.execute(f'SELECT COUNT(*) FROM media WHERE {where}', (param,)).fetchone()[0]
+            rows = index.reader.execute(
+                f"SELECT {', '.join('media.' + c for c in columns)} FROM media WHERE {where} "
+                f"ORDER BY media._display_name COLLATE NOCASE, media._id LIMIT ?",
+                (param, int(limit))
+            ).fetchall()
+        items = [
+            {column: 'NULL' if value is None else str(value) for column, value in zip(columns, row)}
+            for row in rows
+        ]
+        return items, total
+
+    def _refresh_in_background(self, device_id, media_type):
+        key = (device_id, media_type)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(device_id, media_type)
+            except Exception as e:
+                logger.warning(f"后台刷新媒体索引失败: {device_id} {media_type} - {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f'media-index-{media_type}', daemon=True).start()
+
+    def refresh(self, device_id, media_type, force=False):
+        """按需刷新索引：版本变化或首次使用时全量同步，否则增量同步"""
+        index = self._device(device_id)
+        with index.lock:
+            now = time.time()
+            checked = float(index.get_meta(f'checked:{media_type}', 0))
+            if not force and index.get_meta(f'synced:{media_type}') is not None and now - checked < self.refresh_interval:
+                return
+
+            version = self.query_version(device_id)
+            if version is not None and version != index.get_meta('version'):
+                if index.get_meta('version') is not None:
+                    logger.info(f"MediaStore版本变化，全量同步媒体索引: {device_id}")
+                index.db.execute('DELETE FROM media')
+                index.db.execute("DELETE FROM meta WHERE key LIKE 'synced:%' OR key LIKE 'checked:%'")
+                index.set_meta('version', version)
+                index.bump(OUTPUT_COLUMNS)
+
+            synced = index.get_meta(f'synced:{media_type}')
+            try:
+                if synced is None:
+                    self._full_sync(index, device_id, media_type)
+                    changed = True
+                else:
+                    changed = self._incremental_sync(index, device_id, media_type, int(synced), now)
+            except Exception:
+                # 行是边读取边写入的，查询中途失败时丢弃本次的全部修改
+                index.db.rollback()
+                raise
+            index.set_meta(f'checked:{media_type}', now)
+            index.db.commit()
+            if changed:
+                index.bump([media_type])
+
+    def resync(self, device_id, media_type=None):
+        """手动触发全量同步；未指定类型时同步各媒体列表，文件表只在已用于搜索时同步"""
+        index = self._device(device_id)
+        with index.lock:
+            media_types = [media_type] if media_type else [
+                item for item in OUTPUT_COLUMNS if item != 'file' or index.get_meta('synced:file') is not None
+            ]
+            for item in media_types:
+                index.db.execute("DELETE FROM meta WHERE key = ?", (f'synced:{item}',))
+            index.db.commit()
+        for item in media_types:
+            self.refresh(device_id, item, force=True)
+
+    def _upsert(self, index, media_type, rows, skip_unchanged=False):
+        """
+        写入行，返回 (行数, 最大修改时间, 实际写入的行数)
+        skip_unchanged为True时先与已有内容比较，内容相同的行不重写（增量同步会重复读到上次同一秒内的条目）
+        """
+        count = 0
+        written = 0
+        max_modified = 0
+        for row in rows:
+            values = [_to_int(row.get(c)) if c in INT_COLUMNS else row.get(c) for c in MEDIA_COLUMNS]
+            max_modified = max(max_modified, _to_int(row.get('date_modified')) or 0)
+            count += 1
+            if skip_unchanged:
+                existing = index.db.execute(
+                    f"SELECT {', '.join(MEDIA_COLUMNS)} FROM media WHERE media_type = ? AND _id = ?",
+                    (media_type, values[0])
+                ).fetchone()
+                if existing is not None and list(existing) == values:
+                    continue
+            written += 1
+            index.db.execute(
+                f"INSERT OR REPLACE INTO media (media_type, {', '.join(MEDIA_COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' * len(MEDIA_COLUMNS))})",
+                [media_type] + values
+            )
+        return count, max_modified, written
+
+    def _full_sync(self, index, device_id, media_type):
+        started = time.monotonic()
+        index.db.execute('DELETE FROM media WHERE media_type = ?', (media_type,))
+        count, max_modified, _written = self._upsert(index, media_type, self.query_rows(device_id, media_type, None))
+        index.set_meta(f'synced:{media_type}', max_modified)
+        index.set_meta(f'deletions:{media_type}', time.time())
+        logger.info(f"媒体索引全量同步: {device_id} {media_type} {count} 条, 耗时 {time.monotonic() - started:.2f}s")
+
+    def _incremental_sync(self, index, device_id, media_type, synced, now):
+        """返回索引内容是否有变化"""
+        # 使用 >= 避免遗漏同一秒内修改的条目，重复行会被覆盖
+        _count, max_modified, written = self._upsert(
+            index, media_type, self.query_rows(device_id, media_type, f'date_modified>={synced}'), skip_unchanged=True
+        )
+        index.set_meta(f'synced:{media_type}', max(synced, max_modified))
+        if written:
+            logger.info(f"媒体索引增量同步: {device_id} {media_type} {written} 条")
+
+        removed = ()
+        if now - float(index.get_meta(f'deletions:{media_type}', 0)) >= self.deletion_check_interval:
+            current_ids = self.query_ids(device_id, media_type)
+            indexed_ids = {row[0] for row in index.db.execute(
+                'SELECT _id FROM media WHERE media_type = ?', (media_type,))}
+            removed = indexed_ids - current_ids
+            index.db.executemany(
+                'DELETE FROM media WHERE media_type = ? AND _id = ?', [(media_type, i) for i in removed]
+            )
+            index.set_meta(f'deletions:{media_type}', now)
+            if removed:
+                logger.info(f"媒体索引移除已删除条目: {device_id} {media_type} {len(removed)} 条")
+        return bool(written or removed)
+
+    def remove_paths(self, device_id, paths):
+        """本服务删除或移动文件后同步移除索引条目（路径为目录时包含其中的全部条目），无需等待下次检查"""
+        index = self._device(device_id)
+        with index.lock:
+            index.db.executemany(
+                'DELETE FROM media WHERE _data = ? OR substr(_data, 1, ?) = ?',
+                [(p, len(p) + 1, p.rstrip('/') + '/') for p in paths]
+            )
+            index.db.commit()
+            index.bump(OUTPUT_COLUMNS)
+
+    def status(self, device_id):
+        index = self._device(device_id)
+        with index.lock:
+            counts = dict(index.db.execute('SELECT media_type, COUNT(*) FROM media GROUP BY media_type'))
+            meta = dict(index.db.execute('SELECT key, value FROM meta'))
+        return {'counts': counts, 'meta': meta}
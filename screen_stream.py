@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenFrame:
+    """一帧截图：设备返回的原始数据，以及按编码参数缓存的转码结果"""
+
+    def __init__(self, seq, data, mime_type, digest):
+        self.seq = seq
+        self.data = data
+        self.mime_type = mime_type
+        self.digest = digest
+        # 最近一次确认画面未变化的时间，用于判断是否足够新
+        self.updated_at = time.monotonic()
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encode(self, encoder, params=None):
+        """返回 (数据, MIME类型)；同一帧相同参数只转码一次，所有观看者共享结果"""
+        if params is None:
+            return self.data, self.mime_type
+        with self._lock:
+            if params not in self._encoded:
+                self._encoded[params] = encoder(self.data, *params)
+            return self._encoded[params]
+
+
+class _DeviceScreen:
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.cond = threading.Condition()
+        self.capture_lock = threading.Lock()
+        self.frame = None
+        self.seq = 0
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self.thread = None
+        self.stopped = False
+
+
+class ScreenStreamManager:
+    """
+    每台设备最多一个截图循环，无论有多少观看者
+    画面没有变化的帧被丢弃；没有观看者超过 idle_timeout 后循环退出
+    """
+
+    def __init__(self, capture, fps=5, idle_timeout=5, max_failures=3, mime_type='image/png'):
+        """
+        :param capture: (device_id) -> 一帧截图数据
+        """
+        self.capture = capture
+        self.fps = fps
+        self.idle_timeout = idle_timeout
+        self.max_failures = max_failures
+        self.mime_type = mime_type
+        self._lock = threading.Lock()
+        self._screens = {}
+
+    def _screen(self, device_id):
+        with self._lock:
+            screen = self._screens.get(device_id)
+            if screen is None:
+                screen = self._screens[device_id] = _DeviceScreen(device_id)
+            return screen
+
+    def _capture(self, screen, max_age=None):
+        """截取一帧；画面与上一帧相同时只更新时间。max_age不为None时复用足够新的帧"""
+        with screen.capture_lock:
+            if max_age is not None:
+                with screen.cond:
+                    frame = screen.frame
+                    if frame and time.monotonic() - frame.updated_at <= max_age:
+                        return frame
+            data = self.capture(screen.device_id)
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            with screen.cond:
+                if screen.frame is not None and screen.frame.digest == digest:
+                    screen.frame.updated_at = time.monotonic()
+                else:
+                    screen.seq += 1
+                    screen.frame = ScreenFrame(screen.seq, data, self.mime_type, digest)
+                    screen.cond.notify_all()
+                return screen.frame
+
+    def _run(self, screen):
+        interval = 1 / self.fps
+        failures = 0
+        logger.info(f"开始截图循环: {screen.device_id}")
+        while True:
+            with screen.cond:
+                idle = screen.subscribers == 0 and time.monotonic() - screen.idle_since >= self.idle_timeout
+                if screen.stopped or idle or failures >= self.max_failures:
+                    # 在同一把锁内退出，之后的订阅会启动新的循环
+                    screen.thread = None
+                    screen.cond.notify_all()
+                    break
+            started = time.monotonic()
+            try:
+                self._capture(screen)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"截图失败: {screen.device_id} ({failures}/{self.max_failures}) - {e}")
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        logger.info(f"结束截图循环: {screen.device_id}")
+
+    def _ensure_running(self, screen):
+        """需要持有 screen.cond"""
+        if screen.thread is None:
+            screen.stopped = False
+            screen.thread = threading.Thread(
+                target=self._run, args=(screen,), name=f'screen-{screen.device_id}', daemon=True)
+            screen.thread.start()
+
+    def frames(self, device_id, min_interval=0, keepalive=10):
+        """
+        订阅设备画面，画面变化时返回新帧（最多每 min_interval 秒一帧）
+        画面长时间不变时每 keepalive 秒重复最后一帧，以便及时发现已断开的观看者
+        截图循环因设备错误或 stop() 结束时迭代结束
+        """
+        screen = self._screen(device_id)
+        with screen.cond:
+            screen.subscribers += 1
+            self._ensure_running(screen)
+        try:
+            seq = None
+            while True:
+                with screen.cond:
+                    screen.cond.wait_for(
+                        lambda: screen.thread is None or (screen.frame is not None and screen.frame.seq != seq),
+                        keepalive
+                    )
+                    if screen.thread is None:
+                        return
+                    frame = screen.frame
+                if frame is None:
+                    continue
+                sent_at = time.monotonic()
+                yield frame
+                seq = frame.seq
+                delay = min_interval - (time.monotonic() - sent_at)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            with screen.cond:
+                screen.subscribers -= 1
+                if not screen.subscribers:
+                    screen.idle_since = time.monotonic()
+
+    def grab(self, device_id, max_age):
+        """返回不超过 max_age 秒的最新帧，没有时立即截取一帧（并发请求共享同一次截图）"""
+        return self._capture(self._screen(device_id), max_age)
+
+    def stop(self, device_id):
+        """结束设备的截图循环并丢弃最后一帧"""
+        with self._lock:
+            screen = self._screens.pop(device_id, None)
+        if screen is not None:
+            with screen.cond:
+                screen.stopped = True
+                screen.frame = None
+                screen.cond.notify_all()
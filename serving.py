@@ -0,0 +1,121 @@
+import json
+import logging
+import threading
+
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger(__name__)
+
+
+class RequestClass:
+    """一类请求：匹配的路径前缀和同时处理的数量上限"""
+
+    def __init__(self, name, limit, routes):
+        """
+        :param routes: 路径前缀列表，可以带请求方法，例如 '/api/file' 或 'PUT /api/uploads'
+        """
+        self.name = name
+        self.limit = limit
+        self.routes = []
+        for route in routes:
+            method, _, prefix = route.rpartition(' ')
+            self.routes.append((method or None, prefix.rstrip('/')))
+        self.active = 0
+        self.rejected = 0
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def matches(self, method, path):
+        return any(
+            (route_method is None or route_method == method) and (path == prefix or path.startswith(prefix + '/'))
+            for route_method, prefix in self.routes
+        )
+
+
+class ConcurrencyLimiter:
+    """
+    WSGI中间件：按类别限制同时处理的请求数
+    大文件传输、长连接等慢请求各自占用固定额度，不会占满服务器线程而拖慢列表、缩略图等普通请求
+    额度在响应迭代器关闭时（包括客户端中途断开）才释放
+    """
+
+    def __init__(self, app, classes, queue_timeout=2, retry_after=1):
+        """
+        :param classes: [RequestClass]，按顺序匹配，未匹配的请求不受限制
+        :param queue_timeout: 额度用完时最多等待的秒数，超时返回503
+        """
+        self.app = app
+        self.classes = list(classes)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+
+    def classify(self, environ):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        path = environ.get('PATH_INFO', '')
+        return next((c for c in self.classes if c.matches(method, path)), None)
+
+    def __call__(self, environ, start_response):
+        request_class = self.classify(environ)
+        if request_class is None:
+            return self.app(environ, start_response)
+
+        if not request_class.semaphore.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                request_class.rejected += 1
+            logger.warning(f"请求过多，拒绝: {request_class.name} {environ.get('PATH_INFO')}")
+            return self._busy(request_class, start_response)
+
+        with self._lock:
+            request_class.active += 1
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if released:
+                    return
+                released = True
+                request_class.active -= 1
+            request_class.semaphore.release()
+
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            release()
+            raise
+        return ClosingIterator(result, release)
+
+    def _busy(self, request_class, start_response):
+        body = json.dumps({
+            'error': '服务器繁忙',
+            'details': f'同时进行的{request_class.name}请求已达上限 {request_class.limit}'
+        }, ensure_ascii=False).encode('utf-8')
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(self.retry_after))
+        ])
+        return [body]
+
+    def stats(self):
+        with self._lock:
+            return {
+                c.name: {'limit': c.limit, 'active': c.active, 'rejected': c.rejected}
+                for c in self.classes
+            }
+
+
+def serve(app, host, port, threads):
+    """
+    生产环境入口：优先使用waitress（固定大小线程池），未安装时使用Werkzeug的多线程服务器
+    两者都不启用调试器和自动重载
+    """
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        from werkzeug.serving import run_simple
+        logger.info(f"未安装waitress，使用多线程WSGI服务器: http://{host}:{port}")
+        run_simple(host, port, app, threaded=True, use_reloader=False, use_debugger=False)
+        return
+    logger.info(f"使用waitress启动服务: http://{host}:{port}，{threads} 个工作线程")
+    waitress_serve(app, host=host, port=port, threads=threads, connection_limit=max(100, threads * 4))
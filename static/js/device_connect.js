@@ -47,10 +47,6 @@ document.addEventListener('DOMContentLoaded', function () {
                 connectBtn.classList.add("active");
                 connectBtn.disabled = false;
 
-                connectBtn.addEventListener('click', function () {
-                    window.location.href = `/index.html?id=${serial_id}`;
-                });
-
                 // 更新状态指示器
                 statusDot.classList.add("connected");
                 statusText.textContent = "设备已连接";
@@ -78,7 +74,27 @@ document.addEventListener('DOMContentLoaded', function () {
 
     }
 
-    // 设备检查函数
+    // 根据设备列表更新页面
+    function handleDeviceStatus(data) {
+        if (data.connected) {
+            if (data.devices.includes(serial_id)) {
+                return;
+            }
+            serial_id = data.devices[0];
+            deviceSerial.textContent = `设备序列号: ${serial_id}`;
+            get_device_info();
+        } else if (deviceConnected) {
+            deviceConnected = false;
+            serial_id = '';
+            connectBtn.textContent = "等待设备连接";
+            connectBtn.classList.remove("active");
+            connectBtn.disabled = true;
+            statusDot.classList.remove("connected");
+            statusText.textContent = "设备已断开";
+        }
+    }
+
+    // 设备检查函数（不支持事件推送时轮询）
     function checkDeviceConnection() {
         fetch('/api/get_device', {
             method: 'GET'
@@ -87,17 +103,45 @@ document.addEventListener('DOMContentLoaded', function () {
             .then(data => {
                 if (data.connected) {
                     clearInterval(checkInterval);
-                    serial_id = data.devices[0];
-                    deviceSerial.textContent = `设备序列号: ${data.serial}`;
-                    get_device_info();
                 }
-            })
+                handleDeviceStatus(data);
+            });
     }
 
     // 初始禁用按钮
     connectBtn.disabled = true;
 
-    // 每1秒检查一次设备
-    const checkInterval = setInterval(checkDeviceConnection, 1000);
+    connectBtn.addEventListener('click', function () {
+        if (deviceConnected) {
+            window.location.href = `/index.html?id=${serial_id}`;
+        }
+    });
+
+    // 由服务端推送设备变化；事件流不可用时退回每1秒检查一次
+    let checkInterval = null;
+    function startPolling() {
+        if (checkInterval === null) {
+            checkDeviceConnection();
+            checkInterval = setInterval(checkDeviceConnection, 1000);
+        }
+    }
+
+    if (window.EventSource) {
+        const events = new EventSource('/api/device_events');
+        let received = false;
+        events.addEventListener('devices', function (event) {
+            received = true;
+            handleDeviceStatus(JSON.parse(event.data));
+        });
+        events.onerror = function () {
+            // 从未收到事件说明服务端不支持，断线重连则交给EventSource自动处理
+            if (!received) {
+                events.close();
+                startPolling();
+            }
+        };
+    } else {
+        startPolling();
+    }
 
-});
\ No newline at end of file
+});
@@ -15,6 +15,15 @@ let pathHistory = []; // 路径历史
 let selectedFiles = [];
 let currentCategory = 'image';
 let currentUploadIndex = 0;
+let thumbnailGroup = createThumbnailGroup('init'); // 当前网格的缩略图分组，切换页面时取消旧分组的任务
+let previewHls = null; // 当前视频/音频预览的hls.js实例
+let thumbnailBundleController = null; // 当前页的缩略图包请求，重新渲染时中止
+// `${尺寸}:${文件路径}` -> {etag, url}，缩略图包中的图片；再次显示时把etag发给服务端确认，未修改时直接使用
+const thumbnailUrls = new Map();
+const THUMBNAIL_URL_CACHE_LIMIT = 1000;
+const THUMBNAIL_GRID_SIZE = 256; // 宫格视图请求的缩略图尺寸
+const THUMBNAIL_LIST_SIZE = 128; // 列表视图请求的缩略图尺寸
+const thumbnailFormat = document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp') ? 'webp' : 'jpg';
 
 // 多语言支持
 let currentLang = 'zh-CN'; // 默认语言
@@ -322,8 +331,21 @@ function updateUploadHint() {
     uploadHint.textContent = `Allowed file types: ${typeNames[currentCategory] || 'All Types'}`;
 }
 
+// 生成缩略图分组ID：同一视图固定使用同一分组，缩略图URL不变，再次打开时浏览器可以用ETag验证缓存
+function createThumbnailGroup(view) {
+    return encodeURIComponent(`${serial_id}:${view}`);
+}
+
+// 取消上一个网格中尚未开始的缩略图任务
+function resetThumbnailGroup(view) {
+    fetch(`/api/thumbnail/cancel?group=${thumbnailGroup}`, { method: 'POST' })
+        .catch(error => console.error('取消缩略图任务失败:', error));
+    thumbnailGroup = createThumbnailGroup(view);
+}
+
 // 获取图片文件
 function getImages() {
+    resetThumbnailGroup('images');
     fetch(`/api/get_images?id=${serial_id}`)
         .then(response => response.json())
         .then(data => {
@@ -333,7 +355,7 @@ function getImages() {
             currentPage = 1; // 重置当前页码
             // 处理返回的文件数据
             data.forEach(file => {
-                const thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=images&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
+                const thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=images&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}&group=${thumbnailGroup}`;
                 const url = `/api/file?file_path=${encodeURIComponent(file._data)}&category=images&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
                 filesData.push({
                     id: file._id,
@@ -362,6 +384,7 @@ function getImages() {
 
 // 获取图片文件
 function getVideos() {
+    resetThumbnailGroup('videos');
     fetch(`/api/get_videos?id=${serial_id}`)
         .then(response => response.json())
         .then(data => {
@@ -369,7 +392,7 @@ function getVideos() {
             currentPage = 1; // 重置当前页码
             // 处理返回的文件数据
             data.forEach(file => {
-                const thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=video&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
+                const thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=video&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}&group=${thumbnailGroup}`;
                 const url = `/api/file?file_path=${encodeURIComponent(file._data)}&category=video&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
                 filesData.push({
                     id: file._id,
@@ -519,6 +542,7 @@ function renderPathBar() {
 
 // 获取音频文件
 function getFiles(path = '/sdcard/') {
+    resetThumbnailGroup(`files:${path}`);
     fetch(`/api/get_files?id=${serial_id}&path=${encodeURIComponent(path)}`)
         .then(response => response.json())
         .then(data => {
@@ -531,11 +555,14 @@ function getFiles(path = '/sdcard/') {
                 if (file.mime_type != "inode/directory") {
                     category = getFileCategory(file);
                     if (category === "images" || category === "videos") {
-                        thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=${category}&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
+                        thumbnail_url = `/api/thumbnail?file_path=${encodeURIComponent(file._data)}&category=${category}&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}&group=${thumbnailGroup}`;
                     }
                 }
 
-                const url = `/api/file?file_path=${encodeURIComponent(file._data)}&category=${file.mime_type == "inode/directory" ? "folder" : category}&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
+                // 文件夹下载为zip压缩包
+                const url = file.mime_type == "inode/directory"
+                    ? `/api/archive?id=${serial_id}&path=${encodeURIComponent(file._data)}&format=zip`
+                    : `/api/file?file_path=${encodeURIComponent(file._data)}&category=${category}&file_name=${encodeURIComponent(file._display_name)}&id=${serial_id}`;
                 filesData.push({
                     id: file._id,
                     data: file._data,
@@ -663,6 +690,7 @@ function setupEventListeners() {
 
     // 关闭预览
     closePreview.addEventListener('click', () => {
+        stopPreviewStream();
         previewContainer.classList.remove('active');
     });
 
@@ -695,57 +723,84 @@ function setupEventListeners() {
         }
     });
 
-    function uploadFile(file) {
-
-        const formData = new FormData();
-        formData.append('file', file); // 只上传第一个文件
+    const UPLOAD_CHUNK_RETRIES = 5;
 
-        const xhr = new XMLHttpRequest();
+    // 更新上传进度（以服务端已写入设备的字节数为准）
+    function updateUploadProgress(status) {
+        const percent = status.size ? (status.written / status.size) * 100 : 100;
+        progressFill.style.width = percent.toFixed(2) + '%';
+        progressText.textContent = percent.toFixed(2) + '%';
+    }
 
-        // Listen for the upload progress event
-        xhr.upload.onprogress = (event) => {
-            if (event.lengthComputable) {
-                const percentComplete = (event.loaded / event.total) * 100;
-                progressFill.style.width = percentComplete.toFixed(2) + '%';
-                progressText.textContent = percentComplete.toFixed(2) + '%';
+    // 分块上传：创建会话后按偏移逐块发送，连接中断时查询服务端偏移后续传
+    async function uploadFile(file) {
+        try {
+            const createResponse = await fetch(`/api/uploads?id=${serial_id}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    filename: file.name,
+                    size: file.size,
+                    mtime: Math.floor(file.lastModified / 1000),
+                    category: currentCategory
+                })
+            });
+            let status = await createResponse.json();
+            if (!createResponse.ok) {
+                throw new Error(status.error);
             }
-        };
-
-        // Listen for load (success) event
-        xhr.onload = () => {
-            if (xhr.status === 200) {
-                const response = JSON.parse(xhr.responseText);
-                uploadPanel.classList.remove('active');
-                uploadHint.textContent = `文件上传成功: ${response.filename}`;
-                progressFill.style.width = '100%'; // Ensure 100% on completion
-                progressText.textContent = '100%';
-
-                currentUploadIndex++;
-                if (currentUploadIndex === selectedFiles.length) {
-                    setTimeout(() => {
-                        pathBar.style.display = '';
-                        currentPath = '';
-                        pathHistory = [];
-                        renderPathBar();
-                        navigateToPath(response.phonedir);
-                    }, 500);
-                    return;
+            const uploadId = status.upload_id;
+            const chunkSize = status.chunk_size;
+            const phoneDir = status.phonedir;
+            let retries = 0;
+
+            while (status.state === 'uploading' && status.received < file.size) {
+                const offset = status.received;
+                try {
+                    const response = await fetch(`/api/uploads/${uploadId}?offset=${offset}`, {
+                        method: 'PUT',
+                        body: file.slice(offset, offset + chunkSize)
+                    });
+                    status = await response.json();
+                    retries = 0;
+                } catch (error) {
+                    if (++retries > UPLOAD_CHUNK_RETRIES) {
+                        throw error;
+                    }
+                    // 等待后按服务端记录的偏移续传
+                    await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                    status = await (await fetch(`/api/uploads/${uploadId}`)).json();
                 }
-                uploadFile(selectedFiles[currentUploadIndex]); // 上传下一个文件
-            } else {
-                const errorResponse = JSON.parse(xhr.responseText);
-                alert('文件上传失败:', errorResponse);
+                updateUploadProgress(status);
             }
-        };
 
-        // Listen for error event
-        xhr.onerror = () => {
-            alert('网络或服务器错误!');
-        };
+            while (status.state === 'uploading') {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                status = await (await fetch(`/api/uploads/${uploadId}`)).json();
+                updateUploadProgress(status);
+            }
+            if (status.state !== 'completed') {
+                throw new Error(status.error || status.state);
+            }
 
-        // Open and send the request
-        xhr.open('POST', `/api/upload?id=${serial_id}&category=${currentCategory}`);
-        xhr.send(formData);
+            uploadHint.textContent = `文件上传成功: ${file.name}`;
+            currentUploadIndex++;
+            if (currentUploadIndex === selectedFiles.length) {
+                uploadPanel.classList.remove('active');
+                setTimeout(() => {
+                    pathBar.style.display = '';
+                    currentPath = '';
+                    pathHistory = [];
+                    renderPathBar();
+                    navigateToPath(phoneDir);
+                }, 500);
+                return;
+            }
+            uploadFile(selectedFiles[currentUploadIndex]); // 上传下一个文件
+        } catch (error) {
+            console.error('文件上传失败:', error);
+            alert('文件上传失败: ' + error.message);
+        }
     }
 
     confirmUpload.addEventListener('click', () => {
@@ -844,13 +899,15 @@ function renderFiles() {
     listView.innerHTML = '';
 
     // 渲染文件
+    const thumbnails = [];
     currentFiles.forEach(file => {
-        if (currentView === 'grid') {
-            renderGridItem(file);
-        } else {
-            renderListItem(file);
+        const item = currentView === 'grid' ? renderGridItem(file) : renderListItem(file);
+        const img = item.querySelector('img');
+        if (img) {
+            thumbnails.push({ file, img });
         }
     });
+    loadThumbnails(thumbnails, currentView === 'grid' ? THUMBNAIL_GRID_SIZE : THUMBNAIL_LIST_SIZE);
 
     // 渲染分页
     renderPagination();
@@ -914,7 +971,7 @@ function renderGridItem(file) {
     fileCard.innerHTML = `
         <div class="thumbnail-container">
             ${file.thumbnail ?
-            `<img src="${file.thumbnail}" alt="${file.name}" class="thumbnail">` :
+            `<img alt="${file.name}" class="thumbnail">` :
             `<i class="${iconClass} file-icon ${typeClass}"></i>`
         }
         </div>
@@ -932,6 +989,7 @@ function renderGridItem(file) {
     });
 
     gridView.appendChild(fileCard);
+    return fileCard;
 }
 
 // 渲染列表视图项目
@@ -992,7 +1050,7 @@ function renderListItem(file) {
     listItem.innerHTML = `
         <div class="list-thumbnail">
             ${file.thumbnail ?
-            `<img src="${file.thumbnail}" alt="${file.name}">` :
+            `<img alt="${file.name}">` :
             `<i class="${iconClass} list-icon ${typeClass}"></i>`
         }
         </div>
@@ -1014,6 +1072,117 @@ function renderListItem(file) {
     });
 
     listView.appendChild(listItem);
+    return listItem;
+}
+
+// 一次请求获取当前页的全部缩略图，每张到达后立即显示；请求失败时退回逐个请求缩略图
+function loadThumbnails(items, size) {
+    if (thumbnailBundleController) {
+        thumbnailBundleController.abort();
+        thumbnailBundleController = null;
+    }
+    if (items.length === 0) {
+        return;
+    }
+    const controller = new AbortController();
+    thumbnailBundleController = controller;
+    const files = items.map(({ file }) => {
+        const cached = thumbnailUrls.get(`${size}:${file.data}`);
+        return cached ? { file_path: file.data, etag: cached.etag } : { file_path: file.data };
+    });
+    const loaded = new Set();
+    const showFallback = (index) => {
+        const { file, img } = items[index];
+        img.src = `${file.thumbnail}&size=${size}`;
+    };
+
+    fetch(`/api/thumbnail/bundle?id=${serial_id}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ files, size, format: thumbnailFormat, group: decodeURIComponent(thumbnailGroup) }),
+        signal: controller.signal
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return readThumbnailBundle(response, (header, data) => {
+                loaded.add(header.index);
+                if (header.error) {
+                    console.warn('缩略图生成失败:', header.file_path, header.error);
+                    return;
+                }
+                const key = `${size}:${header.file_path}`;
+                const cached = thumbnailUrls.get(key);
+                if (header.not_modified && !cached) {
+                    showFallback(header.index);
+                    return;
+                }
+                const url = header.not_modified
+                    ? cached.url
+                    : URL.createObjectURL(new Blob([data], { type: header.mime_type }));
+                rememberThumbnailUrl(key, header.etag, url);
+                items[header.index].img.src = url;
+            });
+        })
+        .catch(error => {
+            if (error.name === 'AbortError') {
+                return;
+            }
+            console.error('获取缩略图包失败:', error);
+            items.forEach((item, index) => {
+                if (!loaded.has(index)) {
+                    showFallback(index);
+                }
+            });
+        });
+}
+
+// 解析缩略图包：每条记录为 4字节大端序的头部长度 + JSON头部 + 图片数据（长度为头部中的 length）
+async function readThumbnailBundle(response, onRecord) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = new Uint8Array(0);
+    while (true) {
+        const { done, value } = await reader.read();
+        if (value) {
+            const merged = new Uint8Array(buffer.length + value.length);
+            merged.set(buffer);
+            merged.set(value, buffer.length);
+            buffer = merged;
+        }
+        while (buffer.length >= 4) {
+            const headerLength = new DataView(buffer.buffer, buffer.byteOffset, 4).getUint32(0);
+            if (buffer.length < 4 + headerLength) {
+                break;
+            }
+            const header = JSON.parse(decoder.decode(buffer.subarray(4, 4 + headerLength)));
+            const end = 4 + headerLength + header.length;
+            if (buffer.length < end) {
+                break;
+            }
+            onRecord(header, buffer.slice(4 + headerLength, end));
+            buffer = buffer.slice(end);
+        }
+        if (done) {
+            return;
+        }
+    }
+}
+
+// 记录缩略图的对象URL，超出上限时释放最久未使用的
+function rememberThumbnailUrl(key, etag, url) {
+    const old = thumbnailUrls.get(key);
+    if (old && old.url !== url) {
+        URL.revokeObjectURL(old.url);
+    }
+    thumbnailUrls.delete(key);
+    thumbnailUrls.set(key, { etag, url });
+    if (thumbnailUrls.size > THUMBNAIL_URL_CACHE_LIMIT) {
+        const [oldestKey, oldest] = thumbnailUrls.entries().next().value;
+        URL.revokeObjectURL(oldest.url);
+        thumbnailUrls.delete(oldestKey);
+    }
 }
 
 // 获取类型名称
@@ -1290,11 +1459,55 @@ function showPreview(file) {
         </div>
     `;
 
+    stopPreviewStream();
     previewContent.innerHTML = previewHTML;
+    if ((file.type === 'video' || file.type === 'audio') && file.data) {
+        attachPreviewStream(previewContent.querySelector('video, audio'), file);
+    }
 
     // 显示预览面板
     previewContainer.classList.add('active');
 }
 
+// 视频/音频预览使用服务端按需转码的HLS（音频文件为纯音频流），不需要先下载完整的原始文件；浏览器不支持HLS时播放原始文件
+function attachPreviewStream(media, file) {
+    const hlsUrl = `/api/hls/master.m3u8?id=${serial_id}&file_path=${encodeURIComponent(file.data)}`;
+    const useHls = window.Hls && Hls.isSupported();
+    if (!useHls && !media.canPlayType('application/vnd.apple.mpegurl')) {
+        return;
+    }
+    // 移除原始文件的<source>，避免浏览器同时开始下载原始文件
+    media.querySelectorAll('source').forEach(source => source.remove());
+    if (useHls) {
+        previewHls = new Hls();
+        previewHls.on(Hls.Events.ERROR, (event, data) => {
+            if (data.fatal) {
+                console.error('HLS预览失败，改为播放原始文件:', data);
+                stopPreviewStream();
+                media.src = file.previewUrl;
+            }
+        });
+        previewHls.loadSource(hlsUrl);
+        previewHls.attachMedia(media);
+    } else {
+        media.src = hlsUrl;
+    }
+}
+
+// 停止预览播放，服务端在没有分段请求后停止转码
+function stopPreviewStream() {
+    if (previewHls) {
+        previewHls.destroy();
+        previewHls = null;
+    }
+    const media = previewContent.querySelector('video, audio');
+    if (media) {
+        media.pause();
+        media.querySelectorAll('source').forEach(source => source.remove());
+        media.removeAttribute('src');
+        media.load();
+    }
+}
+
 // 页面加载完成后初始化
 document.addEventListener('DOMContentLoaded', init);
\ No newline at end of file
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailJobCancelled(Exception):
+    """缩略图任务已被取消"""
+
+
+class ThumbnailJob:
+    """一个缩略图任务，多个相同请求共享同一个任务"""
+
+    def __init__(self, key, func, group=None, background=False):
+        self.key = key
+        self.func = func
+        self.background = background
+        # None代表未分组的请求，这类任务不会被按分组取消
+        self.groups = {group}
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """等待任务完成并返回结果"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("缩略图任务等待超时")
+        if self.cancelled:
+            raise ThumbnailJobCancelled(self.key)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class ThumbnailScheduler:
+    """
+    有界的缩略图工作线程池
+    相同key的并发请求合并为一个任务（single-flight），按分组可以批量取消尚未开始的任务
+    后台任务（预热）只在没有前台请求排队时执行，且同时执行的数量不超过 background_workers
+    """
+
+    def __init__(self, workers=None, background_workers=1):
+        self.workers = workers or os.cpu_count() or 2
+        self.background_workers = min(background_workers, self.workers)
+        self._lock = threading.Condition()
+        self._queue = deque()
+        self._background = deque()
+        self._jobs = {}
+        self._running = 0
+        self._background_running = 0
+        self._stats = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        for index in range(self.workers):
+            threading.Thread(target=self._worker, name=f'thumbnail-worker-{index}', daemon=True).start()
+
+    def submit(self, key, func, group=None, background=False):
+        """提交任务；同key任务正在排队或执行时直接复用，排队中的后台任务被前台请求复用时提升为前台任务"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.cancelled:
+                job.groups.add(group)
+                self._stats['coalesced'] += 1
+                if not background and job.background and job.started_at is None:
+                    self._background.remove(job)
+                    job.background = False
+                    self._queue.append(job)
+                    self._lock.notify()
+                return job
+            job = ThumbnailJob(key, func, group, background)
+            self._jobs[key] = job
+            (self._background if background else self._queue).append(job)
+            self._stats['submitted'] += 1
+            self._lock.notify()
+            return job
+
+    def cancel_group(self, group):
+        """取消分组中尚未开始的任务；被其他分组共享的任务保留"""
+        cancelled = 0
+        with self._lock:
+            for queue in (self._queue, self._background):
+                for job in list(queue):
+                    if group not in job.groups:
+                        continue
+                    job.groups.discard(group)
+                    if job.groups:
+                        continue
+                    queue.remove(job)
+                    self._cancel(job)
+                    cancelled += 1
+        if cancelled:
+            logger.info(f"取消缩略图任务: 分组 {group}, 共 {cancelled} 个")
+        return cancelled
+
+    def _cancel(self, job):
+        job.cancelled = True
+        self._jobs.pop(job.key, None)
+        self._stats['cancelled'] += 1
+        job.finish()
+
+    def _next_job(self):
+        """需要持有锁：优先取前台任务，后台任务受并发数限制"""
+        if self._queue:
+            return self._queue.popleft()
+        if self._background and self._background_running < self.background_workers:
+            self._background_running += 1
+            return self._background.popleft()
+        return None
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._lock.wait()
+                    job = self._next_job()
+                job.started_at = time.monotonic()
+                waited = job.started_at - job.enqueued_at
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                self._running += 1
+
+            result, error = None, None
+            try:
+                result = job.func()
+            except Exception as e:
+                logger.error(f"缩略图任务失败: {job.key} - {e}")
+                error = e
+
+            with self._lock:
+                self._running -= 1
+                if job.background:
+                    self._background_running -= 1
+                    self._lock.notify()
+                self._jobs.pop(job.key, None)
+                self._stats['failed' if error else 'completed'] += 1
+            job.finish(result, error)
+
+    def stats(self):
+        """队列深度、等待时间等运行状态"""
+        with self._lock:
+            now = time.monotonic()
+            started = self._stats['completed'] + self._stats['failed'] + self._running
+            return {
+                'workers': self.workers,
+                'queue_depth': len(self._queue),
+                'running': self._running,
+                'background_queue_depth': len(self._background),
+                'background_running': self._background_running,
+                'oldest_wait_ms': round((now - self._queue[0].enqueued_at) * 1000, 1) if self._queue else 0,
+                'avg_wait_ms': round(self._wait_total / started * 1000, 1) if started else 0,
+                'max_wait_ms': round(self._wait_max * 1000, 1),
+                **self._stats
+            }
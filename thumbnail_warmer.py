@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from thumbnail_scheduler import ThumbnailJobCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class WarmTask:
+    """一次缩略图预热：按显示顺序为一组文件生成缩略图"""
+
+    def __init__(self, device_id, name, params, list_paths, first_count):
+        self.device_id = device_id
+        self.name = name
+        self.params = params
+        self.list_paths = list_paths
+        self.first_count = first_count
+        # 每次预热使用独立的分组，被替换的旧任务撤回时不影响新任务
+        self.group = f'warm:{device_id}:{name}:{uuid.uuid4().hex[:8]}'
+        self.state = 'running'
+        self.phase = 'first'
+        self.error = None
+        self.total = None
+        self.processed = 0
+        self.skipped = 0
+        self.generated = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.cancelled = False
+
+    def status(self):
+        return {
+            'device_id': self.device_id,
+            'name': self.name,
+            'state': self.state,
+            'phase': self.phase,
+            'error': self.error,
+            'total': self.total,
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'generated': self.generated,
+            'failed': self.failed,
+            'progress': round(self.processed / self.total * 100, 2) if self.total else (100.0 if self.total == 0 else 0.0),
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class ThumbnailWarmer:
+    """
+    在后台为媒体列表预先生成缩略图
+    前 first_count 个文件连续提交，之后每个文件间隔 rest_delay 秒；任务以后台优先级进入缩略图调度器，
+    同时等待的任务不超过 max_in_flight 个，取消时只需撤回这些任务
+    """
+
+    def __init__(self, prepare, scheduler, max_in_flight=4, rest_delay=0.2, keep_finished=600, job_timeout=600):
+        """
+        :param prepare: (device_id, path) -> (缓存key, 生成函数)，缩略图已存在或不需要生成时返回None
+                        生成函数的返回值与 /api/thumbnail 的任务一致: (缩略图路径, 错误)
+        """
+        self.prepare = prepare
+        self.scheduler = scheduler
+        self.max_in_flight = max_in_flight
+        self.rest_delay = rest_delay
+        self.keep_finished = keep_finished
+        self.job_timeout = job_timeout
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def start(self, device_id, name, params, list_paths, first_count, restart=False):
+        """
+        开始预热；同一设备同名任务参数相同且正在进行或刚完成时直接返回已有任务，参数不同时取消旧任务
+        :param list_paths: () -> 按显示顺序排列的文件路径列表，在后台线程中调用
+        """
+        with self._lock:
+            task = self._tasks.get((device_id, name))
+            if task is not None and not restart and task.params == params and (
+                    task.state == 'running' or time.time() - task.finished_at < self.keep_finished):
+                return task
+            if task is not None and task.state == 'running':
+                self._cancel(task)
+            task = WarmTask(device_id, name, params, list_paths, first_count)
+            self._tasks[(device_id, name)] = task
+        threading.Thread(target=self._run, args=(task,), name=f'thumbnail-warm-{name}', daemon=True).start()
+        logger.info(f"开始预热缩略图: {device_id} {name}")
+        return task
+
+    def _run(self, task):
+        in_flight = deque()
+        try:
+            paths = task.list_paths()
+            task.total = len(paths)
+            for index, path in enumerate(paths):
+                if task.cancelled:
+                    break
+                if index >= task.first_count:
+                    task.phase = 'rest'
+                    time.sleep(self.rest_delay)
+                while len(in_flight) >= self.max_in_flight:
+                    self._collect(task, in_flight.popleft())
+                try:
+                    prepared = self.prepare(task.device_id, path)
+                except Exception as e:
+                    logger.warning(f"预热缩略图失败: {path} - {e}")
+                    task.failed += 1
+                    task.processed += 1
+                    continue
+                if prepared is None:
+                    task.skipped += 1
+                    task.processed += 1
+                    continue
+                key, func = prepared
+                in_flight.append(self.scheduler.submit(key, func, task.group, background=True))
+            while in_flight:
+                self._collect(task, in_flight.popleft())
+        except Exception as e:
+            logger.error(f"预热缩略图中止: {task.device_id} {task.name} - {e}")
+            task.error = str(e)
+        finally:
+            if in_flight:
+                self.scheduler.cancel_group(task.group)
+            # start() 在锁内先看 state 再读 finished_at，两者必须一起更新
+            with self._lock:
+                task.finished_at = time.time()
+                task.state = 'cancelled' if task.cancelled else ('failed' if task.error else 'completed')
+            logger.info(
+                f"预热缩略图结束: {task.device_id} {task.name} {task.state}, "
+                f"生成 {task.generated}, 跳过 {task.skipped}, 失败 {task.failed}"
+            )
+
+    def _collect(self, task, job):
+        try:
+            _thumb_path, error = job.wait(self.job_timeout)
+        except ThumbnailJobCancelled:
+            return
+        except Exception:
+            error = True
+        if error:
+            task.failed += 1
+        else:
+            task.generated += 1
+        task.processed += 1
+
+    def _cancel(self, task):
+        task.cancelled = True
+        self.scheduler.cancel_group(task.group)
+
+    def cancel(self, device_id, name=None):
+        """取消设备的预热任务，返回被取消的任务数"""
+        with self._lock:
+            tasks = [task for (task_device, task_name), task in self._tasks.items()
+                     if task_device == device_id and (name is None or task_name == name) and task.state == 'running']
+            for task in tasks:
+                self._cancel(task)
+        return len(tasks)
+
+    def status(self, device_id=None):
+        with self._lock:
+            return [task.status() for (task_device, _), task in self._tasks.items()
+                    if device_id is None or task_device == device_id]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+content query 输出解析的微基准：旧的整体缓冲+正则解析 vs 流式解析
+用法: python tools/bench_content_query.py [--rows 100000] [--chunk-size 65536]
+生成合成的图片查询输出（部分文件名包含逗号），比较耗时、峰值内存和解析出的条目数
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from content_query import QUERY_END_MARKER, iter_content_rows, iter_lines  # noqa: E402
+
+COLUMNS = ['_id', '_data', 'mime_type', '_size', '_display_name', 'width', 'height', 'date_added', 'date_modified']
+
+# 与原 main.parse_adb_output 相同的正则解析方式
+LEGACY_IMAGE_REGEX = re.compile(
+    r"Row: \d+ _id=(?P<_id>[^,]+),\s+"
+    r"_data=(?P<_data>[^,]+),\s+"
+    r"mime_type=(?P<mime_type>[^,]+),\s+"
+    r"_size=(?P<_size>[^,]+),\s+"
+    r"_display_name=(?P<_display_name>[^,]+),\s+"
+    r"width=(?P<width>[^,]+),\s+"
+    r"height=(?P<height>[^,]+),\s+"
+    r"date_added=(?P<date_added>[^,]+)"
+)
+LEGACY_DATE_MODIFIED_REGEX = re.compile(r",\s+date_modified=(?P<date_modified>[^,]+)")
+
+
+def make_dump(rows):
+    """生成合成的 content query 输出，每50行有一个文件名包含逗号"""
+    lines = []
+    for i in range(rows):
+        name = f'IMG_{i:06d}, copy.jpg' if i % 50 == 0 else f'IMG_{i:06d}.jpg'
+        lines.append(
+            f'Row: {i} _id={i + 1}, _data=/storage/emulated/0/DCIM/Camera/{name}, mime_type=image/jpeg, '
+            f'_size={1000000 + i}, _display_name={name}, width=4032, height=3024, '
+            f'date_added={1700000000 + i}, date_modified={1700000000 + i}'
+        )
+    lines.append(f'{QUERY_END_MARKER} 0')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def chunked(data, chunk_size):
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
+
+def legacy_parse(chunks):
+    """旧实现：等待全部输出后逐行正则匹配，返回字典列表"""
+    output = b''.join(chunks).decode('utf-8', errors='ignore')
+    result = []
+    for line in output.splitlines():
+        match = LEGACY_IMAGE_REGEX.match(line)
+        if not match:
+            continue
+        item = match.groupdict()
+        modified = LEGACY_DATE_MODIFIED_REGEX.match(line, match.end())
+        if modified:
+            item['date_modified'] = modified.group('date_modified')
+        item['path'] = item['_data'][:item['_data'].rfind('/') + 1]
+        result.append(item)
+    return len(result)
+
+
+def streaming_parse(chunks):
+    """新实现：边读边解析，逐行消费后即丢弃"""
+    count = 0
+    for _ in iter_content_rows(iter_lines(chunks), COLUMNS, QUERY_END_MARKER):
+        count += 1
+    return count
+
+
+def measure(name, func, data, chunk_size):
+    # 耗时和内存分两次测量，避免tracemalloc的开销影响计时
+    started = time.perf_counter()
+    count = func(chunked(data, chunk_size))
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(chunked(data, chunk_size))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:<10} 条目 {count:>7}  耗时 {elapsed * 1000:8.1f} ms  峰值内存 {peak / 1024 / 1024:7.2f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='content query 解析基准')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    data = make_dump(args.rows)
+    print(f'合成输出: {args.rows} 行, {len(data) / 1024 / 1024:.1f} MiB')
+    measure('regex', legacy_parse, data, args.chunk_size)
+    measure('streaming', streaming_parse, data, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+服务端离线基准：在合成模拟设备上运行，结果写入JSON报告，可与之前的报告对比发现性能退化
+用法: python tools/bench_server.py [--rows 10000] [--latency 0.002] [--bandwidth 40000000] [--repeat 3]
+                                   [--output bench_report.json] [--baseline old_report.json --max-regression 0.2]
+      --bench 只运行指定的项目（逗号分隔）: parse_adb_output, parse_ls_output, get_media_list, get_files,
+      search, thumbnails, hls, downloads
+
+模拟设备由 tools/device_simulator.py 生成，设备命令由 tools/fake_adb.py 和 tools/fake_adb_server.py 执行，
+缩略图和HLS预览默认使用 tools/fake_ffmpeg.py（--real-ffmpeg 使用本机ffmpeg）。缓存和索引写入临时目录，不影响本地数据
+对比时按各项目耗时的中位数判断，任一项目变慢超过 --max-regression 时退出码为1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, TOOLS_DIR)
+import device_simulator  # noqa: E402
+
+REPORT_VERSION = 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'模拟adb server未能在 {timeout} 秒内启动')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(runs):
+    return {
+        'runs': [round(run, 6) for run in runs],
+        'min': round(min(runs), 6),
+        'median': round(statistics.median(runs), 6),
+        'mean': round(statistics.mean(runs), 6),
+        'max': round(max(runs), 6),
+    }
+
+
+def result(runs, items, unit, **extra):
+    """一个项目的结果：耗时统计（秒）、每次处理的数量和按中位数计算的吞吐量"""
+    seconds = summarize(runs)
+    return {
+        'seconds': seconds,
+        'items': items,
+        'throughput': round(items / seconds['median'], 2) if seconds['median'] else None,
+        'unit': unit,
+        **extra
+    }
+
+
+class Bench:
+    """运行环境：模拟设备、模拟adb server和在本进程中启动的服务端"""
+
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix='afs-bench-')
+        self.device_dir = os.path.join(self.work_dir, 'device')
+        self.serial = device_simulator.SERIAL
+        self.adb_server = None
+        self.http_server = None
+        self.main = None
+
+    def start(self):
+        args = self.args
+        started = time.perf_counter()
+        fixture = device_simulator.build_device(
+            self.device_dir, args.rows, args.file_size, args.download_files, args.download_size,
+            args.latency, args.bandwidth)
+        print(f'模拟设备: {args.rows} 个图片条目, 生成耗时 {time.perf_counter() - started:.1f} s')
+
+        adb_port = free_port()
+        env = {**os.environ, 'FAKE_ADB_FIXTURE': fixture}
+        self.adb_server = subprocess.Popen(
+            [sys.executable, os.path.join(TOOLS_DIR, 'fake_adb_server.py'), '--port', str(adb_port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(adb_port)
+
+        # 服务端在导入时读取这些环境变量
+        os.environ.update({
+            'FAKE_ADB_FIXTURE': fixture,
+            'ADB_BIN': os.path.join(TOOLS_DIR, 'fake_adb.py'),
+            'ANDROID_ADB_SERVER_PORT': str(adb_port),
+            'AFS_DATA_DIR': os.path.join(self.work_dir, 'data'),
+            'FAKE_FFMPEG_DELAY': str(args.ffmpeg_delay),
+        })
+        if not args.real_ffmpeg:
+            bin_dir = os.path.join(self.work_dir, 'bin')
+            os.makedirs(bin_dir)
+            os.symlink(os.path.join(TOOLS_DIR, 'fake_ffmpeg.py'), os.path.join(bin_dir, 'ffmpeg'))
+            os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+        sys.path.insert(0, BASE_DIR)
+        import main
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        main.THUMBNAIL_WARM_ON_LIST = False
+        # 下载测试每次都从设备读取，不写入本地缓存
+        main.FILE_STREAM_TEE_TO_CACHE = False
+        self.main = main
+
+        from werkzeug.serving import make_server
+        self.http_server = make_server('127.0.0.1', 0, main.app, threaded=True)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.http_server.server_port}'
+        main.HLS_LOOPBACK_URL = self.base_url
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+        if self.adb_server:
+            self.adb_server.terminate()
+            self.adb_server.wait()
+        if self.args.keep:
+            print(f'保留临时目录: {self.work_dir}')
+        else:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def get(self, route, params):
+        """请求服务端，返回 (状态码, 响应体, 耗时)"""
+        return self.get_url(f'{route}?{urlencode({"id": self.serial, **params})}')
+
+    def get_url(self, path):
+        """请求服务端返回的相对地址（播放列表中的地址）"""
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=600) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        return status, body, time.perf_counter() - started
+
+    def post_json(self, route, payload):
+        """以JSON请求体POST到服务端，返回 (状态码, 响应体, 耗时)"""
+        started = time.perf_counter()
+        request = urllib.request.Request(f'{self.base_url}{route}?{urlencode({"id": self.serial})}',
+                                         data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        return status, body, time.perf_counter() - started
+
+    def timed(self, func):
+        runs = []
+        value = None
+        for _ in range(self.args.repeat):
+            started = time.perf_counter()
+            value = func()
+            runs.append(time.perf_counter() - started)
+        return runs, value
+
+    def bench_parse_adb_output(self):
+        with open(os.path.join(self.device_dir, 'mediastore', 'image.txt'), encoding='utf-8') as f:
+            text = f.read()
+        runs, rows = self.timed(lambda: len(self.main.parse_adb_output(text, 'image')))
+        return {'parse_adb_output': result(runs, rows, 'rows/s')}
+
+    def bench_parse_ls_output(self):
+        text = device_simulator.ls_output(self.args.rows)
+        runs, rows = self.timed(lambda: len(self.main.parse_ls_output(text, '/sdcard/DCIM/Camera')))
+        return {'parse_ls_output': result(runs, rows, 'rows/s')}
+
+    def bench_get_media_list(self):
+        runs, rows = self.timed(lambda: sum(1 for _ in self.main.get_media_list(self.serial, 'image')))
+        return {'get_media_list': result(runs, rows, 'rows/s')}
+
+    def bench_get_files(self):
+        path = '/sdcard/' + device_simulator.MEDIA_LAYOUT['image'][0]
+
+        def listing(refresh):
+            status, body, _elapsed = self.get('/api/get_files', {'path': path, 'refresh': refresh})
+            if status != 200:
+                raise RuntimeError(f'/api/get_files 返回 {status}: {body[:200]}')
+            return len(json.loads(body))
+
+        cold_runs, entries = self.timed(lambda: listing('1'))
+        warm_runs, _ = self.timed(lambda: listing('0'))
+        return {
+            'get_files_cold': result(cold_runs, entries, 'entries/s'),
+            'get_files_warm': result(warm_runs, entries, 'entries/s'),
+        }
+
+    def bench_search(self):
+        def search(query):
+            status, body, _elapsed = self.get('/api/search', {'id': self.serial, 'q': query})
+            if status != 200:
+                raise RuntimeError(f'/api/search 返回 {status}: {body[:200]}')
+            return len(json.loads(body))
+
+        # 第一次搜索同步文件表并建立索引，单独记录
+        first_runs, _ = self.timed(lambda: search('copy'))
+        runs, matches = self.timed(lambda: search('copy'))
+        return {
+            'search_first': result(first_runs[:1], matches, 'rows/s'),
+            'search': result(runs, matches, 'rows/s'),
+        }
+
+    def bench_hls(self):
+        files = device_simulator.media_files('video', self.args.rows)
+
+        def first_segment(path):
+            """打开预览到拿到第一个分段：主播放列表、第一个档位的播放列表、第0段"""
+            status, body, _elapsed = self.get('/api/hls/master.m3u8', {'file_path': path})
+            playlist = [line for line in body.decode().splitlines() if line.startswith('/')][0] if status == 200 else ''
+            if playlist:
+                status, body, _elapsed = self.get_url(playlist)
+            segment = [line for line in body.decode().splitlines() if line.startswith('/')][0] if status == 200 else ''
+            if segment:
+                status, body, _elapsed = self.get_url(segment)
+            if status != 200:
+                raise RuntimeError(f'HLS预览返回 {status}: {body[:200]}')
+            return len(body)
+
+        # 每次使用不同的文件，保证分段缓存未命中
+        runs = []
+        for run in range(self.args.repeat):
+            _row_id, path = files[run % len(files)]
+            started = time.perf_counter()
+            first_segment(path.replace(device_simulator.STORAGE_ROOT, '/sdcard', 1))
+            runs.append(time.perf_counter() - started)
+        return {'hls_first_segment': result(runs, 1, 'starts/s')}
+
+    def concurrent_gets(self, requests):
+        """并发执行请求，返回 (耗时, 各请求耗时, 失败数, 响应字节数)"""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.args.concurrency) as pool:
+            responses = list(pool.map(lambda item: self.get(*item), requests))
+        elapsed = time.perf_counter() - started
+        failures = sum(status >= 400 for status, _body, _latency in responses)
+        return elapsed, [latency for _status, _body, latency in responses], failures, sum(
+            len(body) for _status, body, _latency in responses)
+
+    def bench_thumbnails(self):
+        files = device_simulator.media_files('image', self.args.rows)
+        # 每次使用不同的文件，保证缩略图和文件缓存都未命中
+        count = max(1, min(self.args.thumbnails, len(files) // self.args.repeat))
+        runs, latencies, failures = [], [], 0
+        for run in range(self.args.repeat):
+            batch = files[run * count:(run + 1) * count]
+            requests = [('/api/thumbnail', {'file_path': path, 'category': 'image', 'file_name': path.rsplit('/', 1)[1]})
+                        for _row_id, path in batch]
+            elapsed, run_latencies, run_failures, _size = self.concurrent_gets(requests)
+            runs.append(elapsed)
+            latencies += run_latencies
+            failures += run_failures
+        return {'thumbnails': result(runs, count, 'thumbnails/s', failures=failures, concurrency=self.args.concurrency,
+                                     latency_p50=round(percentile(latencies, 0.5), 6),
+                                     latency_p95=round(percentile(latencies, 0.95), 6))}
+
+    def bench_thumbnail_bundle(self):
+        files = device_simulator.media_files('image', self.args.rows)
+        # 一页文件一次请求，从列表末尾取文件，不与逐个请求的测试重复
+        count = max(1, min(self.main.PER_PAGE, len(files) // (2 * self.args.repeat)))
+        cold, cached, failures = [], [], 0
+        for run in range(self.args.repeat):
+            batch = files[len(files) - (run + 1) * count:len(files) - run * count]
+            payload = {'files': [{'file_path': path} for _row_id, path in batch],
+                       'size': self.main.THUMBNAIL_WARM_SIZE, 'format': 'webp'}
+            for runs in (cold, cached):
+                status, _body, elapsed = self.post_json('/api/thumbnail/bundle', payload)
+                failures += status != 200
+                runs.append(elapsed)
+        return {
+            'thumbnail_bundle': result(cold, count, 'thumbnails/s', failures=failures),
+            'thumbnail_bundle_cached': result(cached, count, 'thumbnails/s'),
+        }
+
+    def bench_downloads(self):
+        paths = [f'/sdcard/{device_simulator.DOWNLOAD_DIR}/file_{i:03d}.bin' for i in range(self.args.download_files)]
+        requests = [('/api/file', {'file_path': path, 'category': 'downloads', 'file_name': path.rsplit('/', 1)[1]})
+                    for path in paths]
+        runs, latencies, failures, total_bytes = [], [], 0, 0
+        for _ in range(self.args.repeat):
+            elapsed, run_latencies, run_failures, total_bytes = self.concurrent_gets(requests)
+            runs.append(elapsed)
+            latencies += run_latencies
+            failures += run_failures
+        summary = result(runs, total_bytes, 'bytes/s', files=len(paths), failures=failures,
+                         concurrency=self.args.concurrency,
+                         latency_p50=round(percentile(latencies, 0.5), 6),
+                         latency_p95=round(percentile(latencies, 0.95), 6))
+        return {'downloads': summary}
+
+
+BENCHMARKS = ['parse_adb_output', 'parse_ls_output', 'get_media_list', 'get_files', 'search', 'thumbnails', 'thumbnail_bundle', 'hls', 'downloads']
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, max_regression):
+    """按耗时中位数与基准报告对比，返回退化的项目列表"""
+    if baseline.get('config') != report['config']:
+        print('注意: 基准报告的测试参数不同，对比结果仅供参考')
+    regressions = []
+    print(f'\n{"项目":<18}{"基准(ms)":>12}{"本次(ms)":>12}{"变化":>10}')
+    for name, current in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        before, after = previous['seconds']['median'], current['seconds']['median']
+        change = (after - before) / before if before else 0
+        flag = '  退化' if change > max_regression else ''
+        print(f'{name:<18}{before * 1000:>12.1f}{after * 1000:>12.1f}{change:>+10.1%}{flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务端离线基准')
+    parser.add_argument('--rows', type=int, default=10000, help='模拟设备的图片条目数（1000-200000）')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='每个媒体文件的大小')
+    parser.add_argument('--download-files', type=int, default=8)
+    parser.add_argument('--download-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.002, help='每条adb命令的模拟延迟，单位为秒')
+    parser.add_argument('--bandwidth', type=float, default=40e6, help='每台设备的模拟带宽，字节/秒，0为不限速')
+    parser.add_argument('--ffmpeg-delay', type=float, default=0.05, help='模拟ffmpeg每次转码的耗时，单位为秒')
+    parser.add_argument('--real-ffmpeg', action='store_true', help='使用本机ffmpeg（模拟文件不是有效的媒体文件）')
+    parser.add_argument('--thumbnails', type=int, default=100, help='每次缩略图测试的文件数')
+    parser.add_argument('--concurrency', type=int, default=8, help='缩略图和下载测试的并发请求数')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--bench', default=','.join(BENCHMARKS))
+    parser.add_argument('--output', default='bench_report.json')
+    parser.add_argument('--baseline', help='之前的报告，用于对比')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='耗时中位数允许增加的比例')
+    parser.add_argument('--keep', action='store_true', help='保留模拟设备和缓存所在的临时目录')
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.bench.split(',') if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'未知的项目: {", ".join(sorted(unknown))}')
+
+    bench = Bench(args)
+    results = {}
+    try:
+        bench.start()
+        for name in selected:
+            for key, value in getattr(bench, f'bench_{name}')().items():
+                results[key] = value
+                print(f'{key:<18} 中位数 {value["seconds"]["median"] * 1000:9.1f} ms  '
+                      f'{value["throughput"]:>14,.1f} {value["unit"]}')
+    finally:
+        bench.stop()
+
+    report = {
+        'version': REPORT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: getattr(args, key) for key in (
+            'rows', 'file_size', 'download_files', 'download_size', 'latency', 'bandwidth', 'ffmpeg_delay',
+            'real_ffmpeg', 'thumbnails', 'concurrency', 'repeat')},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'报告已写入 {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f'性能退化: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
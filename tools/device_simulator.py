@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+合成模拟设备：按指定规模生成文件系统、MediaStore查询输出和 fake_adb 配置，供基准测试和压力调试使用
+用法: python tools/device_simulator.py OUT_DIR [--rows 10000] [--latency 0.002] [--bandwidth 40000000]
+      之后设置 FAKE_ADB_FIXTURE=OUT_DIR/fixture.json，配合 tools/fake_adb.py 和 tools/fake_adb_server.py 使用
+文件均为稀疏文件，20万条目也只占用很少的磁盘空间；/sdcard 是指向 /storage/emulated/0 的链接，与真机一致
+"""
+import argparse
+import json
+import os
+
+SERIAL = 'SIM00001'
+STORAGE_ROOT = '/storage/emulated/0'
+MEDIA_URIS = {
+    'image': 'content://media/external/images/media',
+    'video': 'content://media/external/video/media',
+    'audio': 'content://media/external/audio/media',
+}
+FILE_URI = 'content://media/external/file'
+FILE_PROJECTION = '_id:_data:mime_type:_size:_display_name:date_added:date_modified'
+PROJECTIONS = {
+    'image': '_id:_data:mime_type:_size:_display_name:width:height:date_added:date_modified',
+    'video': '_id:_data:mime_type:_size:_display_name:width:height:date_added:date_modified',
+    'audio': '_id:_data:mime_type:_size:_display_name:date_added:date_modified',
+}
+# 每种媒体的目录、文件名格式、MIME类型、占图片数量的比例
+MEDIA_LAYOUT = {
+    'image': ('DCIM/Camera', 'IMG_{:06d}.jpg', 'image/jpeg', 1),
+    'video': ('Movies', 'VID_{:06d}.mp4', 'video/mp4', 20),
+    'audio': ('Music', 'SONG_{:06d}.mp3', 'audio/mpeg', 20),
+}
+DOWNLOAD_DIR = 'Download/bench'
+BASE_TIME = 1700000000
+
+
+def media_files(media_type, rows):
+    """返回 [(_id, 设备路径)]；_id 在各类型之间不重复，每50个文件有一个文件名包含逗号（content query 输出的边界情况）"""
+    directory, pattern, _mime, ratio = MEDIA_LAYOUT[media_type]
+    count = max(1, rows // ratio)
+    offset = {'image': 0, 'video': 10_000_000, 'audio': 20_000_000}[media_type]
+    files = []
+    for i in range(count):
+        name = pattern.format(i)
+        if i % 50 == 0:
+            stem, ext = os.path.splitext(name)
+            name = f'{stem}, copy{ext}'
+        files.append((offset + i + 1, f'{STORAGE_ROOT}/{directory}/{name}'))
+    return files
+
+
+def media_query_lines(media_type, files, file_size, with_dimensions=True):
+    """content query 输出；with_dimensions为False时不输出宽高（文件表的投影）"""
+    _directory, _pattern, mime_type, _ratio = MEDIA_LAYOUT[media_type]
+    for row, (row_id, path) in enumerate(files):
+        name = path.rsplit('/', 1)[1]
+        date = BASE_TIME + row
+        if media_type == 'audio' or not with_dimensions:
+            extra = ''
+        else:
+            extra = ', width=4032, height=3024' if media_type == 'image' else ', width=1920, height=1080'
+        yield (
+            f'Row: {row} _id={row_id}, _data={path}, mime_type={mime_type}, _size={file_size}, '
+            f'_display_name={name}{extra}, date_added={date}, date_modified={date}\n'
+        )
+
+
+def ls_output(rows):
+    """ls -l 格式的目录列表（parse_ls_output的输入）"""
+    lines = []
+    for i in range(rows):
+        if i % 100 == 0:
+            lines.append(f'drwxrws--- 2 u0_a123 media_rw 3452 2024-06-04 10:00 Folder_{i:06d}')
+        else:
+            lines.append(f'-rw-rw---- 1 u0_a123 media_rw {1000000 + i} 2024-06-04 10:{i % 60:02d} IMG_{i:06d}.jpg')
+    return '\n'.join(lines) + '\n'
+
+
+def sparse_file(path, size, mtime):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    os.utime(path, (mtime, mtime))
+
+
+def build_device(out_dir, rows=10000, file_size=64 * 1024, download_files=8, download_size=8 * 1024 * 1024,
+                 latency=0.0, bandwidth=0.0, serial=SERIAL):
+    """
+    生成模拟设备，返回配置文件路径
+    :param rows: 图片条目数；视频和音频各为其 1/20
+    :param file_size: 每个媒体文件的大小（稀疏文件）
+    :param download_files: Download/bench 下用于并发下载测试的文件数
+    """
+    root = os.path.join(out_dir, 'root')
+    storage = os.path.join(root, STORAGE_ROOT.lstrip('/'))
+    mediastore = os.path.join(out_dir, 'mediastore')
+    os.makedirs(mediastore, exist_ok=True)
+    os.makedirs(storage, exist_ok=True)
+    sdcard = os.path.join(root, 'sdcard')
+    if not os.path.lexists(sdcard):
+        os.symlink(os.path.relpath(storage, root), sdcard)
+
+    commands = {
+        'getprop ro.product.model': {'stdout': 'Simulated Device\n'},
+        'df /data': {'stdout': 'Filesystem     1K-blocks     Used Available Use% Mounted on\n'
+                               '/dev/block/dm-8 115343360 52428800  62914560  46% /data\n'},
+        'dumpsys battery': {'stdout': 'Current Battery Service state:\n  level: 100\n  scale: 100\n'},
+        'content call --uri content://media --method get_version --extra android.intent.extra.TEXT:s:external_primary': {
+            'stdout': 'Result: Bundle[{android.intent.extra.TEXT=1.0.0.0-sim}]\n'},
+    }
+    file_table = os.path.join(mediastore, 'file.txt')
+    with open(file_table, 'w', encoding='utf-8'):
+        pass
+    for media_type, uri in MEDIA_URIS.items():
+        files = media_files(media_type, rows)
+        directory = os.path.join(storage, MEDIA_LAYOUT[media_type][0])
+        os.makedirs(directory, exist_ok=True)
+        for row, (_row_id, path) in enumerate(files):
+            sparse_file(os.path.join(root, path.lstrip('/')), file_size, BASE_TIME + row)
+        rows_file = os.path.join(mediastore, f'{media_type}.txt')
+        with open(rows_file, 'w', encoding='utf-8') as f:
+            f.writelines(media_query_lines(media_type, files, file_size))
+        ids_file = os.path.join(mediastore, f'{media_type}_ids.txt')
+        with open(ids_file, 'w', encoding='utf-8') as f:
+            f.writelines(f'Row: {row} _id={row_id}\n' for row, (row_id, _path) in enumerate(files))
+        commands[f'content query --uri {uri} --projection {PROJECTIONS[media_type]}'] = {
+            'file': os.path.relpath(rows_file, out_dir)}
+        commands[f'content query --uri {uri} --projection _id'] = {'file': os.path.relpath(ids_file, out_dir)}
+        # 文件表包含全部媒体文件（行号在各类型之间不连续，与解析无关）
+        with open(file_table, 'a', encoding='utf-8') as f:
+            f.writelines(media_query_lines(media_type, files, file_size, with_dimensions=False))
+    commands[f'content query --uri {FILE_URI} --projection {FILE_PROJECTION}'] = {
+        'file': os.path.relpath(file_table, out_dir)}
+
+    downloads = os.path.join(storage, DOWNLOAD_DIR)
+    os.makedirs(downloads, exist_ok=True)
+    for i in range(download_files):
+        sparse_file(os.path.join(downloads, f'file_{i:03d}.bin'), download_size, BASE_TIME)
+
+    fixture = {
+        'devices': [serial],
+        'root': 'root',
+        'commands': commands,
+        'simulate': {'latency': latency, 'bandwidth': bandwidth},
+    }
+    fixture_path = os.path.join(out_dir, 'fixture.json')
+    with open(fixture_path, 'w', encoding='utf-8') as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=2)
+    return fixture_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成模拟设备')
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=10000, help='图片条目数，视频和音频各为其1/20')
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--download-files', type=int, default=8)
+    parser.add_argument('--download-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0, help='每条命令的模拟延迟，单位为秒')
+    parser.add_argument('--bandwidth', type=float, default=0.0, help='模拟带宽，字节/秒，0为不限速')
+    args = parser.parse_args()
+
+    fixture_path = build_device(args.out_dir, args.rows, args.file_size, args.download_files, args.download_size,
+                                args.latency, args.bandwidth)
+    print(f'模拟设备 {SERIAL}: {fixture_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+模拟 adb 可执行文件，用于在没有手机的情况下调试服务端
+用法: ADB_BIN=tools/fake_adb.py python main.py
+      FAKE_ADB_FIXTURE 指向固定输出配置（默认 tools/fake_adb_fixture.json）
+
+配置格式:
+{
+    "devices": ["FAKE0001"],
+    "root": "相对配置文件的目录，作为设备文件系统，pull/push使用",
+    "commands": {"getprop ro.product.model": {"stdout": "Pixel 7\\n", "stderr": "", "rc": 0},
+                 "content query --uri ...": {"file": "输出较大时可以放在文件中（相对配置文件的路径）"}},
+    "simulate": {"latency": 0.005, "bandwidth": 40000000}
+}
+shell命令由本机 sh 执行，commands 中的命令以同名shell函数的形式返回固定输出
+"content query --uri ... --projection ..." 的固定输出同样用于带 --where 的查询：条件由 sqlite 对各行执行，与设备上的MediaStore一致
+simulate 为可选的链路模拟：每条命令（adb server 的每个请求）延迟 latency 秒，输出数据按 bandwidth 字节/秒限速
+"""
+import json
+import os
+import re
+import shlex
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+from content_query import iter_content_rows  # noqa: E402
+
+FIXTURE_PATH = os.environ.get(
+    'FAKE_ADB_FIXTURE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_adb_fixture.json')
+)
+
+
+def load_fixture():
+    """读取固定输出配置"""
+    with open(FIXTURE_PATH, encoding='utf-8') as f:
+        fixture = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(FIXTURE_PATH))
+    root = fixture.get('root')
+    if root and not os.path.isabs(root):
+        fixture['root'] = os.path.join(base_dir, root)
+    for output in fixture.get('commands', {}).values():
+        if output.get('file') and not os.path.isabs(output['file']):
+            output['file'] = os.path.join(base_dir, output['file'])
+    return fixture
+
+
+class Link:
+    """模拟设备连接：固定延迟加上按带宽限速，bandwidth为0时不限速"""
+
+    def __init__(self, simulate):
+        self.latency = float(simulate.get('latency', 0))
+        self.bandwidth = float(simulate.get('bandwidth', 0))
+        self._next_send = 0.0
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def pace(self, size):
+        """传输 size 字节后调用，等待到带宽允许的时间"""
+        if not self.bandwidth:
+            return
+        now = time.monotonic()
+        self._next_send = max(self._next_send, now) + size / self.bandwidth
+        if self._next_send > now:
+            time.sleep(self._next_send - now)
+
+
+def output_command(output):
+    """输出固定标准输出的shell命令"""
+    if output.get('file'):
+        return f"cat {shlex.quote(output['file'])}"
+    return f"printf '%s' {shlex.quote(output.get('stdout', ''))}"
+
+
+def filter_rows(projection, where):
+    """从标准输入读取 content query 输出，只输出满足 --where 条件的行"""
+    columns = projection.split(':')
+    db = sqlite3.connect(':memory:')
+    db.execute(f"CREATE TABLE t ({', '.join(columns)})")
+    rows = list(iter_content_rows((line.rstrip('\n') for line in sys.stdin), columns))
+    # 数字按整数保存，date_modified>=N 之类的条件按数值比较
+    db.executemany(f"INSERT INTO t VALUES ({', '.join('?' * len(columns))})",
+                   [[int(v) if v is not None and v.isdigit() else v for v in values] for values in rows])
+    try:
+        matched = [row_id - 1 for (row_id,) in db.execute(f'SELECT rowid FROM t WHERE {where} ORDER BY rowid')]
+    except sqlite3.Error as e:
+        print(f'Error while accessing provider:media\n{e}', file=sys.stderr)
+        return 1
+    for number, index in enumerate(matched):
+        fields = ', '.join(f"{column}={'NULL' if value is None else value}" for column, value in zip(columns, rows[index]))
+        sys.stdout.write(f'Row: {number} {fields}\n')
+    if not matched:
+        sys.stdout.write('No result found.\n')
+    return 0
+
+
+def build_prologue(commands):
+    """把固定输出转换为shell函数定义"""
+    grouped = {}
+    for command, output in commands.items():
+        name, _, rest = command.partition(' ')
+        grouped.setdefault(name, []).append((rest, output))
+
+    lines = []
+    for name, cases in grouped.items():
+        lines.append(f'{name}() {{')
+        lines.append('case "$*" in')
+        for rest, output in cases:
+            body = output_command(output)
+            if output.get('stderr'):
+                body += f"; printf '%s' {shlex.quote(output['stderr'])} >&2"
+            body += f"; return {int(output.get('rc', 0))}"
+            lines.append(f'{shlex.quote(rest)}) {body};;')
+        for rest, output in cases:
+            if name == 'content' and rest.startswith('query ') and '--projection' in rest and '--where' not in rest:
+                # query --uri U --projection P --where W：$5 为投影，$7 为条件
+                lines.append(
+                    f'{shlex.quote(rest + " --where ")}*) {{ {output_command(output)}; }} | '
+                    f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} filter-rows "$5" "$7"; return $?;;'
+                )
+        lines.append(f'*) command {name} "$@";;')
+        lines.append('esac')
+        lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+DEVICE_PATH_REGEX = re.compile(r"(?<=[\s'\"=])/(?=sdcard\b|storage\b)")
+
+
+def rewrite_paths(fixture, command):
+    """把命令中的 /sdcard、/storage 路径映射到模拟根目录"""
+    root = fixture.get('root')
+    if not root:
+        return command
+    return DEVICE_PATH_REGEX.sub(lambda _: root.rstrip('/') + '/', ' ' + command)[1:]
+
+
+def device_list_block(devices):
+    """host:devices / track-devices 格式：4位十六进制长度 + 设备列表"""
+    data = ''.join(f'{device}\tdevice\n' for device in devices).encode('utf-8')
+    return b'%04x' % len(data) + data
+
+
+def watch_devices(interval=0.5):
+    """track-devices：先返回当前设备列表，之后配置文件中的设备列表变化时再返回"""
+    last = None
+    while True:
+        try:
+            devices = load_fixture().get('devices', [])
+        except (OSError, ValueError):
+            devices = last or []
+        if devices != last:
+            last = devices
+            yield devices
+        time.sleep(interval)
+
+
+def restore_paths(fixture, data):
+    """把输出中的模拟根目录还原为设备路径（find等命令会输出完整路径）"""
+    root = fixture.get('root')
+    if not root:
+        return data
+    return data.replace(root.rstrip('/').encode('utf-8') + b'/', b'/')
+
+
+def device_path(fixture, remote_path):
+    """把设备路径映射到本机模拟根目录"""
+    root = fixture.get('root') or '/'
+    return os.path.join(root, remote_path.lstrip('/'))
+
+
+def main(argv):
+    if argv[:1] == ['filter-rows'] and len(argv) == 3:
+        return filter_rows(argv[1], argv[2])
+    fixture = load_fixture()
+    serial = None
+    if len(argv) >= 2 and argv[0] == '-s':
+        serial, argv = argv[1], argv[2:]
+
+    if not argv:
+        print('fake adb: missing command', file=sys.stderr)
+        return 1
+
+    verb, args = argv[0], argv[1:]
+    devices = fixture.get('devices', [])
+
+    if verb == '--version':
+        print('Android Debug Bridge version 1.0.41 (fake)')
+        return 0
+    if verb == 'devices':
+        print('List of devices attached')
+        for device in devices:
+            print(f'{device}\tdevice')
+        print()
+        return 0
+
+    if verb == 'track-devices':
+        try:
+            for current in watch_devices():
+                sys.stdout.buffer.write(device_list_block(current))
+                sys.stdout.buffer.flush()
+        except (BrokenPipeError, KeyboardInterrupt):
+            pass
+        return 0
+
+    if serial is None and len(devices) == 1:
+        serial = devices[0]
+    if serial not in devices:
+        print(f"adb: device '{serial}' not found", file=sys.stderr)
+        return 1
+
+    link = Link(fixture.get('simulate', {}))
+    link.delay()
+    if verb in ('shell', 'exec-out', 'exec-in'):
+        prologue = build_prologue(fixture.get('commands', {}))
+        cwd = fixture.get('root') or None
+        if args:
+            script = prologue + rewrite_paths(fixture, ' '.join(args)) + '\n'
+            proc = subprocess.Popen(['sh', '-c', script], stdout=subprocess.PIPE, cwd=cwd)
+            for chunk in iter(lambda: proc.stdout.read1(65536), b''):
+                sys.stdout.buffer.write(restore_paths(fixture, chunk))
+                sys.stdout.buffer.flush()
+                link.pace(len(chunk))
+            return proc.wait()
+        # 交互会话：先写入函数定义，再转发标准输入
+        proc = subprocess.Popen(['sh'], stdin=subprocess.PIPE, cwd=cwd)
+        proc.stdin.write(prologue.encode('utf-8'))
+        proc.stdin.flush()
+        try:
+            for line in sys.stdin.buffer:
+                link.delay()
+                proc.stdin.write(rewrite_paths(fixture, line.decode('utf-8')).encode('utf-8'))
+                proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        return proc.wait()
+
+    if verb == 'pull' and len(args) == 2:
+        with open(device_path(fixture, args[0]), 'rb') as src, open(args[1], 'wb') as dst:
+            for chunk in iter(lambda: src.read(65536), b''):
+                dst.write(chunk)
+                link.pace(len(chunk))
+        print(f'{args[0]}: 1 file pulled.')
+        return 0
+    if verb == 'push' and len(args) == 2:
+        target = device_path(fixture, args[1])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(args[0], target)
+        print(f'{args[0]}: 1 file pushed.')
+        return 0
+
+    print(f'fake adb: unsupported command: {verb}', file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+模拟 adb server（TCP 5037 协议），用于在没有手机的情况下调试 adb_client
+用法: python tools/fake_adb_server.py [--port 5037]
+      服务端使用 ANDROID_ADB_SERVER_PORT 连接同一端口即可
+设备列表、文件系统根目录和shell固定输出与 tools/fake_adb.py 共用同一份配置
+支持: host:version/devices/track-devices/features/transport, sync: STAT/STA2/LIST/LIS2/RECV/SEND/QUIT, shell:/exec:
+配置中的 simulate 对每个设备请求和sync命令增加延迟，同一设备的所有连接共享带宽（模拟一条USB链路）
+"""
+import argparse
+import os
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_adb import Link, load_fixture, build_prologue, device_list_block, device_path, restore_paths, rewrite_paths, watch_devices  # noqa: E402
+
+FEATURES = 'shell_v2,cmd,stat_v2,ls_v2,fixed_push_mkdir'
+
+
+class SharedLink(Link):
+    """同一设备的多条连接共用的模拟链路"""
+
+    _links = {}
+    _links_lock = threading.Lock()
+
+    def __init__(self, simulate):
+        super().__init__(simulate)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_device(cls, serial, simulate):
+        with cls._links_lock:
+            link = cls._links.get(serial)
+            if link is None:
+                link = cls._links[serial] = cls(simulate)
+            return link
+
+    def pace(self, size):
+        with self._lock:
+            super().pace(size)
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    """处理一条客户端连接"""
+
+    def setup(self):
+        self.fixture = load_fixture()
+        self.serial = None
+        self.link = None
+
+    def send_data(self, data):
+        """发送设备数据，按模拟带宽限速"""
+        self.request.sendall(data)
+        if self.link:
+            self.link.pace(len(data))
+
+    def read_exact(self, size):
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.request.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError('client closed')
+            buf += chunk
+        return bytes(buf)
+
+    def okay(self, payload=None):
+        if payload is None:
+            self.request.sendall(b'OKAY')
+        else:
+            data = payload.encode('utf-8')
+            self.request.sendall(b'OKAY' + b'%04x' % len(data) + data)
+
+    def fail(self, message):
+        data = message.encode('utf-8')
+        self.request.sendall(b'FAIL' + b'%04x' % len(data) + data)
+
+    def handle(self):
+        try:
+            while True:
+                length = int(self.read_exact(4), 16)
+                request = self.read_exact(length).decode('utf-8')
+                if not self.dispatch(request):
+                    return
+        except (ConnectionError, ValueError):
+            return
+
+    def dispatch(self, request):
+        """处理一个请求，返回True表示连接继续用于下一个请求"""
+        devices = self.fixture.get('devices', [])
+        if request == 'host:version':
+            self.okay('0029')
+        elif request in ('host:devices', 'host:devices-l'):
+            self.okay(''.join(f'{d}\tdevice\n' for d in devices))
+        elif request == 'host:track-devices':
+            self.okay()
+            try:
+                for current in watch_devices():
+                    self.request.sendall(device_list_block(current))
+            except OSError:
+                pass
+        elif request == 'host:features' or (request.startswith('host-serial:') and request.endswith(':features')):
+            self.okay(self.fixture.get('features', FEATURES))
+        elif request.startswith('host:transport:') or request == 'host:transport-any':
+            serial = request[len('host:transport:'):] if request.startswith('host:transport:') else (devices or [None])[0]
+            if serial not in devices:
+                self.fail(f"device '{serial}' not found")
+                return False
+            self.serial = serial
+            self.link = SharedLink.for_device(serial, self.fixture.get('simulate', {}))
+            self.link.delay()
+            self.okay()
+            return True
+        elif self.serial and request == 'sync:':
+            self.okay()
+            self.sync_loop()
+        elif self.serial and (request.startswith('shell:') or request.startswith('exec:')):
+            self.okay()
+            self.run_shell(request.partition(':')[2], merge_stderr=request.startswith('shell:'))
+        else:
+            self.fail(f'unknown request: {request}')
+        return False
+
+    def run_shell(self, command, merge_stderr):
+        script = build_prologue(self.fixture.get('commands', {})) + rewrite_paths(self.fixture, command) + '\n'
+        proc = subprocess.Popen(
+            ['sh', '-c', script],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL,
+            cwd=self.fixture.get('root') or None
+        )
+        try:
+            for chunk in iter(lambda: proc.stdout.read1(65536), b''):
+                self.send_data(restore_paths(self.fixture, chunk))
+        except OSError:
+            proc.kill()
+        proc.wait()
+
+    def sync_loop(self):
+        while True:
+            command_id, length = struct.unpack('<4sI', self.read_exact(8))
+            if command_id == b'QUIT':
+                return
+            data = self.read_exact(length).decode('utf-8')
+            handler = getattr(self, f'sync_{command_id.decode().lower()}', None)
+            if handler is None:
+                return
+            self.link.delay()
+            handler(data)
+
+    def local(self, remote_path):
+        return device_path(self.fixture, remote_path)
+
+    def sync_stat(self, remote_path):
+        try:
+            st = os.stat(self.local(remote_path))
+            self.request.sendall(b'STAT' + struct.pack('<III', st.st_mode, st.st_size & 0xffffffff, int(st.st_mtime)))
+        except OSError:
+            self.request.sendall(b'STAT' + struct.pack('<III', 0, 0, 0))
+
+    def sync_sta2(self, remote_path):
+        try:
+            st = os.stat(self.local(remote_path))
+            self.request.sendall(b'STA2' + struct.pack(
+                '<IQQIIIIQqqq', 0, st.st_dev, st.st_ino, st.st_mode, st.st_nlink,
+                st.st_uid, st.st_gid, st.st_size, int(st.st_atime), int(st.st_mtime), int(st.st_ctime)))
+        except OSError as e:
+            self.request.sendall(b'STA2' + struct.pack('<IQQIIIIQqqq', e.errno or 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+
+    def _list_entries(self, remote_path):
+        directory = self.local(remote_path)
+        try:
+            names = ['.', '..'] + sorted(os.listdir(directory))
+        except OSError:
+            return
+        for name in names:
+            try:
+                yield name, os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+
+    def sync_list(self, remote_path):
+        for name, st in self._list_entries(remote_path):
+            encoded = name.encode('utf-8')
+            self.request.sendall(b'DENT' + struct.pack(
+                '<IIII', st.st_mode, st.st_size & 0xffffffff, int(st.st_mtime), len(encoded)) + encoded)
+        self.request.sendall(b'DONE' + struct.pack('<IIII', 0, 0, 0, 0))
+
+    def sync_lis2(self, remote_path):
+        for name, st in self._list_entries(remote_path):
+            encoded = name.encode('utf-8')
+            self.request.sendall(b'DNT2' + struct.pack(
+                '<IQQIIIIQqqqI', 0, st.st_dev, st.st_ino, st.st_mode, st.st_nlink, st.st_uid, st.st_gid,
+                st.st_size, int(st.st_atime), int(st.st_mtime), int(st.st_ctime), len(encoded)) + encoded)
+        self.request.sendall(b'DONE' + bytes(72))
+
+    def sync_recv(self, remote_path):
+        try:
+            f = open(self.local(remote_path), 'rb')
+        except OSError as e:
+            message = str(e).encode('utf-8')
+            self.request.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+            return
+        with f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                self.send_data(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+        self.request.sendall(b'DONE' + struct.pack('<I', 0))
+
+    def sync_send(self, spec):
+        remote_path, _, mode = spec.rpartition(',')
+        target = self.local(remote_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            while True:
+                command_id, length = struct.unpack('<4sI', self.read_exact(8))
+                if command_id == b'DONE':
+                    mtime = length
+                    break
+                f.write(self.read_exact(length))
+                self.link.pace(length)
+        os.chmod(target, stat.S_IMODE(int(mode or 0o644)))
+        if mtime:
+            os.utime(target, (mtime, mtime))
+        self.request.sendall(b'OKAY' + struct.pack('<I', 0))
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟 adb server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037)))
+    args = parser.parse_args()
+
+    with FakeAdbServer((args.host, args.port), FakeAdbHandler) as server:
+        print(f'fake adb server listening on {args.host}:{args.port}')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+模拟 ffmpeg 可执行文件，用于在没有 ffmpeg 的环境中测量缩略图、实时画面和HLS预览的调度开销
+用法: 在PATH靠前的目录中创建名为 ffmpeg 的链接指向本文件（tools/bench_server.py 会自动完成）
+      FAKE_FFMPEG_DELAY 为每次转码（HLS为每个分段）的模拟耗时，单位为秒（默认0.05）
+      FAKE_FFMPEG_DURATION 为探测和HLS转码时假定的媒体时长，单位为秒（默认60）
+读取 -i 指定的输入（pipe:0 时读取标准输入，http地址时读取开头的一段），等待模拟耗时后输出一个最小的JPEG（libwebp时为WebP）；
+没有输出参数时按 ffmpeg -i 的格式在错误输出中打印媒体信息；-f hls 时按 -hls_time 逐个输出分段
+"""
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+# SOI + EOI，足以让服务端按 image/jpeg 返回
+FAKE_JPEG = b'\xff\xd8\xff\xd9'
+# 只有RIFF/WEBP文件头
+FAKE_WEBP = b'RIFF\x04\x00\x00\x00WEBP'
+# 一个MPEG-TS空包
+FAKE_TS_PACKET = b'\x47\x1f\xff\x10' + b'\xff' * 184
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.flac', '.wav', '.ogg')
+
+
+def option(argv, name, default=None):
+    return argv[argv.index(name) + 1] if name in argv and argv.index(name) + 1 < len(argv) else default
+
+
+def source_name(source):
+    """输入的文件名（http地址取 file_path 参数的文件名），用于判断是否为音频"""
+    if source.startswith(('http://', 'https://')):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(source).query)
+        return os.path.basename(query.get('file_path', [''])[0])
+    return os.path.basename(source)
+
+
+def read_input(source):
+    """读取输入，返回是否成功"""
+    if source == 'pipe:0':
+        sys.stdin.buffer.read()
+    elif source.startswith(('http://', 'https://')):
+        try:
+            with urllib.request.urlopen(source, timeout=30) as response:
+                response.read(64 * 1024)
+        except OSError as e:
+            print(f'{source}: {e}', file=sys.stderr)
+            return False
+    elif not os.path.exists(source):
+        print(f'{source}: No such file or directory', file=sys.stderr)
+        return False
+    return True
+
+
+def write_hls(argv, duration, delay):
+    segment_time = float(option(argv, '-hls_time', 2))
+    index = int(option(argv, '-start_number', 0))
+    pattern = option(argv, '-hls_segment_filename')
+    while index * segment_time < duration:
+        time.sleep(delay)
+        target = pattern % index
+        # 与 -hls_flags temp_file 一致：写完后才重命名为分段文件名
+        with open(target + '.tmp', 'wb') as f:
+            f.write(FAKE_TS_PACKET * 64)
+        os.replace(target + '.tmp', target)
+        index += 1
+
+
+def main(argv):
+    if '-i' not in argv or argv.index('-i') + 1 >= len(argv):
+        print('fake ffmpeg: missing input', file=sys.stderr)
+        return 1
+    source = argv[argv.index('-i') + 1]
+    if not read_input(source):
+        return 1
+
+    delay = float(os.environ.get('FAKE_FFMPEG_DELAY', 0.05))
+    duration = float(os.environ.get('FAKE_FFMPEG_DURATION', 60))
+    if argv[-1] == source:
+        minutes, seconds = divmod(duration, 60)
+        print(f'Input #0, from \'{source}\':\n  Duration: {int(minutes // 60):02d}:{int(minutes % 60):02d}:{seconds:05.2f}, '
+              f'start: 0.000000, bitrate: 2000 kb/s', file=sys.stderr)
+        if not source_name(source).lower().endswith(AUDIO_EXTENSIONS):
+            print('  Stream #0:0: Video: h264 (High), yuv420p, 1920x1080, 30 fps', file=sys.stderr)
+        print('  Stream #0:1: Audio: aac (LC), 48000 Hz, stereo', file=sys.stderr)
+        print('At least one output file must be specified', file=sys.stderr)
+        return 1
+    if option(argv, '-f') == 'hls':
+        write_hls(argv, duration, delay)
+        return 0
+
+    time.sleep(delay)
+    target = argv[-1]
+    image = FAKE_WEBP if option(argv, '-c:v') == 'libwebp' else FAKE_JPEG
+    if target == 'pipe:1':
+        sys.stdout.buffer.write(image)
+    else:
+        with open(target, 'wb') as f:
+            f.write(image)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
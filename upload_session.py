@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(RuntimeError):
+    """上传会话状态不允许当前操作"""
+
+
+class UploadCancelled(Exception):
+    """上传会话已取消"""
+
+
+class UploadSession:
+    """
+    一次分块上传：数据按偏移写入，乱序到达的块暂存内存，按顺序交给后台线程直接写入设备
+    本地不保存文件副本；HTTP连接中断后可以按 received 偏移继续上传
+    """
+
+    def __init__(self, device_id, remote_path, size, mtime, max_buffer_bytes):
+        self.upload_id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.remote_path = remote_path
+        self.size = size
+        self.mtime = mtime
+        self.max_buffer_bytes = max_buffer_bytes
+        self.state = 'uploading'
+        self.error = None
+        self.received = 0 # 已按顺序接收的字节数（下一个需要的偏移）
+        self.written = 0 # 已写入设备的字节数
+        self.created_at = time.time()
+        self.last_activity = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._pending = {}
+        self._pending_bytes = 0
+
+    def start(self, push, on_complete=None):
+        """启动后台写入线程，push: (device_id, chunks, remote_path, mtime) -> None"""
+        def run():
+            try:
+                push(self.device_id, self._chunks(), self.remote_path, self.mtime)
+            except UploadCancelled:
+                self._finish('cancelled')
+            except Exception as e:
+                if self._finish('failed', str(e)):
+                    logger.error(f"上传失败: {self.device_id} {self.remote_path} - {e}")
+            else:
+                if self._finish('completed'):
+                    logger.info(f"上传完成: {self.device_id} {self.remote_path} {self.size} 字节")
+                    if on_complete:
+                        on_complete(self)
+
+        threading.Thread(target=run, name=f'upload-{self.upload_id[:8]}', daemon=True).start()
+
+    def _finish(self, state, error=None):
+        """结束会话，返回是否由本次调用改变了状态"""
+        with self._cond:
+            changed = self.state == 'uploading'
+            if changed:
+                self.state = state
+                self.error = error
+            self._queue.clear()
+            self._pending.clear()
+            self._queued_bytes = self._pending_bytes = 0
+            self._cond.notify_all()
+            return changed
+
+    def _chunks(self):
+        """按顺序输出已接收的数据，全部接收后结束"""
+        while True:
+            with self._cond:
+                while not self._queue and self.state == 'uploading' and self.received < self.size:
+                    self._cond.wait()
+                if self.state != 'uploading':
+                    raise UploadCancelled(self.upload_id)
+                if not self._queue:
+                    return
+                chunk = self._queue.popleft()
+                self._queued_bytes -= len(chunk)
+                self._cond.notify_all()
+            yield chunk
+            with self._cond:
+                self.written += len(chunk)
+                self._cond.notify_all()
+
+    def write(self, offset, data, timeout=60):
+        """
+        写入从offset开始的数据；已接收过的部分会被忽略（重试是幂等的）
+        超前的数据在缓冲额度内暂存，否则等待前面的数据到达
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.last_activity = time.monotonic()
+            if offset + len(data) > self.size:
+                raise UploadError(f"数据超出文件大小: {offset + len(data)} > {self.size}")
+            while True:
+                self._check_active()
+                if offset <= self.received:
+                    break
+                if offset not in self._pending and self._pending_bytes + len(data) <= self.max_buffer_bytes:
+                    self._pending[offset] = data
+                    self._pending_bytes += len(data)
+                    return
+                if not self._cond.wait(deadline - time.monotonic()):
+                    raise UploadError(f"等待偏移 {self.received} 的数据超时")
+            self._append(offset, data, deadline)
+            while self._pending:
+                start = min(self._pending)
+                if start > self.received:
+                    break
+                data = self._pending.pop(start)
+                self._pending_bytes -= len(data)
+                self._append(start, data, deadline)
+            self.last_activity = time.monotonic()
+
+    def _append(self, offset, data, deadline):
+        data = data[self.received - offset:]
+        if not data:
+            return
+        # 设备写入跟不上时等待，限制内存中排队的数据量
+        while self._queued_bytes and self._queued_bytes + len(data) > self.max_buffer_bytes:
+            if not self._cond.wait(deadline - time.monotonic()):
+                raise UploadError("等待写入设备超时")
+            self._check_active()
+        self._queue.append(data)
+        self._queued_bytes += len(data)
+        self.received += len(data)
+        self._cond.notify_all()
+
+    def _check_active(self):
+        if self.state != 'uploading':
+            raise UploadError(f"上传会话已结束: {self.state}")
+
+    def wait(self, timeout=None):
+        """等待全部数据写入设备，返回最终状态"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.state != 'uploading', timeout)
+            return self.state
+
+    def cancel(self):
+        self._finish('cancelled')
+
+    def status(self):
+        with self._cond:
+            return {
+                'upload_id': self.upload_id,
+                'device_id': self.device_id,
+                'remote_path': self.remote_path,
+                'size': self.size,
+                'received': self.received,
+                'written': self.written,
+                'buffered': self._queued_bytes + self._pending_bytes,
+                'pending_offsets': sorted(self._pending),
+                'progress': round(self.written / self.size * 100, 2) if self.size else 100.0,
+                'state': self.state,
+                'error': self.error
+            }
+
+
+class UploadManager:
+    """管理进行中的上传会话，长时间没有数据的会话会被取消"""
+
+    def __init__(self, push, max_buffer_bytes, idle_timeout=600, keep_finished=300, on_complete=None):
+        self.push = push
+        self.max_buffer_bytes = max_buffer_bytes
+        self.idle_timeout = idle_timeout
+        self.keep_finished = keep_finished
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def create(self, device_id, remote_path, size, mtime=0):
+        self._reap()
+        session = UploadSession(device_id, remote_path, size, mtime, self.max_buffer_bytes)
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        session.start(self.push, self.on_complete)
+        logger.info(f"创建上传会话: {session.upload_id} {device_id} {remote_path} {size} 字节")
+        return session
+
+    def get(self, upload_id):
+        self._reap()
+        with self._lock:
+            return self._sessions.get(upload_id)
+
+    def list(self):
+        self._reap()
+        with self._lock:
+            return list(self._sessions.values())
+
+    def _reap(self):
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for upload_id, session in sessions:
+            idle = now - session.last_activity
+            if session.state == 'uploading' and idle > self.idle_timeout:
+                logger.info(f"上传会话超时取消: {upload_id}")
+                session.cancel()
+            elif session.state != 'uploading' and idle > self.keep_finished:
+                with self._lock:
+                    self._sessions.pop(upload_id, None)
+
+    def cancel_all(self):
+        for session in self.list():
+            session.cancel()